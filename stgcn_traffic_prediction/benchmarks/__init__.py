@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+/*******************************************
+** license
+********************************************/
+"""
\ No newline at end of file
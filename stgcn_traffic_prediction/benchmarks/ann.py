@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.dataloader.milano_crop import read_h5
+from stgcn_traffic_prediction.dataloader.generate_synthetic_data import generate
+from stgcn_traffic_prediction.models.ann import IVFIndex
+from stgcn_traffic_prediction.models.utils import history_topk
+
+'''
+recall of the IVFIndex top-k against the exact top-k over the same history,
+with build, per-hour update and search times, e.g.
+python ann.py --height 100 --width 100 --hours 1008 --nprobe 2 8 --window 0 336 1008 --json ann.json
+(synthetic data unless --data points at an h5 file)
+'''
+
+
+def recall(found, exact):
+    k = exact.shape[-1]
+    return float((found.unsqueeze(-1) == exact.unsqueeze(-2)).any(-1).sum()) / exact.numel() if k else 1.
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, default=None, help='h5 file, default a synthetic grid')
+    parser.add_argument('--traffic', type=str, default='internet')
+    parser.add_argument('--height', type=int, default=100)
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--hours', type=int, default=1008, help='history length (1008 = 6 weeks)')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--mode', type=str, default='corr', choices=['corr', 'cos'])
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[2, 8])
+    parser.add_argument('--window', type=int, nargs='+', default=[0, 336], help='hours kept for exact rescoring, 0 for none')
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    if args.data is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = generate(os.path.join(tmp, 'synthetic.h5'), args.hours, args.height, args.width)
+            data = read_h5(path, 1, args.traffic)
+    else:
+        data = read_h5(args.data, 1, args.traffic)[-args.hours:]
+    data = torch.from_numpy(np.ascontiguousarray(data)).float()
+    N = data.shape[-1]
+
+    start = time.perf_counter()
+    exact = history_topk(data, args.k, args.mode)
+    exact_s = time.perf_counter() - start
+    results = []
+    for window in args.window:
+        index = IVFIndex(N, args.dim, args.nlist, mode=args.mode, window=window or None)
+        start = time.perf_counter()
+        index.update(data[:-1]).train()
+        build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        index.update(data[-1:])
+        update_s = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            start = time.perf_counter()
+            found = index.search(args.k, nprobe=nprobe)
+            search_s = time.perf_counter() - start
+            results.append({'window': window, 'nprobe': nprobe, 'build_s': build_s, 'update_ms': 1000 * update_s,
+                            'search_s': search_s, 'speedup': exact_s / search_s, 'recall': recall(found, exact)})
+
+    print('exact top-{} of {} cells over {} hours: {:.3f} s'.format(args.k, N, len(data), exact_s))
+    print('{:>7} {:>7} {:>9} {:>11} {:>10} {:>9} {:>8}'.format('window', 'nprobe', 'build(s)', 'update(ms)',
+                                                             'search(s)', 'speedup', 'recall'))
+    for r in results:
+        print('{:>7d} {:>7d} {:>9.2f} {:>11.2f} {:>10.3f} {:>8.1f}x {:>8.3f}'.format(
+            r['window'], r['nprobe'], r['build_s'], r['update_ms'], r['search_s'], r['speedup'], r['recall']))
+    if args.json:
+        # host and version info so runs can be compared over time
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'host': platform.node(), 'threads': args.threads, 'args': vars(args),
+                       'exact_s': exact_s, 'results': results}, f, indent=2)
@@ -0,0 +1,51 @@
+import sys
+import json
+import argparse
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.models.model import forward_batch
+from stgcn_traffic_prediction.benchmarks.utils import bench_opt,synthetic_batch,build_model,train_step,timeit,peak_memory,saved_activation_mb,isolated
+
+'''
+peak training memory and throughput with activation recompute switched on
+per branch, e.g. python checkpoint.py --nodes 400 --batch_size 8
+'''
+
+BRANCHES = [[], ['spatial'], ['p_temporal'], ['spatial_f'], ['spatial', 'p_temporal', 'spatial_f']]
+
+
+def run(args, branches):
+    torch.manual_seed(0)
+    opt = bench_opt('-model_N', str(args.model_N), '-s_model_d', str(args.model_d),
+                    '-p_model_d', str(args.model_d))
+    model = build_model(opt, checkpoint=branches)
+    batch = synthetic_batch(args.batch_size, args.nodes)
+    model.train()
+    activations, _ = saved_activation_mb(lambda: forward_batch(model, batch, opt))
+    if torch.cuda.is_available():
+        model = model.cuda()
+    with peak_memory() as memory:
+        times = timeit(lambda: train_step(model, batch, opt), args.iters)
+    return {'checkpoint': branches, 'activation_mb': activations, 'peak_mb': memory['peak_mb'], 'step_ms': 1000 * float(np.mean(times)),
+            'samples_per_s': args.batch_size / float(np.mean(times))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=400)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--model_N', type=int, default=6)
+    parser.add_argument('--model_d', type=int, default=64)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    results = [isolated(run, args, branches) for branches in BRANCHES]
+    print('{:<40} {:>16} {:>10} {:>10} {:>12}'.format('checkpoint', 'activations(MB)', 'peak(MB)', 'step(ms)', 'samples/s'))
+    for r in results:
+        print('{:<40} {:>16.1f} {:>10.1f} {:>10.1f} {:>12.2f}'.format(','.join(r['checkpoint']) or 'none', r['activation_mb'],
+                                                                     r['peak_mb'], r['step_ms'], r['samples_per_s']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
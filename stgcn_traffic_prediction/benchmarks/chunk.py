@@ -0,0 +1,46 @@
+import sys
+import json
+import argparse
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.models.model import forward_batch
+from stgcn_traffic_prediction.benchmarks.utils import bench_opt,synthetic_batch,build_model,timeit,peak_memory,isolated
+
+'''
+peak inference memory of the full forward vs node-chunked execution as N grows,
+e.g. python chunk.py --nodes 400 1600 3600 --chunk 256
+'''
+
+
+def run(args, N, chunk_size):
+    torch.manual_seed(0)
+    opt = bench_opt('-model_N', str(args.model_N), '-s_model_d', str(args.model_d),
+                    '-p_model_d', str(args.model_d))
+    model = build_model(opt, chunk_size=chunk_size).eval()
+    batch = synthetic_batch(args.batch_size, N)
+    if torch.cuda.is_available():
+        model = model.cuda()
+    with peak_memory() as memory, torch.no_grad():
+        times = timeit(lambda: forward_batch(model, batch, opt), args.iters)
+    return {'nodes': N, 'chunk': chunk_size, 'peak_mb': memory['peak_mb'], 'forward_ms': 1000 * float(np.mean(times))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, nargs='+', default=[400, 1600, 3600])
+    parser.add_argument('--chunk', type=int, default=256)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--model_N', type=int, default=2)
+    parser.add_argument('--model_d', type=int, default=64)
+    parser.add_argument('--iters', type=int, default=2)
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    results = [isolated(run, args, N, chunk) for N in args.nodes for chunk in (None, args.chunk)]
+    print('{:>8} {:>8} {:>10} {:>12}'.format('nodes', 'chunk', 'peak(MB)', 'forward(ms)'))
+    for r in results:
+        print('{:>8d} {:>8} {:>10.1f} {:>12.1f}'.format(r['nodes'], str(r['chunk']), r['peak_mb'], r['forward_ms']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import time
+import argparse
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader,TensorDataset
+from torch.utils.data.distributed import DistributedSampler
+sys.path.append('../../')
+from stgcn_traffic_prediction.benchmarks.utils import bench_opt,synthetic_batch,build_model
+from stgcn_traffic_prediction.utils.distributed import init_distributed,cleanup
+from stgcn_traffic_prediction.utils.lr_scheduler import LR_Scheduler
+from stgcn_traffic_prediction.utils.trainer import Trainer
+
+'''
+CPU data-parallel scaling of Trainer.train_epoch with the gloo backend on
+synthetic data: the global dataset is fixed and sharded over 1..P processes,
+the cores are split evenly between them,
+e.g. python ddp.py --procs 1 2 4 8 --samples 512
+'''
+
+
+def worker(rank, world_size, args, port, results):
+    os.environ['LOCAL_WORLD_SIZE'] = str(world_size)
+    init_distributed('gloo', 'tcp://127.0.0.1:{}'.format(port), rank, world_size)
+    torch.manual_seed(0)
+    opt = bench_opt('-model_N', str(args.model_N), '-s_model_d', str(args.model_d), '-p_model_d', str(args.model_d),
+                    '-batch_size', str(args.batch_size), '-telemetry_every', '0', '-warmup', '0')
+    data = TensorDataset(*synthetic_batch(args.samples, args.nodes))
+    loader = DataLoader(data, batch_size=opt.batch_size, sampler=DistributedSampler(data, world_size, rank),
+                        drop_last=True)
+    trainer = Trainer(opt, build_model(opt), loader, device=torch.device('cpu'))
+    trainer.scheduler = LR_Scheduler(opt.lr_scheduler, trainer.lr, args.epochs + 1, len(loader))
+    trainer.train_epoch(0)
+    start = time.perf_counter()
+    for epoch in range(1, args.epochs + 1):
+        trainer.train_epoch(epoch)
+    elapsed = time.perf_counter() - start
+    if rank == 0:
+        results.put({'procs': world_size, 'threads': torch.get_num_threads(), 'epoch_s': elapsed / args.epochs,
+                     'samples_per_s': args.epochs * len(loader) * opt.batch_size * world_size / elapsed})
+    cleanup()
+
+
+def run(args, world_size, port):
+    results = mp.get_context('spawn').SimpleQueue()
+    mp.spawn(worker, args=(world_size, args, port, results), nprocs=world_size)
+    return results.get()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--procs', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--samples', type=int, default=512, help='synthetic windows in the global dataset')
+    parser.add_argument('--nodes', type=int, default=400)
+    parser.add_argument('--batch_size', type=int, default=8, help='per process')
+    parser.add_argument('--model_N', type=int, default=2)
+    parser.add_argument('--model_d', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=1, help='timed epochs after one warmup epoch')
+    parser.add_argument('--port', type=int, default=29533)
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    results = [run(args, P, args.port + i) for i, P in enumerate(args.procs)]
+    base = results[0]['samples_per_s'] / results[0]['procs']
+    print('{:>6} {:>8} {:>10} {:>12} {:>9} {:>11}'.format('procs', 'threads', 'epoch(s)', 'samples/s', 'speedup',
+                                                         'efficiency'))
+    for r in results:
+        r['speedup'] = r['samples_per_s'] / base
+        r['efficiency'] = r['speedup'] / r['procs']
+        print('{:>6d} {:>8d} {:>10.2f} {:>12.1f} {:>9.2f} {:>11.2f}'.format(r['procs'], r['threads'], r['epoch_s'],
+                                                                          r['samples_per_s'], r['speedup'],
+                                                                          r['efficiency']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
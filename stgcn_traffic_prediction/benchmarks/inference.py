@@ -0,0 +1,73 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.models.model import forward_batch
+from stgcn_traffic_prediction.benchmarks.utils import bench_opt,synthetic_batch,build_model,timeit,peak_memory,isolated
+
+'''
+T_STGCN inference latency over a batch size x nodes x k grid: warmup calls
+first, then timed calls under inference_mode (synchronized on cuda), each
+configuration in a fresh process so the peak memory is its own, e.g.
+python inference.py --batch_size 1 8 32 --nodes 400 1600 --k 3 --json inference.json
+'''
+
+
+def run(args, bs, N, k):
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    opt = bench_opt('-k', str(k), '-model_N', str(args.model_N), '-s_model_d', str(args.model_d),
+                    '-p_model_d', str(args.model_d))
+    result = {'batch_size': bs, 'nodes': N, 'k': k}
+    model = build_model(opt, chunk_size=args.chunk).eval()
+    batch = synthetic_batch(bs, N)
+    if torch.cuda.is_available():
+        model = model.cuda()
+        batch = [x.cuda() for x in batch]
+    try:
+        with peak_memory() as memory, torch.inference_mode():
+            times = timeit(lambda: forward_batch(model, batch, opt), args.iters, args.warmup)
+    except RuntimeError as e:
+        # not every k fits the MUSE attention shapes
+        result['error'] = str(e).split('\n')[0]
+        return result
+    ms = 1000 * times
+    result.update({'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+                   'p99_ms': float(np.percentile(ms, 99)), 'mean_ms': float(ms.mean()),
+                   'samples_per_s': bs * len(times) / float(times.sum()), 'peak_mb': memory['peak_mb']})
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--nodes', type=int, nargs='+', default=[400, 1600])
+    parser.add_argument('--k', type=int, nargs='+', default=[3])
+    parser.add_argument('--model_N', type=int, default=2)
+    parser.add_argument('--model_d', type=int, default=64)
+    parser.add_argument('--chunk', type=int, default=None, help='node chunk size of top-k and node attention')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iters', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    results = [isolated(run, args, bs, N, k) for N in args.nodes for k in args.k for bs in args.batch_size]
+    print('{:>6} {:>6} {:>4} {:>10} {:>10} {:>10} {:>12} {:>10}'.format('bs', 'nodes', 'k', 'p50(ms)', 'p95(ms)',
+                                                                       'p99(ms)', 'samples/s', 'peak(MB)'))
+    for r in results:
+        if 'error' in r:
+            print('{:>6d} {:>6d} {:>4d} {}'.format(r['batch_size'], r['nodes'], r['k'], r['error']))
+            continue
+        print('{:>6d} {:>6d} {:>4d} {:>10.2f} {:>10.2f} {:>10.2f} {:>12.1f} {:>10.1f}'.format(
+            r['batch_size'], r['nodes'], r['k'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['samples_per_s'], r['peak_mb']))
+    if args.json:
+        # host and version info so runs can be compared over time
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'host': platform.node(), 'device': 'cuda' if torch.cuda.is_available() else 'cpu',
+                       'threads': args.threads, 'args': vars(args), 'results': results}, f, indent=2)
@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.dataloader.milano_crop import read_h5
+from stgcn_traffic_prediction.dataloader.generate_synthetic_data import generate
+from stgcn_traffic_prediction.dataloader.ordering import ORDERS,cell_order,inverse
+from stgcn_traffic_prediction.models.utils import history_topk
+from stgcn_traffic_prediction.utils.tiling import tiles
+from stgcn_traffic_prediction.benchmarks.utils import timeit
+
+'''
+memory locality of the row-major, Z-order and Hilbert cell orders: how far
+apart (in columns) grid neighbours and top-k correlated neighbours are, how
+many grid edges a node chunk keeps, how many contiguous runs a tile is made
+of, and the time of the top-k neighbour gather, e.g.
+python ordering.py --height 100 --width 100 --chunk 256 1024 --tile 20 --json ordering.json
+'''
+
+
+def grid_edges(height, width):
+    ids = np.arange(height * width).reshape(height, width)
+    return np.concatenate([np.stack([ids[:, :-1].ravel(), ids[:, 1:].ravel()], 1),
+                           np.stack([ids[:-1].ravel(), ids[1:].ravel()], 1)])
+
+
+def run(args, kind, edges, topk, series):
+    order = cell_order(kind, args.height, args.width)
+    position = inverse(order)
+    e = position[edges]
+    k = position[np.repeat(np.arange(len(topk)), topk.shape[1])], position[topk.ravel()]
+    result = {'order': kind, 'grid_distance': float(np.median(np.abs(e[:, 0] - e[:, 1]))),
+              'topk_distance': float(np.median(np.abs(k[0] - k[1])))}
+    for chunk in args.chunk:
+        result['chunk_{}_edges'.format(chunk)] = float(np.mean(e[:, 0] // chunk == e[:, 1] // chunk))
+    runs = [int((np.diff(np.sort(core.numpy())) != 1).sum()) + 1
+            for core, _ in tiles(args.height, args.width, args.tile, 0, None if kind == 'row' else order)]
+    result['runs_per_tile'] = float(np.mean(runs))
+    # gather of every cell's top-k features, as Spatial/close do, with the columns in this order
+    x = torch.from_numpy(np.ascontiguousarray(series[:, order].T)).float().unsqueeze(0).expand(args.batch_size, -1, -1)
+    x = x[..., :args.features].contiguous()
+    index = torch.from_numpy(position[topk[order]]).unsqueeze(0).expand(args.batch_size, -1, -1)
+    flat = index.reshape(args.batch_size, -1, 1).expand(-1, -1, x.shape[-1])
+    ms = 1000 * timeit(lambda: x.gather(1, flat), args.iters, 2)
+    result['gather_ms'] = float(np.median(ms))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, default=None, help='h5 file, default a synthetic grid')
+    parser.add_argument('--traffic', type=str, default='internet')
+    parser.add_argument('--height', type=int, default=100)
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--hours', type=int, default=336)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--chunk', type=int, nargs='+', default=[256, 1024], help='node chunk sizes')
+    parser.add_argument('--tile', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--features', type=int, default=64, help='hours of features gathered per neighbour')
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    if args.data is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = generate(os.path.join(tmp, 'synthetic.h5'), args.hours, args.height, args.width)
+            series = read_h5(path, 1, args.traffic)[:, 0]
+    else:
+        series = read_h5(args.data, 1, args.traffic)[-args.hours:, 0]
+    topk = history_topk(series[:, None], args.k, 'corr').numpy()
+    edges = grid_edges(args.height, args.width)
+    results = [run(args, kind, edges, topk, series) for kind in ORDERS]
+
+    chunks = ['chunk_{}_edges'.format(c) for c in args.chunk]
+    print('{:>8} {:>10} {:>10} {} {:>10} {:>11}'.format('order', 'grid dist', 'top-k dist',
+                                                        ' '.join('{:>14}'.format('edges in ' + str(c)) for c in args.chunk),
+                                                        'runs/tile', 'gather(ms)'))
+    for r in results:
+        print('{:>8} {:>10.0f} {:>10.0f} {} {:>10.1f} {:>11.3f}'.format(
+            r['order'], r['grid_distance'], r['topk_distance'], ' '.join('{:>14.3f}'.format(r[c]) for c in chunks),
+            r['runs_per_tile'], r['gather_ms']))
+    if args.json:
+        # host and version info so runs can be compared over time
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'host': platform.node(), 'args': vars(args), 'results': results}, f, indent=2)
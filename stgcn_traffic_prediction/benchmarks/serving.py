@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.dataloader.generate_synthetic_data import generate
+from stgcn_traffic_prediction.dataloader.store import build_store,open_store
+from stgcn_traffic_prediction.models.MinMaxNorm import MinMaxNorm01
+from stgcn_traffic_prediction.utils.serving import Forecaster,MicroBatcher,ForecastServer
+from stgcn_traffic_prediction.benchmarks.utils import bench_opt,build_model
+
+'''
+load test of the forecast server over localhost: closed-loop clients (one
+keep-alive connection each) send forecast requests for random hours and
+cells, and the client-side latency, throughput and the server's mean batch
+size are reported per batching setting and concurrency. Without --port a
+server with a random model over a synthetic grid is started per setting, e.g.
+python serving.py --height 20 --width 20 --max_batch 1 32 --concurrency 1 8 32 --json serving.json
+python serving.py --port 8080 --concurrency 8 32
+'''
+
+
+def _serve(path, args, max_batch, ready):
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    opt = bench_opt('-model_N', str(args.model_N), '-s_model_d', str(args.model_d), '-p_model_d', str(args.model_d))
+    data = open_store(build_store(path, opt.nb_flow, opt.traffic))
+    mmn = MinMaxNorm01()
+    mmn.fit(data)
+    forecaster = Forecaster(build_model(opt), opt, mmn, data, replicas=args.serve_threads)
+
+    async def run():
+        server = await ForecastServer(MicroBatcher(forecaster, max_batch, args.max_wait_ms, args.serve_threads),
+                                      '127.0.0.1', 0).start()
+        ready.put(server.port)
+        await server.serve_forever()
+    asyncio.run(run())
+
+
+async def _call(reader, writer, method, path, payload=None):
+    body = b'' if payload is None else json.dumps(payload).encode()
+    writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+                 .format(method, path, len(body)).encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, value = line.decode().split(':', 1)
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def get(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    _, out = await _call(reader, writer, 'GET', path)
+    writer.close()
+    return out
+
+
+async def load(port, concurrency, requests, first, last, cells, n_cells):
+    "closed loop: `concurrency` clients share `requests` requests, returns the latencies (ms) and the wall time"
+    latencies, errors = [], 0
+    remaining = [requests]
+
+    async def client(seed):
+        nonlocal errors
+        rng = random.Random(seed)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            query = {'timestamp': rng.randint(first, last)}
+            if cells:
+                query['cells'] = rng.sample(range(n_cells), cells)
+            start = time.perf_counter()
+            status, _ = await _call(reader, writer, 'POST', '/forecast', query)
+            latencies.append(1000 * (time.perf_counter() - start))
+            errors += status != 200
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(i) for i in range(concurrency)])
+    return np.array(latencies), time.perf_counter() - start, errors
+
+
+async def measure(args, port, max_batch):
+    health = await get(port, '/health')
+    results = []
+    for concurrency in args.concurrency:
+        before = await get(port, '/metrics')
+        ms, seconds, errors = await load(port, concurrency, args.requests, health['first'], health['last'],
+                                         args.cells, health['cells'])
+        after = await get(port, '/metrics')
+        batches = after['batches'] - before['batches']
+        results.append({'max_batch': max_batch, 'concurrency': concurrency, 'requests': len(ms), 'errors': errors,
+                        'req_per_s': len(ms) / seconds, 'p50_ms': float(np.percentile(ms, 50)),
+                        'p95_ms': float(np.percentile(ms, 95)), 'p99_ms': float(np.percentile(ms, 99)),
+                        'mean_batch': (after['requests'] - before['requests']) / batches if batches else None})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=None, help='load a running server instead of starting one')
+    parser.add_argument('--height', type=int, default=20)
+    parser.add_argument('--width', type=int, default=20)
+    parser.add_argument('--hours', type=int, default=336)
+    parser.add_argument('--model_N', type=int, default=2)
+    parser.add_argument('--model_d', type=int, default=64)
+    parser.add_argument('--max_batch', type=int, nargs='+', default=[1, 32], help='server batch limits to compare')
+    parser.add_argument('--max_wait_ms', type=float, default=5.)
+    parser.add_argument('--serve_threads', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=1, help='torch threads of the server')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='requests per concurrency level')
+    parser.add_argument('--cells', type=int, default=10, help='random cells per request, 0 asks for the whole grid')
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    if args.port is not None:
+        results = asyncio.run(measure(args, args.port, None))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = generate(os.path.join(tmp, 'synthetic.h5'), args.hours, args.height, args.width)
+            ctx = mp.get_context('spawn')
+            for max_batch in args.max_batch:
+                ready = ctx.Queue()
+                server = ctx.Process(target=_serve, args=(path, args, max_batch, ready), daemon=True)
+                server.start()
+                port = ready.get()
+                try:
+                    results += asyncio.run(measure(args, port, max_batch))
+                finally:
+                    server.terminate()
+                    server.join()
+
+    print('{:>9} {:>11} {:>9} {:>8} {:>9} {:>9} {:>9} {:>10}'.format('max_batch', 'concurrency', 'req/s', 'p50(ms)',
+                                                                     'p95(ms)', 'p99(ms)', 'errors', 'mean batch'))
+    for r in results:
+        print('{:>9} {:>11d} {:>9.1f} {:>8.1f} {:>9.1f} {:>9.1f} {:>9d} {:>10}'.format(
+            r['max_batch'] or '-', r['concurrency'], r['req_per_s'], r['p50_ms'], r['p95_ms'], r['p99_ms'],
+            r['errors'], '-' if r['mean_batch'] is None else '{:.1f}'.format(r['mean_batch'])))
+    if args.json:
+        # host and version info so runs can be compared over time
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'host': platform.node(), 'args': vars(args), 'results': results}, f, indent=2)
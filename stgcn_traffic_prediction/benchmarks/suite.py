@@ -0,0 +1,245 @@
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.dataloader.STMatrix import STMatrix
+from stgcn_traffic_prediction.dataloader.store import first_target
+from stgcn_traffic_prediction.models.MinMaxNorm import MinMaxNorm01
+from stgcn_traffic_prediction.models.utils import getA_corr,getA_cosin,topk_index
+from stgcn_traffic_prediction.models.transformer import attention,MUSEAttention,MUSEAttention1,MUSEAttention2
+from stgcn_traffic_prediction.models.spatial import Spatial
+from stgcn_traffic_prediction.pygcn.layers import GraphConvolution,SparseGraphConvolution
+from stgcn_traffic_prediction.benchmarks.utils import bench_opt,synthetic_batch,build_model,train_step,timeit
+
+'''
+microbenchmarks of the data pipeline and model hot spots over a nodes x
+batch size grid, with a regression check against a stored baseline, e.g.
+python suite.py --nodes 100 400 --batch_size 1 32 --json baseline.json
+python suite.py --nodes 100 400 --batch_size 1 32 --baseline baseline.json --tolerance 0.25
+exits with status 1 if a case got slower than its baseline by more than the tolerance
+'''
+
+# name -> (setup(args, bs, N) returning the timed callable, whether the case depends on the batch size)
+CASES = {}
+# cases too noisy for the default tolerance
+TOLERANCE = {'minmax_transform': 0.5, 'argsort_topk': 0.5}
+
+
+def case(name, batched=True):
+    def register(setup):
+        CASES[name] = (setup, batched)
+        return setup
+    return register
+
+
+def quiet(fn):
+    "some of the measured functions print their shapes"
+    def call():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return call
+
+
+def similarity_input(bs, N, close_size=3, nb_flow=1):
+    # bs*flow*N*closeness, as the model permutes x_c before the adjacency
+    return torch.rand(bs, nb_flow, N, close_size)
+
+
+@case('create_dataset', batched=False)
+def _create_dataset(args, bs, N):
+    # the window sizes train.py uses by default
+    opt = bench_opt()
+    first = first_target(opt.close_size, opt.period_size, opt.trend_size)
+    if args.hours <= first + opt.close_size:
+        raise ValueError('--hours {} leaves no window, close/period/trend sizes {}/{}/{} need more than {}'.format(
+            args.hours, opt.close_size, opt.period_size, opt.trend_size, first + opt.close_size))
+    data = np.random.rand(args.hours, 2, N).astype('float32')
+    st = STMatrix(data, list(range(args.hours)))
+    return quiet(lambda: st.create_dataset(len_closeness=opt.close_size, len_period=opt.period_size,
+                                           len_trend=opt.trend_size))
+
+
+@case('minmax_transform', batched=False)
+def _minmax(args, bs, N):
+    data = np.random.rand(args.hours, 2, N).astype('float32')
+    mmn = MinMaxNorm01()
+    quiet(lambda: mmn.fit(data))()
+    return lambda: mmn.transform(data)
+
+
+@case('getA_corr')
+def _corr(args, bs, N):
+    x = similarity_input(bs, N)
+    return lambda: getA_corr(x)
+
+
+@case('getA_cosin')
+def _cosin(args, bs, N):
+    x = similarity_input(bs, N)
+    return quiet(lambda: getA_cosin(x))
+
+
+@case('argsort_topk')
+def _argsort(args, bs, N):
+    A = torch.rand(bs, N, N)
+    return lambda: torch.argsort(A, dim=-1, descending=True)[:, :, 0:args.k]
+
+
+@case('topk_index')
+def _topk_index(args, bs, N):
+    x = similarity_input(bs, N)
+    return lambda: topk_index(x, args.k, 'corr', args.chunk or N)
+
+
+@case('Spatial')
+def _spatial(args, bs, N):
+    # neighbour gather and spatial transformer for a given top-k index. close.forward
+    # gathers the same way but does not fit the MUSE shapes (see bench_opt)
+    m = Spatial(3, args.k, N, args.model_d).eval()
+    c, p, _ = synthetic_batch(bs, N)
+    index = torch.randint(0, N, (bs, N, args.k))
+    return torch.no_grad()(lambda: m(c, p, 'c', 'corr', 0, index=index))
+
+
+@case('attention')
+def _attention(args, bs, N):
+    # node attention: h heads of d_k over the N nodes
+    q = torch.rand(bs, args.heads, N, args.model_d // args.heads)
+    return lambda: attention(q, q, q)
+
+
+@case('MUSEAttention')
+def _muse(args, bs, N):
+    m = MUSEAttention(args.model_d, args.model_d // args.heads, args.model_d // args.heads, args.heads).eval()
+    x = torch.rand(bs, N, 3, args.model_d)
+    return torch.no_grad()(lambda: m(x, x, x))
+
+
+@case('MUSEAttention1')
+def _muse1(args, bs, N):
+    m = MUSEAttention1(args.model_d, args.model_d // args.heads, args.model_d // args.heads, args.heads).eval()
+    x = torch.rand(bs, N, args.model_d)
+    return torch.no_grad()(lambda: m(x, x, x))
+
+
+@case('MUSEAttention2')
+def _muse2(args, bs, N):
+    m = MUSEAttention2(args.model_d, args.model_d // args.heads, args.model_d // args.heads, args.heads).eval()
+    q, x = torch.rand(bs, N, args.model_d), torch.rand(bs, N, 3, args.model_d)
+    return torch.no_grad()(lambda: m(q, x, x))
+
+
+@case('GraphConvolution')
+def _gcn(args, bs, N):
+    layer = GraphConvolution(3, 16)
+    x, adj = torch.rand(bs, N, 3), torch.rand(N, N)
+    return torch.no_grad()(lambda: layer(x, adj))
+
+
+@case('SparseGraphConvolution')
+def _sparse_gcn(args, bs, N):
+    layer = SparseGraphConvolution(3, 16)
+    x, index = torch.rand(bs, N, 3), torch.randint(0, N, (bs, N, args.k + 1))
+    weight = torch.softmax(torch.rand(bs, N, args.k + 1), dim=-1)
+    return torch.no_grad()(lambda: layer(x, index, weight))
+
+
+@case('train_step')
+def _train_step(args, bs, N):
+    opt = bench_opt('-model_N', str(args.model_N), '-s_model_d', str(args.model_d), '-p_model_d', str(args.model_d))
+    model = build_model(opt, chunk_size=args.chunk)
+    batch = synthetic_batch(bs, N)
+    return lambda: train_step(model, batch, opt)
+
+
+def run(args):
+    results = []
+    for name in sorted(CASES):
+        if args.cases and not any(c in name for c in args.cases):
+            continue
+        setup, batched = CASES[name]
+        for N in args.nodes:
+            for bs in (args.batch_size if batched else [None]):
+                torch.manual_seed(0)
+                np.random.seed(0)
+                fn = setup(args, bs, N)
+                ms = 1000 * timeit(fn, args.iters, args.warmup)
+                results.append({'case': name, 'batch_size': bs, 'nodes': N, 'median_ms': float(np.median(ms)),
+                                'iqr_ms': float(np.percentile(ms, 75) - np.percentile(ms, 25)), 'iters': args.iters})
+    return results
+
+
+def key(r):
+    return '{}/bs={}/N={}'.format(r['case'], r['batch_size'], r['nodes'])
+
+
+def compare(results, baseline, tolerance=0.25, min_ms=0.05):
+    '''
+    slowdown of every result against the baseline entry of the same case, batch
+    size and nodes. A case regresses if it is more than its tolerance slower and
+    the difference is above min_ms (timer noise of sub-0.1ms cases).
+    TOLERANCE only loosens the tolerance of its cases
+    '''
+    base = {key(r): r for r in baseline}
+    rows = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        ratio = r['median_ms'] / max(b['median_ms'], 1e-9)
+        tol = max(tolerance, TOLERANCE.get(r['case'], 0.))
+        rows.append({'key': key(r), 'baseline_ms': b['median_ms'], 'median_ms': r['median_ms'], 'ratio': ratio,
+                     'regression': ratio > 1 + tol and r['median_ms'] - b['median_ms'] > min_ms})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', type=str, nargs='*', default=None,
+                        help='only the cases whose name contains one of these, of: ' + ', '.join(sorted(CASES)))
+    parser.add_argument('--nodes', type=int, nargs='+', default=[100, 400])
+    parser.add_argument('--batch_size', type=int, nargs='+', default=[1, 32])
+    parser.add_argument('--hours', type=int, default=672, help='series length of the data pipeline cases')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--heads', type=int, default=8)
+    parser.add_argument('--model_N', type=int, default=2)
+    parser.add_argument('--model_d', type=int, default=64)
+    parser.add_argument('--chunk', type=int, default=None, help='node chunk size of top-k and node attention')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file (usable as a baseline)')
+    parser.add_argument('--baseline', type=str, default=None, help='results of an earlier --json run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--min_ms', type=float, default=0.05, help='ignore slowdowns smaller than this')
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    results = run(args)
+    print('{:<24} {:>6} {:>6} {:>12} {:>10}'.format('case', 'bs', 'nodes', 'median(ms)', 'iqr(ms)'))
+    for r in results:
+        print('{:<24} {:>6} {:>6d} {:>12.3f} {:>10.3f}'.format(r['case'], '-' if r['batch_size'] is None else r['batch_size'],
+                                                            r['nodes'], r['median_ms'], r['iqr_ms']))
+    if args.json:
+        # host and version info so runs can be compared over time
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'host': platform.node(), 'device': 'cuda' if torch.cuda.is_available() else 'cpu',
+                       'threads': args.threads, 'args': vars(args), 'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline['results'], args.tolerance, args.min_ms)
+        print('\n{:<44} {:>12} {:>12} {:>8}'.format('vs ' + args.baseline, 'baseline(ms)', 'now(ms)', 'ratio'))
+        for r in rows:
+            print('{:<44} {:>12.3f} {:>12.3f} {:>7.2f}x{}'.format(r['key'], r['baseline_ms'], r['median_ms'], r['ratio'],
+                                                                  '  REGRESSION' if r['regression'] else ''))
+        regressions = [r for r in rows if r['regression']]
+        print('{} of {} cases regressed'.format(len(regressions), len(rows)))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,69 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.models.model import forward_batch,forecast_cells
+from stgcn_traffic_prediction.models.utils import history_topk
+from stgcn_traffic_prediction.benchmarks.utils import bench_opt,synthetic_batch,build_model,timeit
+
+'''
+latency of forecast_cells against the full-grid forward for growing numbers
+of requested cells, and how far its outputs are from the full forward, e.g.
+python targeted.py --nodes 1600 --cells 10 100 400 --context 0 200 --json targeted.json
+'''
+
+
+def run(args, model, opt, batch, full, full_ms, cells, context, graph):
+    ids = torch.randperm(batch[0].shape[-1])[:cells]
+    with torch.inference_mode():
+        out = forecast_cells(model, batch, opt, ids, graph, context)
+        ms = 1000 * timeit(lambda: forecast_cells(model, batch, opt, ids, graph, context), args.iters, args.warmup)
+    diff = (out - full[..., ids]).abs()
+    return {'cells': cells, 'context': context, 'graph': 'cached' if graph is not None else 'per-sample',
+            'p50_ms': float(np.percentile(ms, 50)), 'speedup': full_ms / float(np.percentile(ms, 50)),
+            'max_abs_diff': float(diff.max()), 'mean_abs_diff': float(diff.mean())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=1600)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--cells', type=int, nargs='+', default=[10, 100, 400])
+    parser.add_argument('--context', type=int, nargs='+', default=[0, 200])
+    parser.add_argument('--cached_graph', action='store_true', help='also run with a static top-k graph')
+    parser.add_argument('--model_N', type=int, default=2)
+    parser.add_argument('--model_d', type=int, default=64)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    opt = bench_opt('-model_N', str(args.model_N), '-s_model_d', str(args.model_d), '-p_model_d', str(args.model_d))
+    model = build_model(opt).eval()
+    batch = synthetic_batch(args.batch_size, args.nodes)
+    with torch.inference_mode():
+        full = forward_batch(model, batch, opt)
+        full_ms = float(np.percentile(1000 * timeit(lambda: forward_batch(model, batch, opt), args.iters, args.warmup), 50))
+    graphs = [None] + ([history_topk(torch.rand(24 * 7, 1, args.nodes), opt.k, opt.mode)] if args.cached_graph else [])
+    results = [run(args, model, opt, batch, full, full_ms, c, ctx, g)
+               for g in graphs for ctx in args.context for c in args.cells if c <= args.nodes]
+
+    print('full grid ({} nodes): {:.2f} ms'.format(args.nodes, full_ms))
+    print('{:>7} {:>8} {:>11} {:>10} {:>9} {:>13} {:>14}'.format('cells', 'context', 'graph', 'p50(ms)', 'speedup',
+                                                                  'max|diff|', 'mean|diff|'))
+    for r in results:
+        print('{:>7d} {:>8d} {:>11} {:>10.2f} {:>8.1f}x {:>13.4f} {:>14.5f}'.format(
+            r['cells'], r['context'], r['graph'], r['p50_ms'], r['speedup'], r['max_abs_diff'], r['mean_abs_diff']))
+    if args.json:
+        # host and version info so runs can be compared over time
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'host': platform.node(), 'threads': args.threads, 'args': vars(args),
+                       'full_ms': full_ms, 'results': results}, f, indent=2)
@@ -0,0 +1,71 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.models.model import forward_batch
+from stgcn_traffic_prediction.utils.tiling import TiledExecutor
+from stgcn_traffic_prediction.benchmarks.utils import bench_opt,synthetic_batch,build_model,timeit
+
+'''
+throughput of tiled full-grid inference over worker counts and tile sizes,
+the speedup against one worker with the same tile, and (with --check) the
+distance to the untiled forward, e.g.
+python tiling.py --height 100 --width 100 --tile 20 50 --workers 1 2 4 --json tiling.json
+'''
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--height', type=int, default=100)
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--tile', type=int, nargs='+', default=[20, 50])
+    parser.add_argument('--halo', type=int, default=2)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=1, help='torch threads per worker')
+    parser.add_argument('--model_N', type=int, default=2)
+    parser.add_argument('--model_d', type=int, default=64)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--check', action='store_true', help='compare with the untiled forward (needs its memory)')
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    opt = bench_opt('-model_N', str(args.model_N), '-s_model_d', str(args.model_d), '-p_model_d', str(args.model_d))
+    model = build_model(opt).eval()
+    batch = synthetic_batch(args.batch_size, args.height * args.width)
+    full = None
+    if args.check:
+        with torch.inference_mode():
+            full = forward_batch(model, batch, opt)
+
+    results = []
+    for tile in args.tile:
+        base = None
+        for workers in args.workers:
+            with TiledExecutor(model, opt, tile, args.halo, workers, args.threads) as executor:
+                seconds = timeit(lambda: executor(batch, args.height, args.width), args.iters, args.warmup)
+                r = {'tile': tile, 'workers': workers, 'p50_s': float(np.median(seconds)),
+                     'cells_per_s': args.batch_size * args.height * args.width / float(np.median(seconds))}
+                base = base or r['cells_per_s']
+                r['speedup'] = r['cells_per_s'] / base
+                if full is not None:
+                    r['max_abs_diff'] = float((executor(batch, args.height, args.width) - full).abs().max())
+            results.append(r)
+
+    print('{:>6} {:>8} {:>10} {:>12} {:>9}{}'.format('tile', 'workers', 'p50(s)', 'cells/s', 'speedup',
+                                                    ' {:>11}'.format('max|diff|') if args.check else ''))
+    for r in results:
+        print('{:>6d} {:>8d} {:>10.3f} {:>12.1f} {:>8.2f}x{}'.format(
+            r['tile'], r['workers'], r['p50_s'], r['cells_per_s'], r['speedup'],
+            ' {:>11.4f}'.format(r['max_abs_diff']) if args.check else ''))
+    if args.json:
+        # host and version info so runs can be compared over time
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'host': platform.node(), 'args': vars(args), 'results': results}, f, indent=2)
@@ -0,0 +1,86 @@
+import time
+import contextlib
+import multiprocessing as mp
+import numpy as np
+import torch
+from torch import nn
+
+from stgcn_traffic_prediction.models.model import forward_batch,select_target
+from stgcn_traffic_prediction.utils.parser import getparse
+from stgcn_traffic_prediction.utils.trainer import build_model
+from stgcn_traffic_prediction.utils.memory import peak_rss_mb,reset_peak_rss,rss_mb
+
+
+def bench_opt(*args):
+    '''
+    model options for benchmarks. The close branch and k != 3 do not fit the
+    MUSE attention shapes, so benchmarks run the spatial/period/FS path.
+    '''
+    return getparse(['-s', '-FS', '-k', '3'] + list(args))
+
+
+def synthetic_batch(bs, N, close_size=3, period_size=3, nb_flow=1):
+    c = torch.rand(bs, close_size, nb_flow, N)
+    p = torch.rand(bs, period_size, close_size, nb_flow, N)
+    y = torch.rand(bs, close_size, nb_flow, N)
+    return c, p, y
+
+
+def train_step(model, batch, opt, criterion=nn.MSELoss()):
+    device = next(model.parameters()).device
+    model.train()
+    model.zero_grad()
+    pred = forward_batch(model, batch, opt)
+    loss = criterion(pred.float(), select_target(batch[-1].to(device).float(), opt))
+    loss.backward()
+    return loss.item()
+
+
+def timeit(fn, iters, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def saved_activation_mb(fn):
+    "MB of tensors autograd keeps for backward while running fn"
+    total = [0]
+    def pack(t):
+        total[0] += t.numel() * t.element_size()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        out = fn()
+    return total[0] / 2**20, out
+
+
+@contextlib.contextmanager
+def peak_memory():
+    '''
+    peak MB above the start of the block, allocated on cuda or of the process
+    RSS on CPU, in the 'peak_mb' of the dict it yields once the block is done
+    '''
+    memory = {}
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated() / 2**20
+    else:
+        reset_peak_rss()
+        base = rss_mb()
+    yield memory
+    memory['peak_mb'] = (torch.cuda.max_memory_allocated() / 2**20 if torch.cuda.is_available() else peak_rss_mb()) - base
+
+
+def isolated(fn, *args):
+    '''
+    run fn(*args) in a fresh process. The peak RSS of a process only grows,
+    so CPU memory benchmarks need one process per measurement.
+    '''
+    with mp.get_context('spawn').Pool(1) as pool:
+        return pool.apply(fn, args)
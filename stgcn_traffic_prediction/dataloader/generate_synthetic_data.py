@@ -0,0 +1,88 @@
+import argparse
+import h5py
+import numpy as np
+import pandas as pd
+
+'''
+write a synthetic telecom dataset in the all_data_sliced.h5 layout:
+`data` T*H*W*5 (sms in, sms out, call in, call out, internet) and `idx`
+hourly '%Y-%m-%d %H:%M' timestamps, e.g.
+python generate_synthetic_data.py --output ../all_data_sliced.h5 --T 1488 --height 100 --width 100
+'''
+
+# hour-of-day shapes: offices peak late morning / afternoon, homes in the evening
+_HOURS = np.arange(24)
+BUSINESS = 0.15 + np.exp(-(_HOURS - 11) ** 2 / 8.) + 0.8 * np.exp(-(_HOURS - 16) ** 2 / 6.)
+RESIDENTIAL = 0.2 + 0.5 * np.exp(-(_HOURS - 13) ** 2 / 18.) + np.exp(-(_HOURS - 20) ** 2 / 6.)
+# per channel: scale, weekend factor, weight of the noise
+CHANNELS = [(8., 0.75, 0.35), (8., 0.75, 0.35), (10., 0.6, 0.3), (10., 0.6, 0.3), (120., 0.9, 0.2)]
+
+
+def smooth_field(rng, height, width, length_scale, size=()):
+    "gaussian random field(s) with unit variance and correlation length `length_scale` cells"
+    noise = rng.standard_normal(size + (height, width))
+    ky = np.fft.fftfreq(height)[:, None]
+    kx = np.fft.fftfreq(width)[None, :]
+    kernel = np.exp(-2 * (np.pi * length_scale) ** 2 * (kx ** 2 + ky ** 2))
+    field = np.fft.ifft2(np.fft.fft2(noise) * kernel).real
+    return (field - field.mean(axis=(-2, -1), keepdims=True)) / (field.std(axis=(-2, -1), keepdims=True) + 1e-12)
+
+
+def cell_profiles(rng, height, width):
+    '''
+    per-cell intensity (lognormal over a smooth field, times a city-centre
+    bump, plus Pareto hotspots for the heavy tail) and the business share of
+    its daily profile
+    '''
+    y, x = np.mgrid[0:height, 0:width]
+    centre = np.exp(-((y - height / 2.) ** 2 + (x - width / 2.) ** 2) / (2 * (0.25 * max(height, width)) ** 2))
+    intensity = np.exp(0.8 * smooth_field(rng, height, width, max(height, width) / 15.)) * (0.3 + 2 * centre)
+    hotspots = rng.random_sample((height, width)) < 0.01
+    intensity[hotspots] *= 1 + rng.pareto(1.5, hotspots.sum())
+    business = 1 / (1 + np.exp(-(2 * smooth_field(rng, height, width, max(height, width) / 10.) + 3 * centre - 1)))
+    return intensity, business
+
+
+def generate(path, T=1488, height=100, width=100, chunk_t=24, start='2013-11-01 00:00', seed=0,
+             compression=None, block=168):
+    '''
+    traffic = intensity * (daily profile, weekday/weekend) * spatially and
+    temporally correlated lognormal noise, written `block` hours at a time so
+    memory stays O(block*H*W)
+    '''
+    rng = np.random.RandomState(seed)
+    intensity, business = cell_profiles(rng, height, width)
+    index = pd.date_range(start, periods=T, freq='h')
+    noise = np.zeros((5, height, width))
+    with h5py.File(path, 'w') as f:
+        data = f.create_dataset('data', (T, height, width, 5), dtype='float32',
+                                chunks=(min(chunk_t, T), height, width, 5), compression=compression)
+        f.create_dataset('idx', data=np.array(index.strftime('%Y-%m-%d %H:%M'), dtype='S16'))
+        for t0 in range(0, T, block):
+            hours = index[t0:t0 + block]
+            out = np.empty((len(hours), height, width, 5), dtype='float32')
+            for i, ts in enumerate(hours):
+                # AR(1) in time over spatially smooth innovations
+                noise = 0.8 * noise + 0.6 * smooth_field(rng, height, width, 2., (5,))
+                daily = business * BUSINESS[ts.hour] + (1 - business) * RESIDENTIAL[ts.hour]
+                weekend = ts.dayofweek >= 5
+                for c, (scale, weekend_factor, sigma) in enumerate(CHANNELS):
+                    level = daily * (weekend_factor if weekend else 1.)
+                    out[i, :, :, c] = scale * intensity * level * np.exp(sigma * noise[c] - sigma ** 2)
+            data[t0:t0 + len(hours)] = out
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, default='../all_data_sliced.h5')
+    parser.add_argument('--T', type=int, default=1488, help='hours (1488 = Nov-Dec 2013)')
+    parser.add_argument('--height', type=int, default=100)
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--chunk_t', type=int, default=24, help='hours per h5 chunk')
+    parser.add_argument('--compression', type=str, default=None, choices=['gzip', 'lzf'])
+    parser.add_argument('--start', type=str, default='2013-11-01 00:00')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.output, args.T, args.height, args.width, args.chunk_t, args.start, args.seed, args.compression)
+    print('wrote {} ({} hours, {}x{} grid)'.format(args.output, args.T, args.height, args.width))
@@ -10,6 +10,7 @@ import numpy as np
 from pandas import to_datetime
 from stgcn_traffic_prediction.models.MinMaxNorm import MinMaxNorm01
 from stgcn_traffic_prediction.dataloader.STMatrix import STMatrix
+from stgcn_traffic_prediction.utils.memory import profiled
 
  
 def _loader(f, nb_flow, traffic_type):
@@ -57,7 +58,18 @@ def _loader(f, nb_flow, traffic_type):
         exit(0)
 
 
-def load_data(data, traffic_type, closeness_size, period_size, trend_size, len_test, nb_flow):
+def read_h5(path, nb_flow, traffic_type, profiler=None, order=None):
+    '''T*nb_flow*N series, the cells in `order` (see ordering.py) or row-major'''
+    f = h5py.File(path, 'r')
+    with profiled(profiler, '_loader'):
+        data = _loader(f, nb_flow, traffic_type)
+        if order is not None:
+            data = data[:, :, order]
+    f.close()
+    return data
+
+
+def load_data(data, traffic_type, closeness_size, period_size, trend_size, len_test, nb_flow, profiler=None):
     #f = h5py.File(path, 'r')
     #data = _loader(f, nb_flow, traffic_type)
     #index = f['idx'][:].astype(str)
@@ -73,11 +85,13 @@ def load_data(data, traffic_type, closeness_size, period_size, trend_size, len_t
 
     mmn = MinMaxNorm01()
     data_train = data[:-len_test]
-    mmn.fit(data_train)
+    with profiled(profiler, 'MinMaxNorm01.fit'):
+        mmn.fit(data_train)
 
     data_all_mmn = []
-    for data in data_all:
-        data_all_mmn.append(mmn.transform(data))
+    with profiled(profiler, 'MinMaxNorm01.transform'):
+        for data in data_all:
+            data_all_mmn.append(mmn.transform(data))
 
     fpkl = open('preprocessing.pkl', 'wb')
     for obj in [mmn]:
@@ -91,8 +105,9 @@ def load_data(data, traffic_type, closeness_size, period_size, trend_size, len_t
     for data, index in zip(data_all_mmn, index_all):
         #print(data.shape,index.shape) #(1488,2,400) (1488,)
         st = STMatrix(data, index, 24)
-        _xc, _xp, _xt, _y, _timestamps_y = st.create_dataset(
-            len_closeness=closeness_size, len_period=period_size, len_trend=trend_size,PeriodInterval=1)
+        with profiled(profiler, 'STMatrix.create_dataset'):
+            _xc, _xp, _xt, _y, _timestamps_y = st.create_dataset(
+                len_closeness=closeness_size, len_period=period_size, len_trend=trend_size,PeriodInterval=1)
 
         xc.append(_xc)
         xp.append(_xp)
@@ -100,10 +115,11 @@ def load_data(data, traffic_type, closeness_size, period_size, trend_size, len_t
         y.append(_y)
         timestamps_y += _timestamps_y
 
-    xc = np.vstack(xc)
-    xp = np.vstack(xp)
-    xt = np.vstack(xt)
-    y = np.vstack(y)
+    with profiled(profiler, 'np.vstack'):
+        xc = np.vstack(xc)
+        xp = np.vstack(xp)
+        xt = np.vstack(xt)
+        y = np.vstack(y)
 
     xc_train, xp_train, xt_train, y_train = xc[:-len_test], xp[:-len_test], xt[:-len_test], y[:-len_test]
     xc_test, xp_test, xt_test, y_test = xc[-len_test:], xp[-len_test:], xt[:-len_test], y[-len_test:]
@@ -0,0 +1,74 @@
+import h5py
+import numpy as np
+
+'''
+space-filling-curve orders of the grid cells. _loader flattens the grid
+row-major, so the cells above and below a cell are `width` columns away;
+along a Hilbert or Z-order curve most spatial neighbours stay a few columns
+apart and every contiguous run of cells (a node chunk, a tile) is compact.
+An order is a permutation: column j of the reordered data is cell order[j]
+of the row-major grid, inverse(order) maps a row-major cell to its column.
+'''
+
+ORDERS = ('row', 'zorder', 'hilbert')
+
+
+def _side(height, width):
+    return 1 << int(np.ceil(np.log2(max(height, width, 2))))
+
+
+def zorder_index(height, width):
+    "Morton code of every row-major cell (bits of row and column interleaved)"
+    y, x = np.mgrid[0:height, 0:width]
+    y, x = y.ravel().astype(np.int64), x.ravel().astype(np.int64)
+    code = np.zeros(height * width, dtype=np.int64)
+    for bit in range(int(np.log2(_side(height, width)))):
+        code |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+    return code
+
+
+def hilbert_index(height, width):
+    "distance of every row-major cell along the Hilbert curve of the enclosing power-of-two square"
+    n = _side(height, width)
+    y, x = np.mgrid[0:height, 0:width]
+    y, x = y.ravel().astype(np.int64), x.ravel().astype(np.int64)
+    d = np.zeros(height * width, dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant
+        flip = ~ry & rx
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s //= 2
+    return d
+
+
+def cell_order(kind, height, width):
+    "permutation of the row-major cells for 'row' (identity), 'zorder' or 'hilbert'"
+    if kind == 'row':
+        return np.arange(height * width)
+    if kind == 'zorder':
+        return np.argsort(zorder_index(height, width), kind='stable')
+    if kind == 'hilbert':
+        return np.argsort(hilbert_index(height, width), kind='stable')
+    raise ValueError('unknown cell order {}'.format(kind))
+
+
+def file_order(path, kind):
+    "the cell order of the grid in an h5 file, None for row-major"
+    if kind is None or kind == 'row':
+        return None
+    with h5py.File(path, 'r') as f:
+        height, width = f['data'].shape[1:3]
+    return cell_order(kind, height, width)
+
+
+def inverse(order):
+    inv = np.empty_like(order)
+    inv[order] = np.arange(len(order))
+    return inv
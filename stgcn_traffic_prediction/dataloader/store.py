@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+/*******************************************
+** license
+********************************************/
+"""
+import os
+import json
+import numpy as np
+from stgcn_traffic_prediction.dataloader.milano_crop import read_h5
+from stgcn_traffic_prediction.dataloader.ordering import file_order
+from stgcn_traffic_prediction.models.MinMaxNorm import MinMaxNorm01
+from stgcn_traffic_prediction.models.utils import window_topk
+
+
+def store_path(path, nb_flow, traffic_type, order='row'):
+    return '{}.{}-flow{}{}.npy'.format(os.path.splitext(path)[0], traffic_type, nb_flow,
+                                       '' if order == 'row' else '-' + order)
+
+
+def build_store(path, nb_flow, traffic_type, store=None, order='row'):
+    '''
+    dump the T*nb_flow*N series of an h5 file to a .npy next to it (once), so
+    that any number of processes can memory-map it instead of re-reading the h5.
+    The cells are in `order` (see ordering.py), windows and top-k indexes built
+    from the store keep it
+    '''
+    store = store or store_path(path, nb_flow, traffic_type, order)
+    if not os.path.isfile(store):
+        data = read_h5(path, nb_flow, traffic_type, order=file_order(path, order))
+        np.save(store + '.tmp.npy', data.astype(np.float32))
+        os.replace(store + '.tmp.npy', store)
+    return store
+
+
+def open_store(store):
+    return np.load(store, mmap_mode='r')
+
+
+def first_target(close_size, period_size, trend_size, T=24, TrendInterval=7, PeriodInterval=1):
+    "first hour STMatrix.create_dataset builds a window for"
+    return max(T * TrendInterval * trend_size, T * PeriodInterval * period_size, close_size)
+
+
+def windows(data, targets, close_size, period_size, trend_size, T=24, TrendInterval=7, PeriodInterval=1,
+            target=True):
+    '''
+    the (c, p[, t], y) windows STMatrix.create_dataset builds for the target
+    hours `targets`, gathered straight from a (memory-mapped) T*nb_flow*N array:
+    c is n*close*nb_flow*N, p/t are n*len*close*nb_flow*N and y is n*close*nb_flow*N.
+    target=False leaves y out, so hours up to len(data) can be forecast
+    '''
+    targets = np.asarray(targets)[:, None]
+    span = np.arange(close_size)
+    out = [data[targets - np.arange(1, close_size + 1)]]
+    for size, interval in ((period_size, PeriodInterval * T), (trend_size, TrendInterval * T)):
+        if size > 0:
+            start = targets - interval * np.arange(1, size + 1)
+            out.append(data[start[..., None] + span])
+    if target:
+        out.append(data[targets + span])
+    return [np.asarray(x) for x in out]
+
+
+def window_dir(store, close_size, period_size, trend_size, test_size):
+    return '{}.windows-c{}-p{}-t{}-test{}'.format(os.path.splitext(store)[0], close_size, period_size, trend_size,
+                                                 test_size)
+
+
+def build_windows(store, close_size, period_size, trend_size, test_size, chunk=256):
+    '''
+    materialize the normalized windows load_data would build as .npy files (once
+    per data shape), so every run with the same close/period/trend/test sizes
+    memory-maps them instead of re-windowing. The normalizer is fit on all but
+    the last test_size hours, as in load_data.
+    '''
+    directory = window_dir(store, close_size, period_size, trend_size, test_size)
+    if os.path.isfile(os.path.join(directory, 'mmn.json')):
+        return directory
+    os.makedirs(directory, exist_ok=True)
+    data = open_store(store)
+    lo, hi = float(data[:-test_size].min()), float(data[:-test_size].max())
+    targets = np.arange(first_target(close_size, period_size, trend_size), len(data) - close_size)
+    names = ['c'] + ['p'] * (period_size > 0) + ['t'] * (trend_size > 0) + ['y']
+    arrays = None
+    for i in range(0, len(targets), chunk):
+        parts = windows(data, targets[i:i + chunk], close_size, period_size, trend_size)
+        if arrays is None:
+            arrays = [np.lib.format.open_memmap(os.path.join(directory, n + '.npy'), mode='w+', dtype=np.float32,
+                                                shape=(len(targets),) + x.shape[1:]) for n, x in zip(names, parts)]
+        for a, x in zip(arrays, parts):
+            a[i:i + chunk] = (x - lo) / (hi - lo)
+    for a in arrays:
+        a.flush()
+    with open(os.path.join(directory, 'mmn.json'), 'w') as f:
+        json.dump({'min': lo, 'max': hi, 'names': names, 'test_size': test_size}, f)
+    return directory
+
+
+def build_topk(directory, k, mode, chunk=256, chunk_size=1024):
+    '''
+    the N*k top-k neighbour index of every closeness window of a build_windows
+    directory as an int32 .npy next to the windows (once per k and mode), what
+    the model would otherwise search in every forward of every epoch
+    '''
+    path = os.path.join(directory, 'topk-k{}-{}.npy'.format(k, mode))
+    if not os.path.isfile(path):
+        c = np.load(os.path.join(directory, 'c.npy'), mmap_mode='r')
+        out = np.lib.format.open_memmap(path + '.tmp.npy', mode='w+', dtype=np.int32, shape=(len(c), c.shape[-1], k))
+        window_topk(c, k, mode, chunk, chunk_size, out)
+        out.flush()
+        del out
+        os.replace(path + '.tmp.npy', path)
+    return path
+
+
+class WindowDataset(object):
+    '''
+    train or test part of a build_windows directory, items are (c, p[, t], y) like load_data's,
+    (c, p[, t], index, y) with the build_topk file `topk`
+    '''
+    def __init__(self, directory, part='train', topk=None):
+        with open(os.path.join(directory, 'mmn.json')) as f:
+            meta = json.load(f)
+        self.arrays = [np.load(os.path.join(directory, n + '.npy'), mmap_mode='r') for n in meta['names']]
+        if topk is not None:
+            self.arrays.insert(-1, np.load(topk, mmap_mode='r'))
+        n = len(self.arrays[0])
+        self.offset, self.length = (0, n - meta['test_size']) if part == 'train' else (n - meta['test_size'],
+                                                                                         meta['test_size'])
+        self.mmn = MinMaxNorm01()
+        self.mmn.min, self.mmn.max = meta['min'], meta['max']
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return tuple(np.array(a[self.offset + i]) for a in self.arrays)
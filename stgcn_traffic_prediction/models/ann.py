@@ -0,0 +1,157 @@
+import math
+import torch
+
+
+class IVFIndex(object):
+    """Approximate top-k correlated cells over long histories
+
+    Every cell is embedded by a random projection of its whole series into
+    `dim` dimensions, kept as running sums, so appending hours costs
+    O(N*dim) whatever the history length and the history is not kept.
+    Centered and normalized the embeddings approximate correlation ('corr')
+    or cosine ('cos') similarity by their dot product. An IVF coarse quantizer
+    (k-means over the embeddings, `nlist` lists) limits a query to the cells
+    of its `nprobe` closest lists. 'corr' ranks by |correlation| without the
+    cell itself, as argsort over getA_corr does.
+    Traffic series are all strongly correlated through the daily cycle, so
+    the top-k are separated by small margins the projection blurs. With
+    `window` the last window hours are kept as well and the best rerank*k
+    candidates of every query are rescored exactly over them.
+
+    Args:
+        N: cells
+        dim: embedding size
+        nlist: coarse clusters, default sqrt(N)
+        nprobe: clusters scanned per query
+        mode: 'corr' or 'cos'
+        window: hours kept for the exact rescoring, None scores on the embeddings only
+        rerank: candidates rescored per neighbour
+        seed: seed of the projection and of k-means
+    """
+    def __init__(self, N, dim=256, nlist=None, nprobe=8, mode='corr', window=None, rerank=8, seed=0):
+        self.N = N
+        self.dim = dim
+        self.nlist = nlist or max(1, int(math.sqrt(N)))
+        self.nprobe = nprobe
+        self.mode = mode
+        self.generator = torch.Generator().manual_seed(seed)
+        self.seed = seed
+        self.length = 0
+        self.projected = torch.zeros(N, dim, dtype=torch.float64)
+        self.total = torch.zeros(N, dtype=torch.float64)
+        self.squares = torch.zeros(N, dtype=torch.float64)
+        self.basis = torch.zeros(dim, dtype=torch.float64)
+        self.centroids = None
+        self.lists = None
+        self.rerank = rerank
+        self.history = None if window is None else torch.zeros(window, N)
+        self.filled = 0
+
+    def update(self, series):
+        '''
+        append hours of data, series: T*N (or T*flow*N, flows are summed).
+        Cells keep their list; call :meth:`train` again once the clusters
+        have drifted
+        '''
+        x = torch.as_tensor(series, dtype=torch.float64)
+        if x.dim() == 3:
+            x = x.sum(1)
+        r = torch.randn(len(x), self.dim, generator=self.generator, dtype=torch.float64) / math.sqrt(self.dim)
+        self.projected += x.t().matmul(r)
+        self.basis += r.sum(0)
+        self.total += x.sum(0)
+        self.squares += (x ** 2).sum(0)
+        self.length += len(x)
+        if self.history is not None:
+            window = len(self.history)
+            self.history = torch.cat([self.history, x.float()])[-window:]
+            self.filled = min(self.filled + len(x), window)
+        if self.centroids is not None:
+            self.assign()
+        return self
+
+    def embeddings(self):
+        "N*dim unit vectors whose dot products approximate the similarity of the series"
+        if self.mode == 'corr':
+            mean = self.total / self.length
+            z = self.projected - mean.unsqueeze(-1) * self.basis
+            norm = (self.squares - self.length * mean ** 2).clamp_min(0).sqrt()
+        else:
+            z = self.projected
+            norm = self.squares.sqrt()
+        return (z / norm.clamp_min(1e-12).unsqueeze(-1)).float()
+
+    def recent(self):
+        "N*window unit vectors of the kept hours, their dot products are the exact similarity"
+        x = self.history[len(self.history) - self.filled:].t()
+        if self.mode == 'corr':
+            x = x - x.mean(-1, keepdim=True)
+        return x / x.norm(dim=-1, keepdim=True).clamp_min(1e-12)
+
+    def _scores(self, q, z):
+        s = q.matmul(z.t())
+        return s.abs() if self.mode == 'corr' else s
+
+    def train(self, iters=10):
+        "k-means (spherical, on |dot| for 'corr') over the current embeddings"
+        z = self.embeddings()
+        g = torch.Generator().manual_seed(self.seed)
+        self.centroids = z[torch.randperm(self.N, generator=g)[:self.nlist]].clone()
+        for _ in range(iters):
+            scores = z.matmul(self.centroids.t())
+            assign = self._scores(z, self.centroids).argmax(-1)
+            # a negatively correlated cell pulls its centroid with its sign flipped
+            sign = scores.gather(1, assign.unsqueeze(-1)).sign() if self.mode == 'corr' else 1.
+            sums = torch.zeros_like(self.centroids).index_add_(0, assign, z * sign)
+            empty = sums.norm(dim=-1) == 0
+            sums[empty] = self.centroids[empty]
+            self.centroids = sums / sums.norm(dim=-1, keepdim=True)
+        return self.assign(z)
+
+    def assign(self, z=None):
+        z = self.embeddings() if z is None else z
+        assign = self._scores(z, self.centroids).argmax(-1)
+        counts = torch.bincount(assign, minlength=self.nlist)
+        self.lists = list(torch.split(torch.argsort(assign), counts.tolist()))
+        return self
+
+    def search(self, k, rows=None, nprobe=None):
+        "approximate top-k neighbours of the rows (default every cell), len(rows)*k"
+        if self.centroids is None:
+            self.train()
+        z = self.embeddings()
+        exact = self.recent() if self.history is not None and self.filled > 1 else None
+        rows = torch.arange(self.N) if rows is None else torch.as_tensor(rows, dtype=torch.long)
+        probes = self._scores(z[rows], self.centroids).topk(min(nprobe or self.nprobe, self.nlist), dim=-1).indices
+        # best candidates so far, one dense product per list with the queries probing it
+        keep = k if exact is None else self.rerank * k
+        best = torch.full((len(rows), keep), -1e9)
+        found = torch.full((len(rows), keep), -1, dtype=torch.long)
+        for c, members in enumerate(self.lists):
+            q = (probes == c).any(-1).nonzero().flatten()
+            if len(q) == 0 or len(members) == 0:
+                continue
+            s = self._scores(z[rows[q]], z[members])
+            if self.mode == 'corr':
+                s[rows[q].unsqueeze(-1) == members] = -1e9
+            s, i = torch.cat([best[q], s], dim=-1), torch.cat([found[q], members.expand(len(q), -1)], dim=-1)
+            s, top = s.topk(keep, dim=-1) if s.shape[-1] > keep else s.sort(-1, descending=True)
+            best[q], found[q] = s, i.gather(1, top)
+        if exact is not None:
+            # rescore the shortlist over the kept hours, a chunk of queries at a time
+            for start in range(0, len(rows), 1024):
+                q, f = rows[start:start + 1024], found[start:start + 1024]
+                s = torch.einsum('qd,qcd->qc', exact[q], exact[f.clamp_min(0)])
+                s = s.abs() if self.mode == 'corr' else s
+                # only 'corr' leaves the cell itself out, as in the candidate search
+                s[(f < 0) | ((f == q.unsqueeze(-1)) & (self.mode == 'corr'))] = -1e9
+                best[start:start + 1024] = s
+        index = found.gather(1, best.topk(k, dim=-1).indices)
+        # queries whose probed lists held fewer than k cells: exact search over the embeddings
+        short = (index < 0).any(-1).nonzero().flatten()
+        if len(short):
+            s = self._scores(z[rows[short]], z)
+            if self.mode == 'corr':
+                s[torch.arange(len(short)), rows[short]] = -1e9
+            index[short] = s.topk(k, dim=-1).indices
+        return index
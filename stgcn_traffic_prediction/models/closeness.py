@@ -4,7 +4,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from stgcn_traffic_prediction.models.transformer import make_model
-from stgcn_traffic_prediction.models.utils import c_subsequent_mask,getA_cosin,getA_corr
+from stgcn_traffic_prediction.models.utils import c_subsequent_mask,getA_cosin,getA_corr,get_device
 
 class close(nn.Module):
     def __init__(self,k,N,model_d):
@@ -20,10 +20,11 @@ class close(nn.Module):
         bs = len(x_c)
         N = x_c.shape[-1]
         len_closeness = x_c.shape[1]
+        device = get_device(self)
 
         #adj
         sx_c = x_c.permute((0,2,3,1)).float()
-        if adj is None:
+        if adj is None and index is None:
             if(mode=='cos'):
                 adj = getA_cosin(sx_c)
             elif(mode=='corr'):#maybe need absolute
@@ -39,7 +40,7 @@ class close(nn.Module):
                     selected[i,j] = sx_c[i,flow,index[i,j]]
         #(bs,N,k,c)
 
-        tx_c = torch.cat([sx_c[:,flow].unsqueeze(-1),selected.transpose(-1,-2)],dim=-1).cuda()
+        tx_c = torch.cat([sx_c[:,flow].unsqueeze(-1),selected.transpose(-1,-2)],dim=-1).to(device)
         #(bs,N,c,k+1)
 
 
@@ -51,17 +52,17 @@ class close(nn.Module):
         sq_c: bs*N*closeness*1
         '''
 
-        tgt_mask_c = c_subsequent_mask(len_closeness).cuda()
+        tgt_mask_c = c_subsequent_mask(len_closeness).to(device)
         if(tgt_mode=='c'):
-            tgt_c = sx_c[:,flow].unsqueeze(-1).cuda()
+            tgt_c = sx_c[:,flow].unsqueeze(-1).to(device)
         elif(tgt_mode=='r'):
-            tgt_c = torch.rand((bs,N,len_closeness,1)).cuda()
+            tgt_c = torch.rand((bs,N,len_closeness,1)).to(device)
         elif(tgt_mode=='p'):
-            tgt_c = torch.mean(x_p[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-1).cuda()
+            tgt_c = torch.mean(x_p[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-1).to(device)
         elif(tgt_mode=='t'):
-            tgt_c = torch.mean(x_t[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-1).cuda()
+            tgt_c = torch.mean(x_t[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-1).to(device)
         elif(tgt_mode=='tp'):
-            tgt_c = torch.mean(x_p[:,:,:,flow]+x_t[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-1).cuda()
+            tgt_c = torch.mean(x_p[:,:,:,flow]+x_t[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-1).to(device)
 
         sq_c = self.c_temporal(tx_c, tgt_c, tgt_mask_c).squeeze(-1)
         return sq_c
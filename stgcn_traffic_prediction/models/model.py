@@ -6,8 +6,9 @@ import numpy as np
 from stgcn_traffic_prediction.pygcn.layers import GraphConvolution
 from .period import period
 from .closeness import close
-from .spatial import Spatial,gcnSpatial
-from .utils import getadj,getA_cosin,getA_corr
+from .spatial import Spatial,gcnSpatial,dgcnSpatial
+from .utils import getadj,getA_cosin,getA_corr,topk_index
+from .transformer import Encoder,Decoder,MUSEAttention,MUSEAttention1,MUSEAttention2
 
 class Fusion(nn.Module):
     def __init__(self,dim_in):
@@ -21,11 +22,55 @@ class Fusion(nn.Module):
             out = x1
         return out
 
+class Adjacency(nn.Module):
+    '''
+    top-k neighbour index (bs*N*k) of every node (models.utils.topk_index,
+    chunk_size rows at a time, all rows at once without node chunking) and the
+    dense adjacency (always None, the branches only use the index), a module
+    of its own so it can be hooked like the branches. A precomputed per-sample index (models.utils.window_topk)
+    or else a static N*k graph (T_STGCN.set_graph) is served instead of the
+    per-sample search. The graph is a buffer, checkpoints keep it; it holds
+    full-grid ids, subgraph forwards remap it with subgraph_index.
+    '''
+    def __init__(self):
+        super(Adjacency,self).__init__()
+        self.register_buffer('graph',None)
+
+    def __setstate__(self,state):
+        super(Adjacency,self).__setstate__(state)
+        #pickles from when the graph was a plain attribute
+        if 'graph' not in self._buffers:
+            self._buffers['graph'] = self.__dict__.pop('graph',None)
+
+    def _load_from_state_dict(self,state_dict,prefix,*args,**kwargs):
+        #a checkpoint with a graph restores it into a model built without one
+        graph = state_dict.get(prefix+'graph')
+        if graph is not None and (self.graph is None or self.graph.shape != graph.shape):
+            self.graph = torch.empty_like(graph)
+        super(Adjacency,self)._load_from_state_dict(state_dict,prefix,*args,**kwargs)
+
+    def forward(self,x_c,mode,k,chunk_size=None,index=None):
+        if mode not in ('cos','corr'):
+            raise Exception('wrong adj mode')
+        if(index is not None):
+            return None,index[:,:,:k].to(x_c.device).long()
+        if(self.graph is not None):
+            return None,self.graph[:,:k].to(x_c.device).unsqueeze(0).expand(len(x_c),-1,-1)
+        #one ranking for every path (chunked, subgraph, precomputed), the float32
+        #softmax over getA_corr ties neighbours that float64 still tells apart
+        return None,topk_index(x_c.permute((0,2,3,1)),k,mode,chunk_size or x_c.shape[-1])
+
 class T_STGCN(nn.Module):
-    def __init__(self,len_closeness, external_size, N, k, spatial, s_model_d,c_model_d,p_model_d,t_model_d,dim_hid=16, drop_rate=0.1):
+    chunk_size = None
+    order = None
+
+    def __init__(self,len_closeness, external_size, N, k, spatial, s_model_d,c_model_d,p_model_d,t_model_d,dim_hid=16, drop_rate=0.1,checkpoint=(),chunk_size=None):
         super(T_STGCN,self).__init__()
+        self.adjacency = Adjacency()
         if(spatial=='gcn'):
             self.spatial = gcnSpatial(len_closeness,dim_hid,len_closeness,dropout=0.1)
+        elif(spatial=='dgcn'):
+            self.spatial = dgcnSpatial(len_closeness,dim_hid,len_closeness,k,dropout=0.1)
         else:
             self.spatial = Spatial(len_closeness,k,N,s_model_d)
         self.c_temporal = close(k,N,c_model_d)
@@ -35,17 +80,68 @@ class T_STGCN(nn.Module):
         self.temporal_fusion = Fusion(len_closeness)
         if(spatial=='gcn'):
             self.spatial_f = gcnSpatial(len_closeness,dim_hid,len_closeness,dropout=0.1)
+        elif(spatial=='dgcn'):
+            self.spatial_f = dgcnSpatial(len_closeness,dim_hid,len_closeness,k,dropout=0.1)
         else:
             self.spatial_f = Spatial(len_closeness,k,N,s_model_d)
         self.fusion = Fusion(len_closeness)
         self.k = k
+        self.set_checkpoint(checkpoint)
+        self.set_chunk_size(chunk_size)
+
+    def __setstate__(self,state):
+        super(T_STGCN,self).__setstate__(state)
+        #whole-model pickles from before the adjacency step was a module
+        if 'adjacency' not in self._modules:
+            self._modules['adjacency'] = Adjacency()
+
+    def set_checkpoint(self,branches):
+        '''
+        activation recompute for the encoder/decoder stacks of the given branches
+        ('spatial','c_temporal','p_temporal','spatial_f'), trades compute for memory
+        '''
+        for name in ['spatial','c_temporal','p_temporal','spatial_f']:
+            for m in getattr(self,name).modules():
+                if isinstance(m,(Encoder,Decoder)):
+                    m.checkpoint = name in branches
 
+    def set_graph(self,graph):
+        '''
+        serve the top-k neighbours of Spatial/close from a static N*k graph
+        (e.g. IVFIndex.search over weeks of history), None for the per-sample search.
+        The graph is saved with the model's state_dict
+        '''
+        self.adjacency.graph = None if graph is None else torch.as_tensor(graph).long()
+
+    def set_order(self,order):
+        '''
+        the cells of the input are in this order (dataloader/ordering.py), not
+        row-major: only the grid Laplacian of the gcn spatial model depends on it,
+        callers use it to map cell ids and outputs back
+        '''
+        self.order = order
+        for m in self.modules():
+            if isinstance(m,gcnSpatial):
+                m.order = order
 
-    def forward(self,x_c,mode,c,s,FS,c_tgt,s_tgt,flow,x_p,x_t=None):
+    def set_chunk_size(self,chunk_size):
+        '''
+        node-chunked execution: top-k neighbours and the node attention of every
+        branch are computed chunk_size nodes at a time. The top-k index is the
+        same, the output the same up to float rounding of the attention
+        '''
+        self.chunk_size = chunk_size
+        for m in self.modules():
+            if isinstance(m,(MUSEAttention,MUSEAttention1,MUSEAttention2)):
+                m.chunk_size = chunk_size
+
+    def forward(self,x_c,mode,c,s,FS,c_tgt,s_tgt,flow,x_p,x_t=None,index=None):
         '''initial data size
         x_c: bs*closeness*2*N
         x_p: bs*len_period*closeness*2*N
         x_t: bs*len_trend*closeness*2*N
+        index: bs*N*k precomputed top-k of x_c, None searches it here
+        flow=None predicts every flow in one pass, output bs*closeness*2*N
         '''
         '''spatial output
         sx_c: bs*N*closeness
@@ -67,13 +163,20 @@ class T_STGCN(nn.Module):
         #print('x_c\n',x_c)
 
         #get adj
-        if(mode=='cos'):
-            adj = getA_cosin(x_c.permute((0,2,3,1)))
-        elif(mode=='corr'):
-            adj = getA_corr(x_c.permute((0,2,3,1)))
-        else:
-            raise Exception('wrong adj mode')
-        index = torch.argsort(adj,dim=-1,descending=True)[:,:,0:self.k]
+        adj,index = self.adjacency(x_c,mode,self.k,self.chunk_size,index)
+
+        nb_flow = None
+        if(flow is None):
+            #multi-flow: fold the flow axis into the batch, all flows share the top-k
+            nb_flow = x_c.shape[2]
+            x_c = x_c.transpose(1,2).reshape((bs*nb_flow,len_closeness,1,N))
+            x_p = x_p.permute((0,3,1,2,4)).reshape((bs*nb_flow,)+x_p.shape[1:3]+(1,N))
+            if x_t is not None:
+                x_t = x_t.permute((0,3,1,2,4)).reshape((bs*nb_flow,)+x_t.shape[1:3]+(1,N))
+            adj = None
+            index = index.repeat_interleave(nb_flow,dim=0)
+            flow = 0
+
         if(s):
             #spatial
             x_spatial,_ = self.spatial(x_c,x_p,s_tgt,mode,flow,adj,index,x_t)
@@ -97,7 +200,142 @@ class T_STGCN(nn.Module):
 
         #fusion
         pred = self.fusion(x_temporal,x_spatial)
+        if(nb_flow is not None):
+            return pred.transpose(1,2).reshape((bs,nb_flow,len_closeness,N)).transpose(1,2)
         return pred.transpose(1,2)
 
 
+def split_batch(batch):
+    '''
+    (c,p[,t][,index],target) loader batch -> [c,p,t],index,target; the
+    precomputed top-k index is the integer tensor, t and index may be missing
+    '''
+    index = batch[-2] if len(batch) > 3 and not batch[-2].is_floating_point() else None
+    return list(batch[:-2 if index is not None else -1]),index,batch[-1]
+
+
+def forward_batch(model,batch,opt):
+    '''run T_STGCN on a loader batch (c,p,target) or (c,p,t,target), optionally with a top-k index before target'''
+    x,index,_ = split_batch(batch)
+    c, p = x[0].float(), x[1].float()
+    t = x[2].float() if len(x) > 2 else None
+    flow = None if opt.multi_flow else opt.flow
+    return model(c,opt.mode,opt.c,opt.s,opt.FS,opt.c_t,opt.s_t,flow,p,t,index)
+
+
+def sample_subgraph(x_c,mode,k,cells,index=None):
+    '''
+    nodes of a random subgraph per sample: `cells` target cells (the same for
+    every sample, first in each row) plus their top-k neighbours, padded with
+    other random cells to cells*(k+1) nodes so the batch stays rectangular.
+    The top-k of a target inside its subgraph is its top-k on the full grid.
+    x_c: bs*closeness*flow*N, index: precomputed bs*N*k top-k or a static N*k
+    graph -> nodes: bs*(cells*(k+1))
+    '''
+    bs,N = len(x_c),x_c.shape[-1]
+    size = min(cells*(k+1),N)
+    targets = torch.randperm(N)[:cells]
+    if index is not None and index.dim() == 2:
+        neighbours = index[targets,:k].long().unsqueeze(0).expand(bs,-1,-1)
+    elif index is not None:
+        neighbours = index[:,targets,:k].long()
+    else:
+        neighbours = topk_index(x_c.permute((0,2,3,1)).float(),k,mode,cells,rows=targets)
+    nodes = torch.zeros((bs,size),dtype=torch.long)
+    for i in range(bs):
+        taken = torch.zeros(N,dtype=torch.bool)
+        taken[targets] = True
+        extra = neighbours[i].flatten().unique()
+        extra = extra[~taken[extra]]
+        taken[extra] = True
+        fill = torch.randperm(N)
+        fill = fill[~taken[fill]][:size-cells-len(extra)]
+        nodes[i] = torch.cat([targets,extra,fill])
+    return nodes
+
+
+def subgraph(x,nodes):
+    '''the nodes (bs*M) of x (bs*...*N), bs*...*M'''
+    shape = (len(x),)+(1,)*(x.dim()-2)+(nodes.shape[-1],)
+    return x.gather(-1,nodes.view(shape).expand(x.shape[:-1]+(nodes.shape[-1],)).to(x.device))
+
+
+def subgraph_index(graph,x_c,mode,k,nodes):
+    '''
+    top-k index of subgraph nodes in subgraph ids, from full-grid neighbours
+    (a static N*k graph or a precomputed bs*N*k index): nodes whose k
+    neighbours all lie in the subgraph (the targets) keep them, the others
+    get their top-k searched inside the subgraph.
+    x_c: subgraph closeness bs*closeness*flow*M, nodes: bs*M -> index: bs*M*k
+    '''
+    bs,M = nodes.shape
+    graph = torch.as_tensor(graph).long()[...,:k]
+    if graph.dim() == 2:
+        rows = graph[nodes]
+    else:
+        rows = graph.gather(1,nodes.unsqueeze(-1).expand(-1,-1,k))
+    position = torch.full((bs,graph.shape[-2]),-1,dtype=torch.long)
+    position.scatter_(1,nodes,torch.arange(M).expand(bs,M).contiguous())
+    local = position.gather(1,rows.reshape(bs,-1)).view(bs,M,k)
+    searched = topk_index(x_c.permute((0,2,3,1)).float(),k,mode,M)
+    return torch.where((local >= 0).all(-1,keepdim=True),local,searched)
+
+
+def model_graph(model,batch,graph=None):
+    '''full-grid neighbours a forward of the batch uses: graph, the batch's precomputed index, the model's graph or None'''
+    if graph is not None:
+        return torch.as_tensor(graph)
+    _,index,_ = split_batch(batch)
+    return index if index is not None else model.adjacency.graph
+
+
+def cell_neighbours(model,batch,opt,cells,graph=None):
+    '''top-k neighbours of the cells in every sample (from a cached N*k graph, the batch's precomputed index or the model's graph)'''
+    graph = model_graph(model,batch,graph)
+    if graph is not None and graph.dim() == 2:
+        return graph[cells,:model.k].long()
+    if graph is not None:
+        return graph[:,cells,:model.k].long()
+    return topk_index(batch[0].permute((0,2,3,1)).float(),model.k,opt.mode,len(cells),rows=cells)
+
+
+def forward_nodes(model,batch,opt,nodes,cells,graph=None):
+    '''
+    forward on the subgraph of the given nodes, the output of `cells` (a subset
+    of them). Full-grid neighbours (graph, the batch's index or the model's
+    graph) are remapped to subgraph ids, see subgraph_index
+    '''
+    nodes = nodes.unique()
+    if isinstance(model.spatial,gcnSpatial) and len(nodes) < batch[0].shape[-1]:
+        # get_adj(N) is the Laplacian of the full grid, a subset of cells has none
+        raise ValueError('the gcn spatial model only runs on the full grid')
+    x,_,target = split_batch(batch)
+    graph = model_graph(model,batch,graph)
+    sub = [v[...,nodes] for v in x]
+    if graph is not None:
+        sub.append(subgraph_index(graph,sub[0],opt.mode,model.k,nodes.expand(len(sub[0]),-1)))
+    pred = forward_batch(model,sub+[target[...,nodes]],opt)
+    return pred[...,torch.searchsorted(nodes,cells).to(pred.device)]
+
+
+def forecast_cells(model,batch,opt,cells,graph=None,context=0):
+    '''
+    forecast of the given cells only: the branches run on the cells, their
+    top-k neighbours and `context` evenly spaced extra cells instead of all N.
+    The neighbours are the per-sample top-k (what the full forward gathers
+    for these cells) or, with a cached N*k graph (or the model's), its rows. Every gather of
+    a target is the full-grid one, but the node attention only sees the
+    subgraph, so outputs approach the full forward as context grows (and
+    equal it when the subgraph is the whole grid).
+    returns bs*closeness*len(cells) (bs*closeness*nb_flow*len(cells) with -multi_flow)
+    '''
+    N = batch[0].shape[-1]
+    cells = torch.as_tensor(cells,dtype=torch.long)
+    neighbours = cell_neighbours(model,batch,opt,cells,graph)
+    nodes = torch.cat([cells,neighbours.flatten(),torch.linspace(0,N-1,context).long()])
+    return forward_nodes(model,batch,opt,nodes,cells,graph)
+
 
+def select_target(target,opt):
+    '''the flows the model predicts: bs*closeness*N, or bs*closeness*nb_flow*N with -multi_flow'''
+    return target if opt.multi_flow else target[:,:,opt.flow]
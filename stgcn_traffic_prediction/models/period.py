@@ -6,6 +6,7 @@ from torch.autograd import Variable
 import copy
 import math
 from stgcn_traffic_prediction.models.transformer import make_model
+from stgcn_traffic_prediction.models.utils import get_device
    
 class period(nn.Module):
     def __init__(self,close_size,N,model_d):
@@ -28,9 +29,10 @@ class period(nn.Module):
         bs = len(x_c)
         N = x_c.shape[-1]
         len_closeness = x_c.shape[1]
+        device = get_device(self)
 
-        tgt = x_c.permute((0,2,3,1))[:,flow].unsqueeze(dim=-2).cuda()
-        tx_p = x_p.permute(0,3,4,1,2).float().cuda()
+        tgt = x_c.permute((0,2,3,1))[:,flow].unsqueeze(dim=-2).to(device)
+        tx_p = x_p.permute(0,3,4,1,2).float().to(device)
 
         sq_p = self.p_temporal(tx_p[:,flow], tgt).squeeze(dim=-2)
         return sq_p
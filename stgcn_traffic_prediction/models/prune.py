@@ -0,0 +1,199 @@
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+from stgcn_traffic_prediction.models.model import forward_batch,select_target
+from stgcn_traffic_prediction.models.transformer import Encoder,Decoder,MUSEAttention,MUSEAttention1,MUSEAttention2
+
+ATTENTIONS = (MUSEAttention, MUSEAttention1, MUSEAttention2)
+
+
+def measure_latency(model, batch, opt, repeat=5, warmup=2):
+    "median forward time (ms) of one batch on the current host"
+    model.eval()
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + repeat):
+            start = time.perf_counter()
+            forward_batch(model, batch, opt)
+            if i >= warmup:
+                times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+
+def evaluate(model, batches, opt, criterion):
+    model.eval()
+    device = next(model.parameters()).device
+    total = 0.
+    with torch.no_grad():
+        for batch in batches:
+            pred = forward_batch(model, batch, opt)
+            total += criterion(pred.float(), select_target(batch[-1].to(device).float(), opt)).item()
+    return total / len(batches)
+
+
+def _n_params(module):
+    return sum(p.numel() for p in module.parameters())
+
+
+def candidates(model):
+    '''
+    every prunable unit: whole encoder/decoder layers (at least one is kept per
+    stack) and single attention heads (at least one is kept per attention)
+    '''
+    units = []
+    for name, m in model.named_modules():
+        if isinstance(m, (Encoder, Decoder)) and len(m.layers) > 1:
+            for i, layer in enumerate(m.layers):
+                units.append(('layer', name, m, i, _n_params(layer)))
+        elif isinstance(m, ATTENTIONS) and m.h > 1:
+            cost = _n_params(m) / m.h
+            for i in range(m.h):
+                units.append(('head', name, m, i, cost))
+    return units
+
+
+def _head_slice(attn, head):
+    return slice(head * attn.d_v, (head + 1) * attn.d_v)
+
+
+def ablation_loss(model, unit, batches, opt, criterion):
+    "validation loss with one unit switched off"
+    kind, _, m, i, _ = unit
+    if kind == 'layer':
+        layers = m.layers
+        m.layers = nn.ModuleList([l for j, l in enumerate(layers) if j != i])
+        loss = evaluate(model, batches, opt, criterion)
+        m.layers = layers
+        return loss
+    # zeroing the head's values removes it from both the attention and the conv path
+    rows = _head_slice(m, i)
+    weight = m.fc_v.weight.data[rows].clone()
+    bias = m.fc_v.bias.data[rows].clone()
+    m.fc_v.weight.data[rows] = 0
+    m.fc_v.bias.data[rows] = 0
+    loss = evaluate(model, batches, opt, criterion)
+    m.fc_v.weight.data[rows] = weight
+    m.fc_v.bias.data[rows] = bias
+    return loss
+
+
+def _select_linear(linear, idx, dim):
+    idx = torch.as_tensor(idx, device=linear.weight.device)
+    out_f = len(idx) if dim == 0 else linear.out_features
+    in_f = len(idx) if dim == 1 else linear.in_features
+    new = nn.Linear(in_f, out_f, bias=linear.bias is not None).to(linear.weight.device)
+    new.weight.data = linear.weight.data.index_select(dim, idx).clone()
+    if linear.bias is not None:
+        new.bias.data = linear.bias.data.index_select(0, idx).clone() if dim == 0 else linear.bias.data.clone()
+    return new
+
+
+def _select_conv(conv, idx):
+    '''
+    drop input channels of a Depth_Pointwise_Conv1d. A removed channel only
+    contributed its depthwise bias, which is folded into the pointwise bias.
+    '''
+    idx = torch.as_tensor(idx, device=conv.pointwise_conv.weight.device)
+    depth, point = conv.depth_conv, conv.pointwise_conv
+    keep = torch.zeros(point.in_channels, dtype=torch.bool, device=idx.device)
+    keep[idx] = True
+    if isinstance(depth, nn.Conv1d):
+        if depth.bias is not None:
+            point.bias.data += (point.weight.data[:, ~keep, 0] * depth.bias.data[~keep]).sum(-1)
+        new_depth = nn.Conv1d(len(idx), len(idx), depth.kernel_size[0], groups=len(idx),
+                              padding=depth.padding[0], bias=depth.bias is not None).to(idx.device)
+        new_depth.weight.data = depth.weight.data[idx].clone()
+        if depth.bias is not None:
+            new_depth.bias.data = depth.bias.data[idx].clone()
+        conv.depth_conv = new_depth
+    new_point = nn.Conv1d(len(idx), point.out_channels, 1).to(idx.device)
+    new_point.weight.data = point.weight.data[:, idx].clone()
+    new_point.bias.data = point.bias.data.clone()
+    conv.pointwise_conv = new_point
+
+
+def prune_heads(attn, heads):
+    keep = [i for i in range(attn.h) if i not in set(heads)]
+    qk = np.concatenate([np.arange(i * attn.d_k, (i + 1) * attn.d_k) for i in keep])
+    v = np.concatenate([np.arange(i * attn.d_v, (i + 1) * attn.d_v) for i in keep])
+    attn.fc_q = _select_linear(attn.fc_q, qk, 0)
+    attn.fc_k = _select_linear(attn.fc_k, qk, 0)
+    attn.fc_v = _select_linear(attn.fc_v, v, 0)
+    attn.fc_o = _select_linear(attn.fc_o, v, 1)
+    for conv in (attn.conv1, attn.conv3, attn.conv5):
+        _select_conv(conv, v)
+    attn.h = len(keep)
+
+
+def prune_layers(stack, layers):
+    stack.layers = nn.ModuleList([l for i, l in enumerate(stack.layers) if i not in set(layers)])
+
+
+def remove(units):
+    "remove several units at once, grouped per module so indices stay valid"
+    groups = {}
+    for kind, _, m, i, _ in units:
+        groups.setdefault((kind, id(m)), (kind, m, []))[2].append(i)
+    for kind, m, idx in groups.values():
+        if kind == 'layer':
+            prune_layers(m, idx)
+        else:
+            prune_heads(m, idx)
+
+
+def prune(model, batches, sample, target_ms, opt, criterion, step=1, log=print):
+    '''
+    greedy structured pruning to a latency budget: score every head/layer by
+    the validation loss increase per removed parameter and drop the `step`
+    cheapest ones until the measured latency meets target_ms
+    '''
+    base_loss = evaluate(model, batches, opt, criterion)
+    latency = measure_latency(model, sample, opt)
+    report = [{'removed': '-', 'latency_ms': latency, 'valid_loss': base_loss, 'params': _n_params(model)}]
+    log('[prune] start latency: {:0.2f}ms, valid_loss: {:0.8f}'.format(latency, base_loss))
+    while latency > target_ms:
+        units = candidates(model)
+        if not units:
+            log('[prune] nothing left to prune, target not reached')
+            break
+        scores = [(ablation_loss(model, u, batches, opt, criterion) - base_loss) / u[4] for u in units]
+        order = np.argsort(scores)
+        chosen, seen = [], {}
+        for j in order:
+            kind, name, m, i, _ = units[j]
+            # never empty a stack or an attention within one round
+            size = len(m.layers) if kind == 'layer' else m.h
+            if seen.get(id(m), 0) + 1 >= size:
+                continue
+            seen[id(m)] = seen.get(id(m), 0) + 1
+            chosen.append(units[j])
+            if len(chosen) == step:
+                break
+        if not chosen:
+            break
+        remove(chosen)
+        base_loss = evaluate(model, batches, opt, criterion)
+        latency = measure_latency(model, sample, opt)
+        removed = ', '.join('{}:{}[{}]'.format(u[0], u[1], u[3]) for u in chosen)
+        report.append({'removed': removed, 'latency_ms': latency, 'valid_loss': base_loss, 'params': _n_params(model)})
+        log('[prune] removed {} -> latency: {:0.2f}ms, valid_loss: {:0.8f}'.format(removed, latency, base_loss))
+    return model, report
+
+
+def finetune(model, data, opt, criterion, epochs, lr):
+    device = next(model.parameters()).device
+    optimizer = torch.optim.Adam(model.parameters(), lr, betas=(0.9, 0.98), eps=1e-9)
+    for epoch in range(epochs):
+        model.train()
+        total = 0.
+        for batch in data:
+            optimizer.zero_grad()
+            pred = forward_batch(model, batch, opt)
+            loss = criterion(pred.float(), select_target(batch[-1].to(device).float(), opt))
+            loss.backward()
+            optimizer.step()
+            total += loss.item()
+        print('[finetune] epoch: {:d}, train_loss: {:0.8f}'.format(epoch + 1, total / len(data)))
+    return model
@@ -0,0 +1,57 @@
+import io
+import copy
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+from stgcn_traffic_prediction.models.model import forward_batch
+
+
+def quantize(model, dtype=torch.qint8):
+    '''
+    dynamic int8 quantization for CPU serving, covers every nn.Linear:
+    fc_q/k/v/o, PositionwiseFeedForward, Embeddings, Generator and Fusion
+    '''
+    model = copy.deepcopy(model).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=dtype)
+
+
+def model_size(model):
+    "size in bytes of the serialized state_dict"
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell()
+
+
+def compare(float_model, q_model, data, opt, max_batches=None):
+    '''
+    run both models on the same batches and report the int8 error and latency.
+    MUSEAttention renormalizes dy_paras on every call, so both models have to
+    see exactly the same sequence of forwards to stay comparable.
+    '''
+    float_model = float_model.cpu().eval()
+    q_model = q_model.eval()
+    float_t, q_t = [], []
+    abs_err, sq_err, max_err, n = 0., 0., 0., 0
+    with torch.no_grad():
+        for idx, batch in enumerate(data):
+            if max_batches is not None and idx >= max_batches:
+                break
+            start = time.perf_counter()
+            pred = forward_batch(float_model, batch, opt)
+            float_t.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            q_pred = forward_batch(q_model, batch, opt)
+            q_t.append(time.perf_counter() - start)
+
+            diff = (q_pred - pred).abs()
+            abs_err += diff.sum().item()
+            sq_err += (diff ** 2).sum().item()
+            max_err = max(max_err, diff.max().item())
+            n += diff.numel()
+
+    return {'mae': abs_err / n, 'rmse': (sq_err / n) ** 0.5, 'max_err': max_err,
+            'float_ms': 1000 * float(np.mean(float_t)), 'int8_ms': 1000 * float(np.mean(q_t)),
+            'float_mb': model_size(float_model) / 2**20, 'int8_mb': model_size(q_model) / 2**20}
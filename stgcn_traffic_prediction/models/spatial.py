@@ -3,11 +3,14 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 
-from stgcn_traffic_prediction.pygcn.models import GCN
+from stgcn_traffic_prediction.pygcn.models import GCN,DynamicGCN
 from stgcn_traffic_prediction.models.transformer import make_model
-from .utils import getA_cosin,getA_corr,getadj,get_adj,scaled_Laplacian
+from .utils import getA_cosin,getA_corr,getadj,get_adj,scaled_Laplacian,get_device,topk_index,topk_weights
 
 class gcnSpatial(nn.Module):
+    # cell order of the input (T_STGCN.set_order), the grid Laplacian follows it
+    order = None
+
     def __init__(self,dim_in,dim_hid,dim_out,dropout):
         super(gcnSpatial,self).__init__()
         self.spatial = GCN(dim_in,dim_hid,dim_out,dropout)
@@ -15,14 +18,54 @@ class gcnSpatial(nn.Module):
     def forward(self,x_c,x_p,tgt_mode,mode,flow,A=None,index=None,x_t=None):
         #print('x_c:',x_c)
         N = x_c.shape[-1]
+        device = get_device(self)
         sx_c = x_c.permute(0,2,3,1).float()
         #print('sx',sx_c.shape)
         adj_mx = get_adj(N)
+        if self.order is not None:
+            adj_mx = adj_mx[np.ix_(self.order,self.order)]
         L_tilde = torch.tensor(scaled_Laplacian(adj_mx)).float()
         #adj = getadj(sx_c)
         #print('gcn_adj',adj.shape)
-        spatial_c = self.spatial(sx_c[:,flow].cuda(),L_tilde.cuda())
+        spatial_c = self.spatial(sx_c[:,flow].to(device),L_tilde.to(device))
         return  spatial_c,adj_mx
+
+
+class dgcnSpatial(nn.Module):
+    '''
+    GCN over the data-driven top-k graph of every sample instead of the fixed
+    grid Laplacian: each node averages itself and its k neighbours weighted by
+    topk_weights, so a layer costs O(bs*N*k*d)
+    '''
+    def __init__(self,dim_in,dim_hid,dim_out,k,dropout):
+        super(dgcnSpatial,self).__init__()
+        self.spatial = DynamicGCN(dim_in,dim_hid,dim_out,dropout)
+        self.k = k
+
+    def forward(self,x_c,x_p,tgt_mode,mode,flow,A=None,index=None,x_t=None):
+        '''
+        x_c: bs*closeness*flow*N, index: bs*N*k (computed from x_c when missing)
+        the node features are x_c, or the mean of x_p/x_t for tgt_mode 'p'/'t'
+        output: bs*N*closeness
+        '''
+        bs,_,_,N = x_c.shape
+        device = get_device(self)
+        x = x_c.permute((0,2,3,1)).float()
+        if index is None:
+            index = topk_index(x,self.k,mode,N)
+        index = index.to(device)
+        weight = topk_weights(x.to(device),index,mode)
+        if(tgt_mode=='p'):
+            h = torch.mean(x_p[:,:,:,flow],dim=1).transpose(1,2)
+        elif(tgt_mode=='t'):
+            h = torch.mean(x_t[:,:,:,flow],dim=1).transpose(1,2)
+        else:
+            h = x[:,flow]
+        #A + I, rows normalized
+        self_index = torch.arange(N,device=device).view(1,N,1).expand(bs,-1,-1)
+        index = torch.cat([self_index,index],dim=-1)
+        weight = torch.cat([torch.ones_like(weight[...,:1]),weight],dim=-1)/2
+        return self.spatial(h.float().to(device),index,weight),index
  
 class Spatial(nn.Module):
     def __init__(self,close_size,k,N,model_d):
@@ -43,10 +86,11 @@ class Spatial(nn.Module):
         sq_c: bs*N*1*closeness
         '''
         bs,closeness,_,N = x_c.shape
+        device = get_device(self)
         x = x_c.permute((0,2,3,1)).float()
         #print('x',x.shape)
         #calculate the similarity between other nodes
-        if A is None:
+        if A is None and index is None:
             if(mode=='cos'):
                 A = getA_cosin(x)
             elif(mode=='moran'):
@@ -71,19 +115,19 @@ class Spatial(nn.Module):
         #sx_c:(bs,N,k,closeness)
 
         if(tgt_mode=='c'):
-            tgt = x[:,flow].unsqueeze(dim=-2).cuda()
+            tgt = x[:,flow].unsqueeze(dim=-2).to(device)
             #tgt_c = sx_c[:,flow].unsqueeze(-1).cuda()
         elif(tgt_mode=='r'):
-            tgt = torch.rand((bs,N,1,closeness)).cuda()
+            tgt = torch.rand((bs,N,1,closeness)).to(device)
         elif(tgt_mode=='p'):
             #print('before tgt_p',x_p.shape)
-            tgt = torch.mean(x_p[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-2).cuda()
+            tgt = torch.mean(x_p[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-2).to(device)
         elif(tgt_mode=='t'):
-            tgt = torch.mean(x_t[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-2).cuda()
+            tgt = torch.mean(x_t[:,:,:,flow],dim=1).transpose(1,2).unsqueeze(-2).to(device)
         #spatial transformer
         
        # print('s_tgt',tgt.shape)
-        sq_c = self.spatial(sx_c.cuda(), tgt).squeeze(dim=-2)
+        sq_c = self.spatial(sx_c.to(device), tgt).squeeze(dim=-2)
         #print('sq_c',sq_c.shape)
         #return sq_c.permute((0,3,1,2)) 
         #return F.sigmoid(sq_c).permute((0,3,1,2))
@@ -7,6 +7,7 @@ import copy
 import math
 from torch.nn import init
 from torch.functional import norm
+from torch.utils.checkpoint import checkpoint
 import torch
 
 def clones(module, N):
@@ -165,6 +166,9 @@ class EncoderLayer(nn.Module):
 
 class Encoder(nn.Module):
     "Core encoder is a stack of N layers"
+    # recompute layer activations in backward instead of storing them
+    checkpoint = False
+
     def __init__(self, layer, N):
         super(Encoder, self).__init__()
         self.layers = clones(layer, N)
@@ -173,7 +177,10 @@ class Encoder(nn.Module):
     def forward(self, x):
         "Pass the input (and mask) through each layer in turn."
         for layer in self.layers:
-            x = layer(x)
+            if self.checkpoint and self.training and torch.is_grad_enabled():
+                x = checkpoint(layer, x, use_reentrant=False)
+            else:
+                x = layer(x)
         return self.norm(x)
 
 
@@ -200,6 +207,9 @@ class DecoderLayer(nn.Module):
  
 class Decoder(nn.Module):
     "Generic N layer decoder with masking."
+    # recompute layer activations in backward instead of storing them
+    checkpoint = False
+
     def __init__(self, layer, N):
         super(Decoder, self).__init__()
         self.layers = clones(layer, N)
@@ -207,7 +217,10 @@ class Decoder(nn.Module):
         
     def forward(self, x, memory, tgt_mask):
         for layer in self.layers:
-            x = layer(x, memory, tgt_mask)
+            if self.checkpoint and self.training and torch.is_grad_enabled():
+                x = checkpoint(layer, x, memory, tgt_mask, use_reentrant=False)
+            else:
+                x = layer(x, memory, tgt_mask)
         return self.norm(x)
 
 
@@ -271,7 +284,39 @@ class Depth_Pointwise_Conv1d(nn.Module):
     
 
 
+def chunked_attention(q, k, v, d_k, dropout, attention_mask=None, attention_weights=None, chunk_size=None):
+    '''
+    softmax(q k / sqrt(d_k)) v for q:(b_s, h, nq, d_k), k:(b_s, h, d_k, nk), v:(b_s, h, nk, d_v).
+    With chunk_size the query rows are processed in slices, so only a
+    (chunk_size, nk) block of scores exists at a time; every row of the
+    softmax sees all keys, so the result is the full product up to float
+    rounding (the matmuls are blocked differently).
+    '''
+    nq = q.shape[-2]
+    if chunk_size is None or nq <= chunk_size:
+        chunk_size = nq
+    outs = []
+    for start in range(0, nq, chunk_size):
+        end = start + chunk_size
+        att = torch.matmul(q[:, :, start:end], k) / np.sqrt(d_k)  # (b_s, h, chunk, nk)
+        if attention_weights is not None:
+            att = att * _rows(attention_weights, start, end, nq)
+        if attention_mask is not None:
+            att = att.masked_fill(_rows(attention_mask, start, end, nq), -np.inf)
+        att = torch.softmax(att, -1)
+        att = dropout(att)
+        outs.append(torch.matmul(att, v))
+    return outs[0] if len(outs) == 1 else torch.cat(outs, dim=-2)
+
+
+def _rows(t, start, end, nq):
+    "query rows of a mask/weight that may broadcast along the query axis"
+    return t[..., start:end, :] if t.dim() >= 2 and t.shape[-2] == nq else t
+
+
 class MUSEAttention(nn.Module):
+    # split the query rows of the (nq, nk) attention into slices of this size
+    chunk_size = None
 
     def __init__(self, d_model, d_k, d_v, h,dropout=.1):
 
@@ -334,15 +379,8 @@ class MUSEAttention(nn.Module):
         k = self.fc_k(keys).view(b_s, nk, self.h, self.d_k).permute(0, 2, 3, 1)  # (b_s, h, d_k, nk)
         v = self.fc_v(values).view(b_s, nk, self.h, self.d_v).permute(0, 2, 1, 3)  # (b_s, h, nk, d_v)
 
-        att = torch.matmul(q, k) / np.sqrt(self.d_k)  # (b_s, h, nq, nk)
-        if attention_weights is not None:
-            att = att * attention_weights
-        if attention_mask is not None:
-            att = att.masked_fill(attention_mask, -np.inf)
-        att = torch.softmax(att, -1)
-        att=self.dropout(att)
-
-        out = torch.matmul(att, v).permute(0, 2, 1, 3).contiguous().view(b_s, nq, self.h * self.d_v)  # (b_s, nq, h*d_v)
+        out = chunked_attention(q, k, v, self.d_k, self.dropout, attention_mask, attention_weights,
+                                self.chunk_size).permute(0, 2, 1, 3).contiguous().view(b_s, nq, self.h * self.d_v)  # (b_s, nq, h*d_v)
         # print("OUT::",out.shape)
         out = self.fc_o(out)  # (b_s, nq, d_model)
 
@@ -448,6 +486,8 @@ class MUSEAttention(nn.Module):
 ''' 
         
 class MUSEAttention1(nn.Module):
+    # split the query rows of the (nq, nk) attention into slices of this size
+    chunk_size = None
 
     def __init__(self, d_model, d_k, d_v, h,dropout=.1):
 
@@ -510,15 +550,8 @@ class MUSEAttention1(nn.Module):
         k = self.fc_k(keys).view(b_s, nk, self.h, self.d_k).permute(0, 2, 3, 1)  # (b_s, h, d_k, nk)
         v = self.fc_v(values).view(b_s, nk, self.h, self.d_v).permute(0, 2, 1, 3)  # (b_s, h, nk, d_v)
 
-        att = torch.matmul(q, k) / np.sqrt(self.d_k)  # (b_s, h, nq, nk)
-        if attention_weights is not None:
-            att = att * attention_weights
-        if attention_mask is not None:
-            att = att.masked_fill(attention_mask, -np.inf)
-        att = torch.softmax(att, -1)
-        att=self.dropout(att)
-
-        out = torch.matmul(att, v).permute(0, 2, 1, 3).contiguous().view(b_s, nq, self.h * self.d_v)  # (b_s, nq, h*d_v)
+        out = chunked_attention(q, k, v, self.d_k, self.dropout, attention_mask, attention_weights,
+                                self.chunk_size).permute(0, 2, 1, 3).contiguous().view(b_s, nq, self.h * self.d_v)  # (b_s, nq, h*d_v)
         # print("OUT::",out.shape)
         out = self.fc_o(out)  # (b_s, nq, d_model)
 
@@ -622,6 +655,8 @@ class MUSEAttention1(nn.Module):
 '''
 
 class MUSEAttention2(nn.Module):
+    # split the query rows of the (nq, nk) attention into slices of this size
+    chunk_size = None
 
     def __init__(self, d_model, d_k, d_v, h,dropout=.1):
 
@@ -686,15 +721,8 @@ class MUSEAttention2(nn.Module):
         k = self.fc_k(keys).view(b_s, nk, self.h, self.d_k).permute(0, 2, 3, 1)  # (b_s, h, d_k, nk)
         v = self.fc_v(values).view(b_s, nk, self.h, self.d_v).permute(0, 2, 1, 3)  # (b_s, h, nk, d_v)
 
-        att = torch.matmul(q, k) / np.sqrt(self.d_k)  # (b_s, h, nq, nk)
-        if attention_weights is not None:
-            att = att * attention_weights
-        if attention_mask is not None:
-            att = att.masked_fill(attention_mask, -np.inf)
-        att = torch.softmax(att, -1)
-        att=self.dropout(att)
-
-        out = torch.matmul(att, v).permute(0, 2, 1, 3).contiguous().view(b_s, nq, self.h * self.d_v)  # (b_s, nq, h*d_v)
+        out = chunked_attention(q, k, v, self.d_k, self.dropout, attention_mask, attention_weights,
+                                self.chunk_size).permute(0, 2, 1, 3).contiguous().view(b_s, nq, self.h * self.d_v)  # (b_s, nq, h*d_v)
         # print("OUT::",out.shape)
         out = self.fc_o(out)  # (b_s, nq, d_model)
 
@@ -6,6 +6,9 @@ import matplotlib.pyplot as plt
 from scipy.sparse.linalg import eigs
 
 
+def get_device(module):
+    return next(module.parameters()).device
+
 def get_adj(nums):
     A = np.zeros((int(nums), int(nums)), dtype = np.float32)
     stride = int(np.sqrt(nums))
@@ -83,6 +86,78 @@ def getA_corr(x):
 
     return F.softmax(A.reshape(bs,1,-1),dim=-1).reshape(bs,N,N)
 
+def topk_index(x,k,mode,chunk_size,rows=None):
+    '''
+    top-k neighbours of every node by |correlation| ('corr', without the node
+    itself) or cosine similarity ('cos'), the ranking of getA_corr/getA_cosin
+    computed in float64 without the dense (bs,N,N) softmax: similarities are
+    built for chunk_size rows at a time. Every row is ranked on its own, so the
+    result does not depend on chunk_size or rows. Constant cells have no
+    correlation, their similarity to every cell is 0 (np.corrcoef gives NaN).
+    rows limits the search to the neighbours of those nodes.
+    x: bs*flow*N*c -> index: bs*N*k (bs*len(rows)*k)
+    '''
+    (bs,flow,N,c) = x.shape
+    x = x.transpose(1,2).contiguous().view((bs,N,c*flow)).double()
+    if(mode=='corr'):
+        x = x - x.mean(-1,keepdim=True)
+    z = x/torch.norm(x,2,dim=-1,keepdim=True).clamp_min(1e-12)
+    if rows is None:
+        rows = torch.arange(N)
+    index = torch.zeros((bs,len(rows),k),dtype=torch.long)
+    for start in range(0,len(rows),chunk_size):
+        end = min(start+chunk_size,len(rows))
+        A = z[:,rows[start:end]].matmul(z.transpose(1,2))
+        if(mode=='corr'):
+            A = A.abs()
+            A[:,torch.arange(end-start),rows[start:end]] = -1e9
+        index[:,start:end] = torch.topk(A,k,dim=-1).indices
+    return index
+
+def history_topk(data,k,mode,chunk_size=1024):
+    '''
+    static top-k graph of a whole series, for callers that cannot afford the
+    per-sample search. data: T*flow*N -> index: N*k
+    '''
+    x = torch.as_tensor(data).float().permute((1,2,0)).unsqueeze(0)
+    return topk_index(x,k,mode,chunk_size)[0]
+
+def window_topk(x_c,k,mode,batch_size=64,chunk_size=1024,out=None):
+    '''
+    per-window top-k index the model would compute in forward, for a whole
+    array of closeness windows at once, so it is paid once per dataset instead
+    of once per epoch. Adjacency ranks with topk_index as well, on the same
+    float32 input, and the ranking does not depend on chunk_size, so the
+    index is the one forward would search. out: an int32 array to fill (e.g. a memmap).
+    x_c: n*closeness*flow*N -> index: n*N*k (int32)
+    '''
+    n,N = len(x_c),x_c.shape[-1]
+    out = np.zeros((n,N,k),dtype=np.int32) if out is None else out
+    for start in range(0,n,batch_size):
+        x = torch.from_numpy(np.array(x_c[start:start+batch_size])).float().permute((0,2,3,1))
+        out[start:start+len(x)] = topk_index(x,k,mode,chunk_size).numpy()
+    return out
+
+def topk_weights(x,index,mode):
+    '''
+    edge weights of a top-k graph: softmax over the k neighbours of the
+    similarity getA_cosin/getA_corr would give them, computed for the N*k
+    edges only. The same as renormalizing the rows of the dense adjacency
+    over the selected neighbours.
+    x: bs*flow*N*c, index: bs*N*k -> weight: bs*N*k
+    '''
+    (bs,flow,N,c) = x.shape
+    k = index.shape[-1]
+    x = x.transpose(1,2).contiguous().view((bs,N,c*flow))
+    if(mode=='corr'):
+        x = x - x.mean(-1,keepdim=True)
+    z = x/torch.norm(x,2,dim=-1,keepdim=True).clamp_min(1e-12)
+    neighbours = z.gather(1,index.reshape(bs,N*k,1).expand(-1,-1,z.shape[-1])).view(bs,N,k,-1)
+    A = (z.unsqueeze(2)*neighbours).sum(-1)
+    if(mode=='corr'):
+        A = A.abs()
+    return F.softmax(A,dim=-1)
+
 def getadj(x):
     (bs,flow,N,c) = x.shape
     x = x.transpose(1,2).contiguous().view((bs,N,c*flow)).numpy()
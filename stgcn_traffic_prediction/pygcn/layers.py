@@ -42,3 +42,22 @@ class GraphConvolution(Module):
         return self.__class__.__name__ + ' (' \
                + str(self.in_features) + ' -> ' \
                + str(self.out_features) + ')'
+
+
+class SparseGraphConvolution(GraphConvolution):
+    """
+    GCN layer over a per-sample k-neighbour graph: every node sums the
+    weighted features of its k neighbours, O(bs*N*k*d) instead of the
+    O(bs*N^2*d) of a dense adjacency
+    input: bs*N*in_features, index: bs*N*k neighbours, weight: bs*N*k
+    """
+
+    def forward(self, input, index, weight):
+        support = torch.matmul(input, self.weight)
+        bs, N, k = index.shape
+        neighbours = support.gather(1, index.reshape(bs, N * k, 1).expand(-1, -1, support.shape[-1]))
+        output = (weight.unsqueeze(-1) * neighbours.view(bs, N, k, -1)).sum(2)
+        if self.bias is not None:
+            return output + self.bias
+        else:
+            return output
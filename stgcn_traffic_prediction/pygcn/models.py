@@ -1,6 +1,6 @@
 import torch.nn as nn
 import torch.nn.functional as F
-from .layers import GraphConvolution
+from .layers import GraphConvolution,SparseGraphConvolution
 import torch
 
 class GCN(nn.Module):
@@ -20,3 +20,18 @@ class GCN(nn.Module):
 
         #print('after gcn:\n',x)
         return x 
+
+
+class DynamicGCN(nn.Module):
+    '''two layer GCN over a per-sample k-neighbour graph (index, weight: bs*N*k)'''
+    def __init__(self, nfeat, nhid, nclass, dropout):
+        super(DynamicGCN, self).__init__()
+
+        self.gc1 = SparseGraphConvolution(nfeat, nhid)
+        self.gc2 = SparseGraphConvolution(nhid, nclass)
+        self.dropout = dropout
+
+    def forward(self, x, index, weight):
+        x = F.relu(self.gc1(x, index, weight))
+        x = F.dropout(x, self.dropout, training=self.training)
+        return self.gc2(x, index, weight)
@@ -0,0 +1,36 @@
+import sys
+import json
+sys.path.append('../../')
+from stgcn_traffic_prediction.dataloader.store import build_store,open_store
+from stgcn_traffic_prediction.utils.backtest import cutoffs,backtest
+from stgcn_traffic_prediction.utils.parser import getparse,get_model_filename
+
+'''
+rolling-origin backtest of the best checkpoint: every -backtest_stride hours a
+new cutoff scores the next -backtest_horizon hours, windows run in a pool of
+-workers processes, e.g.
+python backtest.py -s -FS -backtest_horizon 168 -backtest_stride 24 -workers 8
+'''
+
+if __name__ == '__main__':
+    opt = getparse(sys.argv[1:])
+    opt.save_dir = '{}/{}'.format(opt.save_dir, opt.traffic)
+    opt.model_filename = get_model_filename(opt)
+
+    store = build_store('../all_data_sliced.h5', opt.nb_flow, opt.traffic)
+    horizon = opt.backtest_horizon or opt.test_size
+    origins = cutoffs(len(open_store(store)), opt, horizon, opt.backtest_stride, opt.backtest_start, opt.backtest_end)
+    print('backtesting {} cutoffs of {} hours with {} workers'.format(len(origins), horizon, opt.workers))
+    report = backtest(opt, opt.model_filename + '.model', store, origins, horizon, opt.workers,
+                      opt.worker_threads, opt.batch_size)
+
+    print('{:>8} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12}'.format('cutoff', 'MAE', 'RMSE', 'NRMSE', 'R2',
+                                                                   'Real MAE', 'Real RMSE'))
+    for r in report['windows'] + [dict(report['overall'], cutoff='all')]:
+        print('{:>8} {:>10.5f} {:>10.5f} {:>10.5f} {:>10.5f} {:>12.5f} {:>12.5f}'.format(
+            r['cutoff'], r['mae'], r['rmse'], r['nrmse'], r['r2'], r['real_mae'], r['real_rmse']))
+    print('real MAE per hour of day: ' + ' '.join('{:d}:{:0.3f}'.format(h, v)
+                                                  for h, v in enumerate(report['per_hour']['real_mae'])))
+    with open(opt.model_filename + '.backtest.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Saving to ' + opt.model_filename + '.backtest.json')
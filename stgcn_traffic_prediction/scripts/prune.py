@@ -0,0 +1,41 @@
+import sys
+import itertools
+import torch
+from torch import nn
+sys.path.append('../../')
+from stgcn_traffic_prediction.utils.trainer import build_data,build_loaders,load_model
+from stgcn_traffic_prediction.models.prune import prune,finetune,evaluate,measure_latency
+from stgcn_traffic_prediction.utils.parser import getparse,get_model_filename
+
+'''
+prune attention heads and encoder/decoder layers of the best checkpoint until
+a forward of one batch fits the latency budget on this host, then fine-tune, e.g.
+python prune.py -s -FS -target_latency 50 -prune_epochs 2
+'''
+
+if __name__ == '__main__':
+    torch.manual_seed(22)
+    opt = getparse(sys.argv[1:])
+    opt.save_dir = '{}/{}'.format(opt.save_dir, opt.traffic)
+    opt.model_filename = get_model_filename(opt)
+
+    train_data, test_data, mmn = build_data(opt, '../all_data_sliced.h5')
+    train_loader, valid_loader, _ = build_loaders(opt, train_data, test_data)
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = load_model(opt, opt.model_filename + '.model', device)
+    criterion = nn.L1Loss() if opt.loss == 'l1' else nn.MSELoss()
+
+    batches = list(itertools.islice(valid_loader, opt.prune_batches))
+    model, report = prune(model, batches, batches[0], opt.target_latency, opt, criterion, opt.prune_step)
+    if opt.prune_epochs > 0:
+        model = finetune(model, train_loader, opt, criterion, opt.prune_epochs, opt.lr or 1e-4)
+        report.append({'removed': 'finetune', 'latency_ms': measure_latency(model, batches[0], opt),
+                       'valid_loss': evaluate(model, list(valid_loader), opt, criterion),
+                       'params': sum(p.numel() for p in model.parameters())})
+
+    print('{:<60} {:>12} {:>14} {:>10}'.format('removed', 'latency(ms)', 'valid_loss', 'params'))
+    for row in report:
+        print('{:<60} {:>12.2f} {:>14.8f} {:>10d}'.format(row['removed'][:60], row['latency_ms'], row['valid_loss'], row['params']))
+    torch.save({'model': model, 'report': report}, opt.model_filename + '.pruned.model')
+    print('Saving to ' + opt.model_filename + '.pruned.model')
@@ -0,0 +1,33 @@
+import sys
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.utils.trainer import build_data,build_loaders,load_model
+from stgcn_traffic_prediction.models.quantization import quantize,compare
+from stgcn_traffic_prediction.utils.parser import getparse,get_model_filename
+
+'''
+export a dynamic int8 copy of the best checkpoint for CPU serving, e.g.
+python quantize.py -s -FS
+the int8 model is validated against the float model on the test split
+'''
+
+if __name__ == '__main__':
+    opt = getparse(sys.argv[1:])
+    opt.save_dir = '{}/{}'.format(opt.save_dir, opt.traffic)
+    opt.model_filename = get_model_filename(opt)
+
+    train_data, test_data, mmn = build_data(opt, '../all_data_sliced.h5')
+    _, _, test_loader = build_loaders(opt, train_data, test_data)
+
+    model = load_model(opt, opt.model_filename + '.model', 'cpu')
+    q_model = quantize(model)
+    report = compare(model, q_model, test_loader, opt, opt.quant_batches)
+
+    log_string = (' [int8 MAE]:{:0.6f}, [int8 RMSE]:{:0.6f}, [int8 max err]:{:0.6f}\n'
+                  ' [size] float:{:0.2f}MB int8:{:0.2f}MB\n'
+                  ' [latency] float:{:0.2f}ms int8:{:0.2f}ms').format(
+                      report['mae'], report['rmse'], report['max_err'], report['float_mb'],
+                      report['int8_mb'], report['float_ms'], report['int8_ms'])
+    print(log_string)
+    torch.save({'model': q_model, 'report': report}, opt.model_filename + '.int8.model')
+    print('Saving to ' + opt.model_filename + '.int8.model')
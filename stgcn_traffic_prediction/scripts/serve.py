@@ -0,0 +1,51 @@
+import sys
+import asyncio
+import h5py
+import torch
+sys.path.append('../../')
+from stgcn_traffic_prediction.dataloader.store import build_store,open_store
+from stgcn_traffic_prediction.dataloader.ordering import file_order
+from stgcn_traffic_prediction.utils.serving import Forecaster,MicroBatcher,ForecastServer
+from stgcn_traffic_prediction.utils.trainer import load_model,load_mmn
+from stgcn_traffic_prediction.utils.parser import getparse,get_model_filename
+
+'''
+local forecast service for the best checkpoint (or an exported model), requests
+are coalesced into micro-batches, e.g.
+python serve.py -s -FS -port 8080 -max_batch 32 -max_wait_ms 5 -serve_threads 2
+curl -d '{"timestamp": "2013-12-20 10:00", "cells": [0, 1, 2]}' localhost:8080/forecast
+curl localhost:8080/metrics
+'''
+
+
+def start_time(path):
+    "timestamp of the first hour of the h5 file, None when idx holds no timestamps"
+    with h5py.File(path, 'r') as f:
+        first = f['idx'][0] if 'idx' in f else None
+    if isinstance(first, bytes):
+        first = first.decode()
+    return first if isinstance(first, str) else None
+
+
+async def main(opt, path):
+    torch.set_num_threads(opt.worker_threads)
+    data = open_store(build_store(path, opt.nb_flow, opt.traffic))
+    mmn = load_mmn(opt.model_filename + '.model', data, opt.test_size)
+    model = load_model(opt, opt.serve_model or opt.model_filename + '.model')
+    if model.order is None:
+        # checkpoints written before the order was stored
+        model.set_order(file_order(path, opt.order))
+    forecaster = Forecaster(model, opt, mmn, data, start_time(path), replicas=opt.serve_threads)
+    server = await ForecastServer(MicroBatcher(forecaster, opt.max_batch, opt.max_wait_ms, opt.serve_threads),
+                                  opt.host, opt.port).start()
+    print('serving {} cells on http://{}:{} (hours {} to {})'.format(forecaster.cells, opt.host, server.port,
+                                                                    forecaster.timestamp(forecaster.first),
+                                                                    forecaster.timestamp(len(data))))
+    await server.serve_forever()
+
+
+if __name__ == '__main__':
+    opt = getparse(sys.argv[1:])
+    opt.save_dir = '{}/{}'.format(opt.save_dir, opt.traffic)
+    opt.model_filename = get_model_filename(opt)
+    asyncio.run(main(opt, '../all_data_sliced.h5'))
@@ -0,0 +1,36 @@
+import os
+import sys
+import json
+sys.path.append('../../')
+from stgcn_traffic_prediction.utils.sweep import sweep
+from stgcn_traffic_prediction.utils.parser import getparse
+
+'''
+hyperparameter sweep over a JSON search space {option: [values]}, e.g.
+python sweep.py -s -FS -k 3 -epoch_size 20 -space space.json -search random -trials 16 -workers 4 -worker_threads 2
+every other option is the base configuration of all trials
+'''
+
+if __name__ == '__main__':
+    opt = getparse(sys.argv[1:])
+    with open(opt.space) as f:
+        space = json.load(f)
+    sweep_dir = '{}/{}/sweep'.format(opt.save_dir, opt.traffic)
+    results = sweep(sys.argv[1:], space, '../all_data_sliced.h5', sweep_dir, opt.search, opt.trials, opt.workers,
+                    opt.worker_threads, opt.grace_epochs)
+
+    names = sorted(space)
+    print(' '.join('{:>12}'.format(n[:12]) for n in ['trial'] + names + ['epochs', 'valid_loss', 'real_mae',
+                                                                          'real_rmse', 'time(s)']))
+    for r in results:
+        if 'error' in r:
+            print('{:>12} {}'.format(r['trial'], r['error']))
+            continue
+        status = 'stopped' if r['stopped'] else ''
+        print(' '.join('{:>12}'.format(str(v)) for v in [r['trial']] + [r[n] for n in names] + [r['epochs']]) +
+              ' {:>12.8f} {:>12} {:>12} {:>12.1f} {}'.format(
+                  r['best_valid_loss'], '{:0.5f}'.format(r['real_mae']) if 'real_mae' in r else '-',
+                  '{:0.5f}'.format(r['real_rmse']) if 'real_rmse' in r else '-', r['time'], status))
+    with open(os.path.join(sweep_dir, 'sweep.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Saving to ' + os.path.join(sweep_dir, 'sweep.json'))
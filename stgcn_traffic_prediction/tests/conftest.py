@@ -0,0 +1,32 @@
+import os
+import sys
+import pytest
+import torch
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../'))
+from stgcn_traffic_prediction.utils.parser import getparse
+from stgcn_traffic_prediction.utils.trainer import build_model
+
+
+def small_opt(*args):
+    "a small model on the spatial/period/FS path (the close branch and k != 3 do not fit the MUSE shapes)"
+    return getparse(['-s', '-FS', '-k', '3', '-model_N', '1', '-s_model_d', '16', '-c_model_d', '16',
+                     '-p_model_d', '16'] + list(args))
+
+
+def small_batch(bs=2, N=36, close_size=3, period_size=3, nb_flow=1, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    c = torch.rand(bs, close_size, nb_flow, N, generator=g)
+    p = torch.rand(bs, period_size, close_size, nb_flow, N, generator=g)
+    y = torch.rand(bs, close_size, nb_flow, N, generator=g)
+    return [c, p, y]
+
+
+@pytest.fixture
+def opt():
+    return small_opt()
+
+
+@pytest.fixture
+def model(opt):
+    torch.manual_seed(0)
+    return build_model(opt).eval()
@@ -0,0 +1,27 @@
+import pytest
+import torch
+from stgcn_traffic_prediction.models.ann import IVFIndex
+from stgcn_traffic_prediction.models.utils import topk_index
+
+
+def _series(T=48, N=20, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    return torch.rand(T, N, generator=g) + torch.linspace(0, 1, N)[torch.randperm(N, generator=g)] * \
+        torch.sin(torch.arange(T).float() / 4).unsqueeze(-1)
+
+
+@pytest.mark.parametrize('mode', ['corr', 'cos'])
+def test_full_probe_and_window_is_exact(mode):
+    x = _series()
+    # every list probed and every cell kept for the exact rescoring over the whole series
+    index = IVFIndex(20, dim=16, nlist=4, nprobe=4, mode=mode, window=48, rerank=7).update(x)
+    expected = topk_index(x.t().reshape(1, 1, 20, 48), 3, mode, 20)[0]
+    assert torch.equal(index.search(3), expected)
+
+
+def test_update_in_parts_equals_one_update():
+    x = _series(T=60)
+    whole = IVFIndex(20, dim=16, window=30).update(x)
+    parts = IVFIndex(20, dim=16, window=30).update(x[:25]).update(x[25:])
+    assert torch.allclose(parts.embeddings(), whole.embeddings(), atol=1e-6)
+    assert torch.equal(parts.recent(), whole.recent())
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import torch
+from stgcn_traffic_prediction.models.model import T_STGCN
+from stgcn_traffic_prediction.utils import trainer
+from stgcn_traffic_prediction.utils.trainer import build_model,load_model,load_mmn
+from conftest import small_opt,small_batch
+
+
+def test_build_model_sizes():
+    model = build_model(small_opt('-s_model_d', '8', '-c_model_d', '32'))
+    reference = T_STGCN(3, 6, 1, 3, 'transformer', 8, 32, 16, 64)
+    assert {k: v.shape for k, v in model.state_dict().items()} == \
+           {k: v.shape for k, v in reference.state_dict().items()}
+
+
+def _trainer(opt, tmp_path):
+    from torch.utils.data import DataLoader
+    from stgcn_traffic_prediction.utils.trainer import Trainer
+    c, p, y = small_batch(bs=8)
+    data = list(zip(c, p, y))
+    tmp_path.mkdir(exist_ok=True)
+    opt.model_filename = str(tmp_path / 'run')
+    opt.best_valid_loss = float('inf')
+    torch.manual_seed(0)
+    return Trainer(opt, build_model(opt), DataLoader(data, 4), DataLoader(data, 4), device=torch.device('cpu'))
+
+
+def test_resume_continues_the_run(tmp_path):
+    opt = small_opt('-lr', '0.01', '-lr-scheduler', 'cos', '-warmup', '1')
+    straight = _trainer(opt, tmp_path / 'a')
+    straight.fit(3)
+    straight.close()
+    assert not trainer._log_files
+
+    # a 3-epoch run that ends after its first epoch
+    first = _trainer(opt, tmp_path / 'b')
+    first.fit(3, lambda epoch, valid_loss: True)
+    first.close()
+    resumed = _trainer(opt, tmp_path / 'b')
+    resumed.resume(opt.model_filename + '.last.model')
+    assert resumed.start_epoch == 1
+    resumed.fit(2)
+    resumed.close()
+    assert resumed.train_loss == pytest.approx(straight.train_loss, rel=1e-5)
+    assert resumed.optimizer.param_groups[0]['lr'] == pytest.approx(straight.optimizer.param_groups[0]['lr'])
+
+
+def test_load_mmn_of_a_whole_model_pickle(tmp_path):
+    data = np.arange(40, dtype=np.float32).reshape(10, 1, 4)
+    torch.save({'model': build_model(small_opt()), 'epoch': 0, 'valid_loss': [1.]}, str(tmp_path / 'old.model'))
+    mmn = load_mmn(str(tmp_path / 'old.model'), data, 2)
+    assert (mmn.min, mmn.max) == (0, 31)
+    torch.save({'model': {}, 'mmn': {'min': 1., 'max': 5.}}, str(tmp_path / 'new.model'))
+    mmn = load_mmn(str(tmp_path / 'new.model'), data, 2)
+    assert (mmn.min, mmn.max) == (1., 5.)
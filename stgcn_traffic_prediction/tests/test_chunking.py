@@ -0,0 +1,47 @@
+import torch
+from stgcn_traffic_prediction.models.model import forward_batch
+from stgcn_traffic_prediction.models.utils import topk_index
+from conftest import small_batch
+
+
+def grid(N=36, bs=2, seed=0):
+    "closeness features bs*flow*N*c with a constant cell and two duplicated cells"
+    x = torch.rand(bs, 1, N, 6, generator=torch.Generator().manual_seed(seed))
+    x[:, :, 3] = 0.5
+    x[:, :, 10] = x[:, :, 20]
+    return x
+
+
+def test_topk_index_does_not_depend_on_chunking():
+    for mode in ('corr', 'cos'):
+        x = grid()
+        full = topk_index(x, 5, mode, x.shape[2])
+        for chunk in (1, 7, 16):
+            assert torch.equal(topk_index(x, 5, mode, chunk), full)
+
+
+def test_topk_index_rows_match_full_search():
+    x = grid()
+    rows = torch.tensor([0, 3, 10, 20, 35])
+    assert torch.equal(topk_index(x, 5, 'corr', 2, rows=rows), topk_index(x, 5, 'corr', 36)[:, rows])
+
+
+def test_topk_index_constant_cells():
+    x = grid()
+    index = topk_index(x, 5, 'corr', 4)
+    # no NaN ranking: the constant cell is nobody's neighbour, itself is never its own
+    assert not (index == 3).any()
+    assert not (index == torch.arange(36).view(1, -1, 1)).any()
+    # a duplicated cell is the closest neighbour of its copy
+    assert (index[:, 10, 0] == 20).all() and (index[:, 20, 0] == 10).all()
+
+
+def test_chunked_forward_matches_unchunked(model, opt):
+    batch = small_batch()
+    batch[0][:, :, :, 3] = 0.5
+    with torch.no_grad():
+        full = forward_batch(model, batch, opt)
+        model.set_chunk_size(5)
+        chunked = forward_batch(model, batch, opt)
+    assert torch.isfinite(full).all()
+    assert torch.allclose(chunked, full, atol=1e-5)
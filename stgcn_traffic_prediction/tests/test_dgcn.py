@@ -0,0 +1,42 @@
+import pytest
+import torch
+from stgcn_traffic_prediction.models.model import forward_batch,select_target
+from stgcn_traffic_prediction.models.utils import getA_corr,getA_cosin,topk_index,topk_weights
+from stgcn_traffic_prediction.pygcn.layers import GraphConvolution,SparseGraphConvolution
+from stgcn_traffic_prediction.utils.trainer import build_model
+from conftest import small_opt,small_batch
+
+
+@pytest.mark.parametrize('mode,dense', [('corr', getA_corr), ('cos', getA_cosin)])
+def test_topk_weights_are_renormalized_adjacency_rows(mode, dense):
+    torch.manual_seed(0)
+    x = torch.rand(2, 1, 10, 3)
+    index = topk_index(x, 3, mode, 10)
+    A = dense(x).gather(2, index)
+    assert torch.allclose(topk_weights(x, index, mode), A / A.sum(-1, keepdim=True), atol=1e-5)
+
+
+def test_sparse_layer_matches_dense_layer():
+    torch.manual_seed(0)
+    bs, N, k = 2, 10, 4
+    x = torch.rand(bs, N, 3)
+    index = torch.randint(0, N, (bs, N, k))
+    weight = torch.softmax(torch.rand(bs, N, k), -1)
+    # duplicate neighbours add up in the dense adjacency as in the sparse sum
+    adj = torch.zeros(bs, N, N).scatter_add_(2, index, weight)
+    sparse = SparseGraphConvolution(3, 16)
+    dense = GraphConvolution(3, 16)
+    dense.load_state_dict(sparse.state_dict())
+    assert torch.allclose(sparse(x, index, weight), dense(x, adj), atol=1e-5)
+
+
+def test_dgcn_forward_backward():
+    opt = small_opt('-spatial', 'dgcn')
+    torch.manual_seed(0)
+    model = build_model(opt).train()
+    batch = small_batch()
+    pred = forward_batch(model, batch, opt)
+    assert pred.shape == select_target(batch[-1], opt).shape and torch.isfinite(pred).all()
+    torch.nn.functional.mse_loss(pred, select_target(batch[-1], opt)).backward()
+    grads = [p.grad for p in model.spatial.parameters()]
+    assert all(g is not None and torch.isfinite(g).all() for g in grads)
@@ -0,0 +1,48 @@
+import torch
+from stgcn_traffic_prediction.models.model import forward_batch,forecast_cells,sample_subgraph,subgraph,\
+    subgraph_index
+from stgcn_traffic_prediction.models.utils import history_topk
+from stgcn_traffic_prediction.utils.tiling import TiledExecutor
+from stgcn_traffic_prediction.utils.trainer import build_model
+from conftest import small_batch
+
+
+def static_graph(N=36):
+    return history_topk(torch.rand(48, 1, N, generator=torch.Generator().manual_seed(1)), 3, 'corr')
+
+
+def test_graph_is_saved_with_the_model(model, opt):
+    model.set_graph(static_graph())
+    restored = build_model(opt)
+    restored.load_state_dict(model.state_dict())
+    assert torch.equal(restored.adjacency.graph, model.adjacency.graph)
+
+
+def test_forecast_cells_with_model_graph(model, opt):
+    model.set_graph(static_graph())
+    batch = small_batch()
+    cells = torch.tensor([1, 7, 30])
+    with torch.no_grad():
+        full = forward_batch(model, batch, opt)
+        few = forecast_cells(model, batch, opt, cells)
+        whole = forecast_cells(model, batch, opt, cells, context=36)
+    assert few.shape == full[..., cells].shape
+    assert torch.allclose(whole, full[..., cells], atol=1e-5)
+
+
+def test_subgraph_keeps_target_graph_neighbours():
+    graph = static_graph()
+    batch = small_batch()
+    nodes = sample_subgraph(batch[0], 'corr', 3, 4, graph)
+    index = subgraph_index(graph, subgraph(batch[0], nodes), 'corr', 3, nodes)
+    # the first 4 nodes are the targets, their local neighbours are their graph rows
+    assert torch.equal(nodes.gather(1, index[:, :4].reshape(len(nodes), -1)).view(-1, 4, 3), graph[nodes[:, :4]])
+
+
+def test_tiles_with_model_graph(model, opt):
+    model.set_graph(static_graph())
+    batch = small_batch()
+    with torch.no_grad():
+        full = forward_batch(model, batch, opt)
+        tiled = TiledExecutor(model, opt, tile=6, halo=0, workers=0)(batch, 6, 6)
+    assert torch.allclose(tiled, full, atol=1e-5)
@@ -0,0 +1,17 @@
+import copy
+import torch
+from stgcn_traffic_prediction.models.model import forward_batch
+from conftest import small_opt,small_batch
+
+
+def test_multi_flow_matches_per_flow_runs(model):
+    batch = small_batch(nb_flow=2)
+    with torch.no_grad():
+        # bs*closeness*nb_flow*N in one pass
+        together = forward_batch(copy.deepcopy(model), batch, small_opt('-nb_flow', '2', '-multi_flow'))
+        single = small_opt('-nb_flow', '2', '-flow', '0')
+        assert torch.allclose(together[:, :, 0], forward_batch(copy.deepcopy(model), batch, single), atol=1e-5)
+        # -flow 1 with -FS indexes the one-flow temporal output, so flow 1 runs as
+        # flow 0 of the swapped batch (the top-k over both flows does not change)
+        swapped = [x.flip(-2) for x in batch]
+        assert torch.allclose(together[:, :, 1], forward_batch(copy.deepcopy(model), swapped, single), atol=1e-5)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import torch
+from stgcn_traffic_prediction.dataloader.generate_synthetic_data import generate
+from stgcn_traffic_prediction.dataloader.ordering import cell_order
+from stgcn_traffic_prediction.dataloader.store import build_store,open_store
+from stgcn_traffic_prediction.models.MinMaxNorm import MinMaxNorm01
+from stgcn_traffic_prediction.utils import backtest
+from stgcn_traffic_prediction.utils.parser import get_model_filename
+from stgcn_traffic_prediction.utils.trainer import build_model,load_model
+from conftest import small_opt
+
+
+def test_order_is_part_of_the_model_filename():
+    row = get_model_filename(small_opt())
+    assert row.endswith('model_d=16-16-16-64')
+    assert get_model_filename(small_opt('-order', 'hilbert')) == row + '-order=hilbert'
+    assert get_model_filename(small_opt('-multi_flow')) == row + '-multi_flow'
+    assert get_model_filename(small_opt('-order', 'zorder', '-multi_flow')) == row + '-order=zorder-multi_flow'
+
+
+def test_load_model_restores_the_order(tmp_path):
+    opt = small_opt('-spatial', 'gcn')
+    model = build_model(opt)
+    order = cell_order('hilbert', 6, 6)
+    torch.save({'model': model.state_dict(), 'order': [int(i) for i in order]}, str(tmp_path / 'm.model'))
+    loaded = load_model(opt, str(tmp_path / 'm.model'))
+    assert np.array_equal(loaded.order, order)
+    assert np.array_equal(loaded.spatial.order, order)
+
+
+def test_backtest_of_an_ordered_model_is_row_major(tmp_path):
+    path = generate(str(tmp_path / 'g.h5'), 24 * 9, 6, 6)
+    order = cell_order('hilbert', 6, 6)
+    store = build_store(path, 1, 'internet')
+    assert np.array_equal(open_store(build_store(path, 1, 'internet', order='hilbert')), open_store(store)[..., order])
+    opt = small_opt('-spatial', 'gcn')
+    torch.manual_seed(0)
+    model = build_model(opt).eval()
+    data = open_store(store)
+    mmn = MinMaxNorm01()
+    mmn.fit(data)
+    results = []
+    for o in (None, order):
+        model.set_order(o)
+        backtest._worker.update(opt=opt, data=data, mmn=mmn, model=model)
+        results.append(backtest._evaluate(24 * 8, 8, 4)[1])
+    assert np.allclose(results[0].per_cell()['mae'], results[1].per_cell()['mae'], atol=1e-5)
+
+
+def test_cutoffs_without_a_window():
+    opt = small_opt()
+    assert backtest.cutoffs(200, opt, 24, 24) == [72, 96, 120, 144, 168]
+    with pytest.raises(ValueError, match='start'):
+        backtest.cutoffs(200, opt, 168, 24)
+    with pytest.raises(ValueError):
+        backtest.cutoffs(200, opt, 24, 24, start=150, end=160)
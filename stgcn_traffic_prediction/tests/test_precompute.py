@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import torch
+from stgcn_traffic_prediction.dataloader.generate_synthetic_data import generate
+from stgcn_traffic_prediction.models.model import Adjacency,forward_batch
+from stgcn_traffic_prediction.models.utils import window_topk
+from stgcn_traffic_prediction.utils.trainer import build_data
+from conftest import small_opt
+
+
+def test_window_topk_matches_forward_search(tmp_path, monkeypatch):
+    # load_data pickles its normalizer into the working directory
+    monkeypatch.chdir(tmp_path)
+    # a 30x30 synthetic grid, k large enough for near-ties to matter
+    path = generate(os.path.join(str(tmp_path), 'grid.h5'), 120, 30, 30)
+    opt = small_opt('-test_size', '24', '-precompute_topk')
+    train, _, _ = build_data(opt, path)
+    c = torch.from_numpy(np.stack([w[0] for w in train[:16]])).float()
+    for mode in ('corr', 'cos'):
+        _, searched = Adjacency()(c, mode, 20)
+        assert torch.equal(torch.from_numpy(window_topk(c.numpy(), 20, mode, 5, 100)).long(), searched)
+        _, chunked = Adjacency()(c, mode, 20, chunk_size=64)
+        assert torch.equal(chunked, searched)
+
+
+def test_precomputed_index_gives_the_same_output(tmp_path, model, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = generate(os.path.join(str(tmp_path), 'grid.h5'), 120, 6, 6)
+    opt = small_opt('-test_size', '24', '-precompute_topk')
+    train, _, _ = build_data(opt, path)
+    # (c, p, index, target) windows
+    batch = [torch.from_numpy(np.stack(x)) for x in zip(*train[:4])]
+    assert len(batch) == 4 and batch[2].dtype == torch.int32
+    with torch.no_grad():
+        with_index = forward_batch(model, batch, opt)
+        without = forward_batch(model, batch[:2] + batch[3:], opt)
+    assert torch.equal(with_index, without)
@@ -0,0 +1,40 @@
+import torch
+from torch.utils.checkpoint import checkpoint
+from stgcn_traffic_prediction.models.model import forward_batch
+from stgcn_traffic_prediction.utils.profiler import BranchProfiler
+from stgcn_traffic_prediction.utils.trainer import build_model
+from conftest import small_opt,small_batch
+
+
+def test_recompute_and_paused_calls_are_not_counted():
+    opt = small_opt()
+    torch.manual_seed(0)
+    model = build_model(opt, checkpoint=['spatial', 'p_temporal'])
+    profiler = BranchProfiler(model)
+    batch = small_batch()
+    model.train()
+    forward_batch(model, batch, opt).sum().backward()
+    calls = {name: s['calls'] for name, s in profiler.stats.items()}
+    assert calls['spatial'] == 1 and profiler.stats['spatial']['backward_calls'] == 1
+    with profiler.pause(), torch.no_grad():
+        forward_batch(model.eval(), batch, opt)
+    assert {name: s['calls'] for name, s in profiler.stats.items()} == calls
+    profiler.remove()
+
+
+class Checkpointed(torch.nn.Module):
+    "a component inside a checkpointed block, backward runs its forward again"
+    def __init__(self):
+        super(Checkpointed, self).__init__()
+        self.spatial = torch.nn.Linear(4, 4)
+
+    def forward(self, x):
+        return checkpoint(lambda x: torch.tanh(self.spatial(x)), x, use_reentrant=False)
+
+
+def test_checkpoint_recompute_is_not_a_call():
+    model = Checkpointed()
+    profiler = BranchProfiler(model)
+    model(torch.rand(2, 4, requires_grad=True)).sum().backward()
+    assert profiler.stats['spatial']['calls'] == 1
+    profiler.remove()
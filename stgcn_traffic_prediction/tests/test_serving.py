@@ -0,0 +1,101 @@
+import asyncio
+import numpy as np
+import pytest
+import torch
+from stgcn_traffic_prediction.dataloader.ordering import cell_order
+from stgcn_traffic_prediction.dataloader.store import windows
+from stgcn_traffic_prediction.models.MinMaxNorm import MinMaxNorm01
+from stgcn_traffic_prediction.models.model import forward_batch
+from stgcn_traffic_prediction.utils.serving import Histogram,Forecaster,MicroBatcher
+from stgcn_traffic_prediction.utils.trainer import build_model
+from conftest import small_opt
+
+
+def test_histogram_quantiles():
+    h = Histogram([1, 2, 4])
+    assert h.quantile(0.5) is None
+    for v in (0.5, 1, 1.5, 3):
+        h.observe(v)
+    # values on a bound land in its bucket, quantiles are capped by the largest value
+    assert h.counts.tolist() == [2, 1, 1, 0]
+    assert h.quantile(0.5) == 1 and h.quantile(0.75) == 2 and h.quantile(1) == 3
+    h.observe(10)
+    assert h.counts[-1] == 1 and h.quantile(1) == 10
+    assert h.snapshot()['buckets'][-1] == ['inf', 1]
+
+
+def _series(T=96, N=36, seed=0):
+    data = np.random.RandomState(seed).rand(T, 1, N).astype(np.float32) * 100
+    mmn = MinMaxNorm01()
+    mmn.fit(data)
+    return data, mmn
+
+
+def test_forecaster_matches_forward_batch():
+    opt = small_opt()
+    torch.manual_seed(0)
+    model = build_model(opt).eval()
+    data, mmn = _series()
+    forecaster = Forecaster(model, opt, mmn, data)
+    out = forecaster([(80, None), (73, [0, 5]), (80, [3, 35]), (96, None)])
+    batch = [torch.from_numpy(mmn.transform(x)).float() for x in windows(data, [73, 80, 96], 3, 3, 0, target=False)]
+    with torch.no_grad():
+        full = mmn.inverse_transform(torch.relu(forward_batch(model, batch + [None], opt)).numpy())
+    assert np.allclose(out[0], full[1], atol=1e-4)
+    assert np.allclose(out[1], full[0][..., [0, 5]], atol=1e-4)
+    assert np.allclose(out[2], full[1][..., [3, 35]], atol=1e-4)
+    assert np.allclose(out[3], full[2], atol=1e-4)
+
+
+def test_ordered_forecaster_answers_in_row_major_cells():
+    opt = small_opt('-spatial', 'gcn')
+    torch.manual_seed(0)
+    model = build_model(opt).eval()
+    data, mmn = _series()
+    row = Forecaster(model, opt, mmn, data)([(85, None), (85, [2, 30])])
+    model.set_order(cell_order('hilbert', 6, 6))
+    ordered = Forecaster(model, opt, mmn, data)([(85, None), (85, [2, 30])])
+    assert np.allclose(row[0], ordered[0], atol=1e-4) and np.allclose(row[1], ordered[1], atol=1e-4)
+
+
+def test_forecaster_bounds():
+    data, mmn = _series()
+    forecaster = Forecaster(build_model(small_opt()), small_opt(), mmn, data)
+    forecaster.check(72)
+    forecaster.check(96, [0, 35])
+    for hour, cells in ((71, None), (97, None), (80, [36]), (80, [-1])):
+        with pytest.raises(ValueError):
+            forecaster.check(hour, cells)
+
+
+class Recorder(object):
+    "a forecaster that records its batches and fails for hour 0"
+    first = 0
+
+    def __init__(self):
+        self.batches = []
+
+    def check(self, hour, cells=None):
+        pass
+
+    def __call__(self, requests):
+        self.batches.append(len(requests))
+        if any(h == 0 for h, _ in requests):
+            raise RuntimeError('bad batch')
+        return [h * 10 for h, _ in requests]
+
+
+def test_micro_batcher_coalesces_and_propagates_errors():
+    async def run():
+        forecaster = Recorder()
+        batcher = await MicroBatcher(forecaster, max_batch=4, max_wait_ms=200, threads=1).start()
+        assert await asyncio.gather(*[batcher.submit(h) for h in (1, 2, 3, 4)]) == [10, 20, 30, 40]
+        assert forecaster.batches == [4]
+        with pytest.raises(RuntimeError):
+            await batcher.submit(0)
+        # the failed batch gave its slot back
+        assert await asyncio.wait_for(batcher.submit(5), 5) == 50
+        await batcher.close()
+        return batcher.metrics()
+    metrics = asyncio.run(run())
+    assert (metrics['requests'], metrics['errors'], metrics['batches']) == (5, 1, 2)
@@ -0,0 +1,34 @@
+import pytest
+import torch
+from stgcn_traffic_prediction.models.model import forward_batch,forecast_cells,cell_neighbours
+from stgcn_traffic_prediction.models.utils import topk_index
+from stgcn_traffic_prediction.utils.trainer import build_model
+from conftest import small_opt,small_batch
+
+
+def test_forecast_cells_equals_full_forward_on_the_whole_grid(model, opt):
+    batch = small_batch()
+    cells = torch.tensor([0, 5, 17, 35])
+    with torch.no_grad():
+        full = forward_batch(model, batch, opt)
+        assert torch.allclose(forecast_cells(model, batch, opt, cells, context=36), full[..., cells], atol=1e-5)
+        # fewer nodes: same shape, the attention only sees the subgraph
+        assert forecast_cells(model, batch, opt, cells).shape == full[..., cells].shape
+
+
+def test_cell_neighbours_are_the_full_grid_top_k(model, opt):
+    batch = small_batch()
+    cells = torch.tensor([2, 9, 33])
+    full = topk_index(batch[0].permute((0, 2, 3, 1)), 3, opt.mode, 36)
+    assert torch.equal(cell_neighbours(model, batch, opt, cells), full[:, cells])
+
+
+def test_gcn_needs_the_full_grid():
+    opt = small_opt('-spatial', 'gcn')
+    model = build_model(opt).eval()
+    with torch.no_grad():
+        with pytest.raises(ValueError):
+            forecast_cells(model, small_batch(), opt, torch.tensor([0, 5]))
+        assert forecast_cells(model, small_batch(), opt, torch.tensor([0, 5]), context=36).shape == (2, 3, 2)
+    with pytest.raises(SystemExit):
+        small_opt('-spatial', 'gcn', '-subgraph_cells', '8')
@@ -0,0 +1,40 @@
+import torch
+from stgcn_traffic_prediction.dataloader.ordering import cell_order
+from stgcn_traffic_prediction.models.model import forward_batch
+from stgcn_traffic_prediction.utils.tiling import TiledExecutor,tiles
+from stgcn_traffic_prediction.utils.trainer import build_model
+from conftest import small_opt,small_batch
+
+
+def test_tiles_cover_every_cell_once():
+    order = cell_order('hilbert', 6, 6)
+    for o in (None, order):
+        cores = torch.cat([core for core, _ in tiles(6, 6, 4, 1, o)])
+        assert torch.equal(cores.sort().values, torch.arange(36))
+
+
+def test_one_tile_equals_the_full_forward(model, opt):
+    batch = small_batch()
+    with torch.no_grad():
+        full = forward_batch(model, batch, opt)
+        assert torch.allclose(TiledExecutor(model, opt, tile=6, halo=0, workers=0)(batch, 6, 6), full, atol=1e-5)
+
+
+def test_tiles_in_worker_processes_match_in_process(model, opt):
+    batch = small_batch()
+    with torch.no_grad():
+        local = TiledExecutor(model, opt, tile=3, halo=1, workers=0)(batch, 6, 6)
+    with TiledExecutor(model, opt, tile=3, halo=1, workers=1) as executor:
+        assert torch.allclose(executor(batch, 6, 6), local, atol=1e-6)
+
+
+def test_tiling_in_cell_order():
+    opt = small_opt('-spatial', 'gcn')
+    torch.manual_seed(0)
+    model = build_model(opt).eval()
+    order = cell_order('hilbert', 6, 6)
+    model.set_order(order)
+    batch = [x[..., order] for x in small_batch()]
+    with torch.no_grad():
+        full = forward_batch(model, batch, opt)
+        assert torch.allclose(TiledExecutor(model, opt, tile=6, halo=0, workers=0)(batch, 6, 6), full, atol=1e-5)
@@ -0,0 +1,21 @@
+import torch
+from torch.utils.data import DataLoader
+from stgcn_traffic_prediction.utils.lr_scheduler import LR_Scheduler
+from stgcn_traffic_prediction.utils.trainer import Trainer
+from conftest import small_opt,small_batch
+
+
+def test_accumulated_gradients_are_means_over_their_group(model):
+    opt = small_opt('-lr', '0.01', '-warmup', '0')
+    c, p, y = small_batch(bs=5)
+    trainer = Trainer(opt, model, DataLoader(list(zip(c, p, y)), 1), accum_steps=2, device=torch.device('cpu'))
+    trainer.scheduler = LR_Scheduler(opt.lr_scheduler, trainer.lr, 1, 3)
+    w = next(model.parameters())
+    # every batch has a loss of sum(w), so each optimizer step must see a gradient of one
+    trainer.loss = lambda batch, subsample: w.sum()
+    grads = []
+    step = trainer.optimizer.step
+    trainer.optimizer.step = lambda: (grads.append(w.grad.clone()), step())
+    trainer.train_epoch(0)
+    assert len(grads) == 3
+    assert all(torch.allclose(g, torch.ones_like(g)) for g in grads)
@@ -0,0 +1,82 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+
+from stgcn_traffic_prediction.dataloader.store import open_store,first_target,windows
+from stgcn_traffic_prediction.dataloader.ordering import inverse
+from stgcn_traffic_prediction.models.model import forward_batch,select_target
+from stgcn_traffic_prediction.utils.metrics import StreamingMetrics
+from stgcn_traffic_prediction.utils.trainer import load_model,load_mmn
+
+
+def cutoffs(length, opt, horizon, stride, start=None, end=None):
+    '''
+    rolling forecast origins: every cutoff scores the `horizon` hours after it,
+    origins move by `stride` hours from `start` (default: the first hour with a
+    full window) until the last horizon that fits before `end`. Raises a
+    ValueError when not one horizon fits
+    '''
+    first = first_target(opt.close_size, opt.period_size, opt.trend_size)
+    last = min(end or length, length - opt.close_size)
+    origins = list(range(max(start or first, first), last - horizon + 1, stride))
+    if not origins:
+        raise ValueError('no backtest window of {} hours between hour {} (start) and {} (end) of {} hours'.format(
+            horizon, max(start or first, first), last, length))
+    return origins
+
+
+_worker = {}
+
+
+def _init(opt, model_file, store, threads):
+    torch.set_num_threads(threads)
+    data = open_store(store)
+    _worker.update(opt=opt, data=data, mmn=load_mmn(model_file, data, opt.test_size),
+                   model=load_model(opt, model_file).eval())
+
+
+def _evaluate(cutoff, horizon, batch_size):
+    opt, data, model, mmn = _worker['opt'], _worker['data'], _worker['model'], _worker['mmn']
+    metrics = StreamingMetrics(mmn)
+    targets = np.arange(cutoff, cutoff + horizon)
+    with torch.inference_mode():
+        for i in range(0, horizon, batch_size):
+            batch = [torch.from_numpy(mmn.transform(x)) for x in
+                     windows(data, targets[i:i + batch_size], opt.close_size, opt.period_size, opt.trend_size)]
+            if model.order is None:
+                pred = torch.relu(forward_batch(model, batch, opt)).float()
+            else:
+                # the store is row-major, the model sees its own cell order
+                pred = torch.relu(forward_batch(model, [x[..., model.order] for x in batch], opt)).float()
+                pred = pred[..., inverse(model.order)]
+            metrics.update(pred, select_target(batch[-1], opt).float(), targets[i:i + batch_size])
+    return cutoff, metrics
+
+
+def backtest(opt, model_file, store, origins, horizon, workers=1, threads=1, batch_size=32):
+    '''
+    score a checkpoint on every window [cutoff, cutoff + horizon) in a process
+    pool. Workers memory-map the store, so the series is shared through the
+    page cache instead of copied per process; every worker holds its own copy
+    of the weights.
+    returns per-window metrics (normalized and real units), the pooled overall
+    metrics and their per-hour-of-day and per-cell breakdowns
+    '''
+    if not origins:
+        raise ValueError('backtest needs at least one cutoff, see cutoffs()')
+    rows, total = [], None
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'), initializer=_init,
+                             initargs=(opt, model_file, store, threads)) as pool:
+        futures = [pool.submit(_evaluate, c, horizon, batch_size) for c in origins]
+        for future in futures:
+            cutoff, metrics = future.result()
+            total = metrics if total is None else total.merge(metrics)
+            row = {'cutoff': cutoff, 'hours': horizon}
+            row.update(metrics.result())
+            rows.append(row)
+    overall = {'windows': len(rows), 'hours': len(rows) * horizon}
+    overall.update(total.result())
+    return {'windows': rows, 'overall': overall,
+            'per_hour': {k: v.tolist() for k, v in total.per_hour().items()},
+            'per_cell': {k: v.tolist() for k, v in total.per_cell().items()}}
@@ -0,0 +1,83 @@
+import os
+import pickle
+import random
+import threading
+import numpy as np
+import torch
+
+
+def rng_state():
+    "torch, cuda, numpy and python RNG states as tensors/builtins (loadable with weights_only)"
+    np_state = np.random.get_state()
+    return {'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+            'numpy': [np_state[0], torch.from_numpy(np_state[1].astype(np.int64)), np_state[2], np_state[3],
+                      np_state[4]],
+            'python': random.getstate()}
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    name, keys, pos, has_gauss, cached = state['numpy']
+    np.random.set_state((name, keys.numpy().astype(np.uint32), pos, has_gauss, cached))
+    random.setstate(state['python'])
+
+
+def _snapshot(obj):
+    "detached CPU copies of every tensor, so training can go on while the copy is written"
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: _snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(v) for v in obj)
+    return obj
+
+
+class AsyncCheckpointer(object):
+    """Write checkpoints on a background thread
+
+    :meth:`save` copies the state to host memory and returns, the file is
+    written to ``path + '.tmp'`` and renamed, so a crash never leaves a
+    truncated checkpoint. At most one write is in flight, a new save waits for
+    the previous one.
+    """
+    def __init__(self):
+        self.thread = None
+        self.error = None
+
+    def _write(self, state, path):
+        try:
+            torch.save(state, path + '.tmp')
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            self.error = e
+
+    def save(self, state, path):
+        self.wait()
+        state = _snapshot(state)
+        self.thread = threading.Thread(target=self._write, args=(state, path), daemon=True)
+        self.thread.start()
+
+    def wait(self):
+        "block until the pending write is on disk, re-raising its error"
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+def load_checkpoint(path, map_location='cpu', mmap=True):
+    '''
+    load a checkpoint memory-mapped: tensors are paged in from the file when
+    first touched instead of being read up front. Whole-model pickles written
+    before state_dict checkpoints are loaded the old way.
+    '''
+    try:
+        return torch.load(path, map_location=map_location, mmap=mmap, weights_only=True)
+    except pickle.UnpicklingError:
+        return torch.load(path, map_location=map_location, weights_only=False)
@@ -0,0 +1,77 @@
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='gloo', init_method=None, rank=None, world_size=None):
+    '''
+    join the process group torchrun describes through RANK/WORLD_SIZE/MASTER_ADDR
+    (or the explicit arguments) and return (rank, world_size); (0, 1) when the
+    process was started on its own
+    '''
+    if world_size is None:
+        world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size <= 1:
+        return 0, 1
+    if not dist.is_initialized():
+        if rank is None:
+            dist.init_process_group(backend, init_method=init_method)
+        else:
+            dist.init_process_group(backend, init_method=init_method, rank=rank, world_size=world_size)
+    if 'OMP_NUM_THREADS' not in os.environ:
+        # split the cores of this machine between its ranks instead of oversubscribing them
+        local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return dist.get_rank(), dist.get_world_size()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main():
+    return get_rank() == 0
+
+
+def local_device(backend):
+    "cuda:LOCAL_RANK for nccl, the CPU for gloo"
+    if backend == 'nccl':
+        return torch.device('cuda', int(os.environ.get('LOCAL_RANK', 0)))
+    return torch.device('cpu')
+
+
+def all_reduce_sum(*values):
+    "sum python numbers over all ranks, returned unchanged when not distributed"
+    if not is_distributed():
+        return values if len(values) > 1 else values[0]
+    t = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(t)
+    t = t.tolist()
+    return tuple(t) if len(t) > 1 else t[0]
+
+
+def broadcast_object(obj, src=0):
+    "the (picklable) obj of rank src on every rank, returned unchanged when not distributed"
+    if not is_distributed():
+        return obj
+    box = [obj]
+    dist.broadcast_object_list(box, src)
+    return box[0]
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
@@ -53,6 +53,12 @@ class LR_Scheduler(object):
         assert lr >= 0
         self._adjust_learning_rate(optimizer, lr)
  
+    def state_dict(self):
+        return dict(self.__dict__)
+
+    def load_state_dict(self, state):
+        self.__dict__.update(state)
+
     def _adjust_learning_rate(self, optimizer, lr):
         if len(optimizer.param_groups) == 1:
             optimizer.param_groups[0]['lr'] = lr
@@ -0,0 +1,116 @@
+import time
+import resource
+import linecache
+import tracemalloc
+import contextlib
+
+
+def peak_rss_mb():
+    "peak resident set size of this process so far (since the last reset_peak_rss)"
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def reset_peak_rss():
+    "restart the peak at the current RSS (Linux), so import-time peaks do not hide the measured one"
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+
+
+def rss_mb():
+    "current resident set size (Linux), the base to measure a new peak against"
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+class MemoryProfiler(object):
+    """Peak RSS and tracemalloc allocation sites of named stages
+
+    Every :meth:`stage` records the RSS before/after and its peak, the peak
+    of the memory traced by tracemalloc (numpy arrays and python objects,
+    not torch tensors) and the source lines whose allocations grew the most
+    during the stage. Sites come from snapshots at the start and end of the
+    stage, so they rank the memory a line still holds when the stage ends:
+    temporaries freed inside the stage count towards its peaks but not
+    towards any site.
+    tracemalloc slows allocation-heavy code down, so this is a diagnostic
+    mode; :meth:`stop` ends tracing.
+
+    Args:
+        frames: traceback depth tracemalloc keeps per allocation
+        top: allocation sites kept per stage
+    """
+    def __init__(self, frames=1, top=10):
+        self.top = top
+        self.stages = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        traced, _ = tracemalloc.get_traced_memory()
+        reset_peak_rss()
+        rss = rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = peak_rss_mb()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            # leave out the snapshots themselves
+            ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            after, before = after.filter_traces(ignore), before.filter_traces(ignore)
+            sites = []
+            for diff in after.compare_to(before, 'lineno')[:self.top]:
+                if diff.size_diff <= 0:
+                    continue
+                frame = diff.traceback[0]
+                sites.append({'site': '{}:{}'.format(frame.filename, frame.lineno),
+                              'code': linecache.getline(frame.filename, frame.lineno).strip(),
+                              'mb': diff.size_diff / 2**20, 'count': diff.count_diff})
+            self.stages.append({'stage': name, 'time_s': elapsed, 'rss_before_mb': rss, 'rss_after_mb': rss_mb(),
+                                'rss_peak_mb': peak - rss, 'traced_peak_mb': (traced_peak - traced) / 2**20,
+                                'sites': sites})
+
+    def stage_table(self):
+        "one line per stage in the order they ran"
+        lines = ['{:<26} {:>8} {:>12} {:>12} {:>15} {:>15}'.format(
+            'stage', 'time(s)', 'rss(MB)', 'rss+(MB)', 'rss peak+(MB)', 'traced peak(MB)')]
+        for s in self.stages:
+            lines.append('{:<26} {:>8.2f} {:>12.1f} {:>12.1f} {:>15.1f} {:>15.1f}'.format(
+                s['stage'], s['time_s'], s['rss_after_mb'], s['rss_after_mb'] - s['rss_before_mb'],
+                s['rss_peak_mb'], s['traced_peak_mb']))
+        return '\n'.join(lines)
+
+    def table(self, limit=20):
+        '''
+        allocation sites of every stage ranked by the memory they still held at
+        its end (not at its peak, see the stage table for that)
+        '''
+        sites = sorted(((site, s['stage']) for s in self.stages for site in s['sites']), key=lambda x: -x[0]['mb'])
+        lines = ['{:>10} {:>9}  {:<26} {}'.format('held(MB)', 'blocks', 'stage', 'site')]
+        for site, stage in sites[:limit]:
+            lines.append('{:>10.1f} {:>9d}  {:<26} {}  {}'.format(site['mb'], site['count'], stage, site['site'],
+                                                                 site['code']))
+        return '\n'.join(lines)
+
+    def stop(self):
+        tracemalloc.stop()
+
+
+def profiled(profiler, name):
+    "profiler.stage(name), or nothing when there is no profiler"
+    return profiler.stage(name) if profiler is not None else contextlib.nullcontext()
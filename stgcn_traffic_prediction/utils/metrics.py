@@ -10,4 +10,74 @@ def getmetrics(pred,truth):
     nrmse = rmse/np.mean(truth)
     r2 = metrics.r2_score(truth,pred)
  
-    return mae,mse,rmse,nrmse,r2 
\ No newline at end of file
+    return mae,mse,rmse,nrmse,r2 
+
+
+def _summary(stats, lo=0., scale=1., prefix=''):
+    "getmetrics from summed [n, |e|, e^2, y, y^2] (any trailing shape), in units x*scale+lo"
+    n, abs_err, sq_err, s, s2 = stats
+    abs_err, sq_err = abs_err * scale, sq_err * scale ** 2
+    s2 = s2 * scale ** 2 + 2 * scale * lo * s + n * lo ** 2
+    s = s * scale + n * lo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mse = sq_err / n
+        mean = s / n
+        return {prefix + 'mae': abs_err / n, prefix + 'mse': mse, prefix + 'rmse': mse ** 0.5,
+                prefix + 'nrmse': mse ** 0.5 / mean, prefix + 'r2': 1 - sq_err / (s2 - n * mean ** 2)}
+
+
+class StreamingMetrics(object):
+    """MAE/MSE/RMSE/NRMSE/R2 updated batch by batch
+
+    Only sums of n, |e|, e^2, y and y^2 are kept, per cell and per hour of the
+    day, so memory does not grow with the number of predictions. Real-unit
+    metrics follow exactly from the normalized sums because MinMaxNorm01 is
+    affine. Values match getmetrics on the concatenated arrays.
+
+    Args:
+        mmn: the MinMaxNorm01 of the data, None for normalized metrics only
+        period: hours per day of the per-hour breakdown
+    """
+    def __init__(self, mmn=None, period=24):
+        self.mmn = mmn
+        self.period = period
+        self.cells = None
+        self.hours = np.zeros((5, period))
+
+    def update(self, pred, truth, hours=None):
+        '''
+        pred/truth: bs*closeness*[nb_flow*]N arrays or tensors,
+        hours: index of the hour of pred[:, 0] for each sample, for the per-hour breakdown
+        '''
+        pred = torch.as_tensor(pred).double()
+        truth = torch.as_tensor(truth, device=pred.device).double()
+        err = pred - truth
+        stats = torch.stack([torch.ones_like(err), err.abs(), err ** 2, truth, truth ** 2])
+        cells = stats.flatten(1, -2).sum(1).cpu().numpy()
+        self.cells = cells if self.cells is None else self.cells + cells
+        if hours is not None:
+            steps = stats.flatten(3).sum(-1).cpu().numpy()
+            idx = (np.asarray(hours)[:, None] + np.arange(steps.shape[-1])) % self.period
+            for i in range(5):
+                np.add.at(self.hours[i], idx.ravel(), steps[i].ravel())
+
+    def merge(self, other):
+        "add the sums of another accumulator, e.g. from another process"
+        self.cells = other.cells if self.cells is None else self.cells + other.cells
+        self.hours = self.hours + other.hours
+        return self
+
+    def _report(self, stats):
+        out = _summary(stats)
+        if self.mmn is not None:
+            out.update(_summary(stats, float(self.mmn.min), float(self.mmn.max - self.mmn.min), 'real_'))
+        return out
+
+    def result(self):
+        return {k: float(v) for k, v in self._report(self.cells.sum(-1)).items()}
+
+    def per_cell(self):
+        return self._report(self.cells)
+
+    def per_hour(self):
+        return self._report(self.hours)
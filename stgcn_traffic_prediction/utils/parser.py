@@ -1,5 +1,5 @@
 import argparse
-def getparse():
+def getparse(args=""):
     parse = argparse.ArgumentParser()
     parse.add_argument('-height', type=int, default=100)
     parse.add_argument('-width', type=int, default=100)
@@ -15,15 +15,18 @@ def getparse():
     parse.add_argument('-s_model_d',type=int,default=64)
     parse.add_argument('-model_N',type=int,default=6)
     parse.add_argument('-k',type=int,default=20)
-    parse.add_argument('-spatial',type=str,choices=['gcn','transformer'],help='choose the spatial model type',default='transformer')
+    parse.add_argument('-spatial',type=str,choices=['gcn','dgcn','transformer'],help="choose the spatial model type ('dgcn': GCN over the top-k correlation graph)",default='transformer')
     parse.add_argument('-mode',type=str,default='corr',choices=['cos','corr'],help='choose the way to get adj metrix') 
     parse.add_argument('-c',action='store_true')
     parse.add_argument('-s',action='store_true')
     parse.add_argument('-FS',action='store_true')
     parse.add_argument('-nb_flow', type=int, default=1)
     parse.add_argument('-flow',type=int,choices=[0,1],default=0,help='in--0,out--1')
+    parse.add_argument('-multi_flow',action='store_true',help='predict all nb_flow flows in one pass')
     parse.add_argument('-c_t',type=str,default='p',choices=['t','p','tp','c','r'])
     parse.add_argument('-s_t',type=str,default='c',choices=['t','p','tp','c','r'])
+    parse.add_argument('-checkpoint',nargs='*',default=[],choices=['spatial','c_temporal','p_temporal','spatial_f'],help='branches that recompute encoder/decoder activations in backward')
+    parse.add_argument('-node_chunk',type=int,default=None,help='process top-k and node attention this many nodes at a time')
     #training
     parse.add_argument('-train', dest='train', action='store_true')
     parse.add_argument('-no-train', dest='train', action='store_false')
@@ -33,6 +36,11 @@ def getparse():
     parse.add_argument('-loss', type=str, default='l2', help='l1 | l2')
     parse.add_argument('-lr', type=float)
     parse.add_argument('-batch_size', type=int, default=64, help='batch size')
+    parse.add_argument('-order',type=str,default='row',choices=['row','zorder','hilbert'],help='cell order along the node axis, space-filling curves keep neighbours close in memory')
+    parse.add_argument('-precompute_topk',action='store_true',help='compute every window\'s top-k neighbour index once when loading the data instead of in every forward')
+    parse.add_argument('-subgraph_cells',type=int,default=None,help='train each step on this many random cells and their top-k neighbours only (evaluation scores the full grid)')
+    parse.add_argument('-accum_steps', type=int, default=1, help='batches accumulated per optimizer step')
+    parse.add_argument('-dist_backend', type=str, default='gloo', choices=['gloo', 'nccl'], help='torch.distributed backend when launched with torchrun')
     parse.add_argument('-se',type=int)
     parse.add_argument('-epoch_size', type=int, default=500, help='epochs')
     parse.add_argument('-test_row', type=int, default=51, help='test row')
@@ -48,5 +56,48 @@ def getparse():
 
     parse.add_argument('-warmup',type=int,default=100)
     parse.add_argument('-test_batch_size',type=int,default=1)
+    #telemetry
+    parse.add_argument('-telemetry_every',type=int,default=50,help='record step timings to <model>.metrics.jsonl every n steps, 0 disables')
+    parse.add_argument('-grad_stats_every',type=int,default=0,help='record weight/gradient statistics every n optimizer steps, 0 disables')
+    parse.add_argument('-profile',action='store_true',help='per-epoch time/memory breakdown of the adjacency step, branches and fusions')
+    parse.add_argument('-profile_trace',type=str,default=None,help='also write per-call events of -profile as a Chrome trace to this file')
+    parse.add_argument('-profile_memory',action='store_true',help='peak RSS and allocation sites of preprocessing, peak memory of every branch in training')
+    #quantization
+    parse.add_argument('-quant_batches',type=int,default=None,help='test batches used to validate the int8 model (default: all)')
+    #pruning
+    parse.add_argument('-target_latency',type=float,default=100.,help='latency budget (ms) for the forward of one validation batch')
+    parse.add_argument('-prune_batches',type=int,default=4,help='validation batches used to score heads/layers')
+    parse.add_argument('-prune_step',type=int,default=1,help='units removed per scoring round')
+    parse.add_argument('-prune_epochs',type=int,default=1,help='fine-tuning epochs after pruning')
+    #backtesting
+    parse.add_argument('-backtest_horizon',type=int,default=None,help='hours scored after every cutoff (default: test_size)')
+    parse.add_argument('-backtest_stride',type=int,default=24,help='hours between consecutive cutoffs')
+    parse.add_argument('-backtest_start',type=int,default=None,help='first cutoff hour (default: first full window)')
+    parse.add_argument('-backtest_end',type=int,default=None,help='no window past this hour')
+    parse.add_argument('-workers',type=int,default=4,help='evaluation/trial processes')
+    parse.add_argument('-worker_threads',type=int,default=1,help='torch threads per evaluation/trial process')
+    #sweep
+    parse.add_argument('-space',type=str,default='space.json',help='JSON search space {option: [values]}')
+    parse.add_argument('-search',type=str,default='grid',choices=['grid','random'])
+    parse.add_argument('-trials',type=int,default=None,help='random draws, or the first n grid points')
+    parse.add_argument('-grace_epochs',type=int,default=2,help='epochs before a poor trial can be stopped, 0 disables')
+    #serving
+    parse.add_argument('-host',type=str,default='127.0.0.1')
+    parse.add_argument('-port',type=int,default=8080)
+    parse.add_argument('-serve_model',type=str,default=None,help='exported model to serve, e.g. <model>.int8.model (default: the best checkpoint)')
+    parse.add_argument('-max_batch',type=int,default=32,help='forecast requests coalesced into one batch')
+    parse.add_argument('-max_wait_ms',type=float,default=5.,help='longest a request waits for others to join its batch')
+    parse.add_argument('-serve_threads',type=int,default=1,help='batches running at once, each with its own model replica')
 
-    return parse.parse_args("")
+    opt = parse.parse_args(args)
+    if opt.subgraph_cells and opt.spatial == 'gcn':
+        parse.error('-subgraph_cells needs a top-k spatial model, -spatial gcn convolves over the grid of all cells')
+    return opt
+
+def get_model_filename(opt):
+    # row-major single-flow runs keep the names of checkpoints written before -order and -multi_flow
+    order = getattr(opt,'order','row')
+    return '{}/flow={}-close={}-period={}-trend={}-spatial={}-mode={}-c={}-s={}-FS={}-model_N={}-scptmodel_d={}-{}-{}-{}{}{}'.format(
+                    opt.save_dir, opt.flow, opt.close_size,opt.period_size,opt.trend_size,opt.spatial,opt.mode,opt.c,opt.s,opt.FS,opt.model_N,
+                    opt.s_model_d,opt.c_model_d,opt.p_model_d,opt.t_model_d,'' if order == 'row' else '-order='+order,
+                    '-multi_flow' if getattr(opt,'multi_flow',False) else '')
@@ -0,0 +1,184 @@
+import json
+import time
+import contextlib
+import torch
+
+from stgcn_traffic_prediction.utils.memory import peak_rss_mb,reset_peak_rss,rss_mb
+
+COMPONENTS = ('adjacency', 'spatial', 'c_temporal', 'p_temporal', 'temporal_fusion', 'spatial_f', 'fusion')
+
+
+class BranchProfiler(object):
+    """Per-component profile of T_STGCN from forward/backward hooks
+
+    For the adjacency/top-k step, every branch and the fusions it aggregates
+    forward and backward wall time, calls, the memory autograd keeps for
+    backward (saved_mb) and, on cuda, the allocation growth (alloc_mb).
+    The network inputs need no gradient, so a component's backward is timed
+    from its output gradient to the last gradient accumulated into its
+    parameters.
+    With memory=True it also keeps the peak tensor memory of every component:
+    in forward the allocator peak (cuda) or RSS peak (cpu) above the memory
+    at its start, in backward the largest growth sampled whenever a gradient
+    is accumulated into its parameters. Backward has no hook between those
+    points, so its peak is a lower bound: intermediates freed before the
+    next accumulation are missed.
+    Nothing is hooked unless a profiler is attached, so the disabled cost is
+    zero; :meth:`remove` detaches it. Calls under :meth:`pause` (e.g.
+    validation) and forwards that activation checkpointing recomputes during
+    backward are not counted.
+
+    Args:
+        model: the T_STGCN (not a DDP wrapper)
+        trace: keep per-call events for :meth:`export_chrome_trace`
+        max_events: trace events kept, later calls are only aggregated
+        memory: record the forward/backward peak memory of each component
+    """
+    def __init__(self, model, trace=False, max_events=100000, memory=False):
+        self.cuda = next(model.parameters()).is_cuda
+        self.trace = trace
+        self.memory = memory
+        self.max_events = max_events
+        self.events = []
+        self.paused = False
+        self.origin = time.perf_counter()
+        self.handles = []
+        self.reset()
+        for name in COMPONENTS:
+            m = getattr(model, name, None)
+            if m is None:
+                continue
+            self.handles += [m.register_forward_pre_hook(self._forward_pre(name)),
+                             m.register_forward_hook(self._forward(name)),
+                             m.register_full_backward_pre_hook(self._backward_pre(name))]
+            self.handles += [p.register_post_accumulate_grad_hook(self._accumulated(name)) for p in m.parameters()]
+
+    def reset(self):
+        self.stats = {name: {'calls': 0, 'forward_s': 0., 'backward_calls': 0, 'backward_s': 0., 'saved_mb': 0.,
+                             'alloc_mb': 0., 'peak_mb': 0., 'backward_peak_mb': 0.} for name in COMPONENTS}
+        self._open = {}
+        self._backward_open = {}
+
+    @contextlib.contextmanager
+    def pause(self):
+        "leave the calls made inside out of the profile"
+        paused, self.paused = self.paused, True
+        try:
+            yield
+        finally:
+            self.paused = paused
+
+    def _skip(self):
+        # a forward inside a backward pass is a checkpoint recompute
+        return self.paused or torch._C._current_graph_task_id() != -1
+
+    def _now(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _allocated(self):
+        return torch.cuda.memory_allocated() / 2**20 if self.cuda else rss_mb()
+
+    def _reset_peak(self):
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            reset_peak_rss()
+        return self._allocated()
+
+    def _peak(self):
+        return torch.cuda.max_memory_allocated() / 2**20 if self.cuda else peak_rss_mb()
+
+    def _event(self, name, phase, start, end):
+        if self.trace and len(self.events) < self.max_events:
+            self.events.append({'name': name, 'cat': phase, 'ph': 'X', 'pid': 0, 'tid': 0 if phase == 'forward' else 1,
+                                'ts': 1e6 * (start - self.origin), 'dur': 1e6 * (end - start)})
+
+    def _forward_pre(self, name):
+        def hook(module, args):
+            if self._skip():
+                return
+            saved = [0]
+            def pack(t):
+                saved[0] += t.numel() * t.element_size()
+                return t
+            ctx = torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t)
+            ctx.__enter__()
+            alloc = torch.cuda.memory_allocated() if self.cuda else 0
+            base = self._reset_peak() if self.memory else 0.
+            self._open[name] = (ctx, saved, alloc, base, self._now())
+        return hook
+
+    def _forward(self, name):
+        def hook(module, args, output):
+            if name not in self._open:
+                return
+            end = self._now()
+            ctx, saved, alloc, base, start = self._open.pop(name)
+            ctx.__exit__(None, None, None)
+            s = self.stats[name]
+            if self.memory:
+                s['peak_mb'] = max(s['peak_mb'], self._peak() - base)
+            s['calls'] += 1
+            s['forward_s'] += end - start
+            s['saved_mb'] += saved[0] / 2**20
+            if self.cuda:
+                s['alloc_mb'] += (torch.cuda.memory_allocated() - alloc) / 2**20
+            self._event(name, 'forward', start, end)
+        return hook
+
+    def _backward_pre(self, name):
+        def hook(module, grad_output):
+            if self.paused:
+                return
+            if not self._backward_open:
+                # close every span once this backward pass is done
+                torch.autograd.Variable._execution_engine.queue_callback(self._backward_done)
+            start = self._now()
+            base = self._allocated() if self.memory else 0.
+            self._backward_open[name] = [start, start, base, base]
+        return hook
+
+    def _accumulated(self, name):
+        def hook(param):
+            if name in self._backward_open:
+                span = self._backward_open[name]
+                span[1] = self._now()
+                if self.memory:
+                    span[3] = max(span[3], self._allocated())
+        return hook
+
+    def _backward_done(self):
+        for name, (start, end, base, peak) in self._backward_open.items():
+            s = self.stats[name]
+            s['backward_calls'] += 1
+            s['backward_s'] += end - start
+            s['backward_peak_mb'] = max(s['backward_peak_mb'], peak - base)
+            self._event(name, 'backward', start, end)
+        self._backward_open = {}
+
+    def table(self):
+        "per-component breakdown since the last reset, slowest first"
+        total = sum(s['forward_s'] + s['backward_s'] for s in self.stats.values()) or 1.
+        lines = ['{:<16} {:>7} {:>12} {:>13} {:>7} {:>11} {:>11}'.format(
+            'component', 'calls', 'forward(ms)', 'backward(ms)', 'share', 'saved(MB)', 'alloc(MB)')
+                 + (' {:>14} {:>14}'.format('fwd peak(MB)', 'bwd peak>=(MB)') if self.memory else '')]
+        for name, s in sorted(self.stats.items(), key=lambda x: -(x[1]['forward_s'] + x[1]['backward_s'])):
+            if s['calls'] == 0:
+                continue
+            lines.append('{:<16} {:>7d} {:>12.2f} {:>13.2f} {:>6.1f}% {:>11.2f} {:>11.2f}'.format(
+                name, s['calls'], 1000 * s['forward_s'], 1000 * s['backward_s'],
+                100 * (s['forward_s'] + s['backward_s']) / total, s['saved_mb'], s['alloc_mb'])
+                + (' {:>14.2f} {:>14.2f}'.format(s['peak_mb'], s['backward_peak_mb']) if self.memory else ''))
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, path):
+        "per-call events for chrome://tracing or Perfetto"
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events}, f)
+
+    def remove(self):
+        for h in self.handles:
+            h.remove()
+        self.handles = []
@@ -0,0 +1,332 @@
+import json
+import time
+import copy
+import queue
+import asyncio
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+from stgcn_traffic_prediction.dataloader.store import first_target,windows
+from stgcn_traffic_prediction.dataloader.ordering import inverse
+from stgcn_traffic_prediction.models.model import forward_batch
+
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+
+class Histogram(object):
+    """Fixed-bucket histogram, cheap enough to observe on every request
+
+    Args:
+        bounds: increasing bucket upper bounds, default 0.05 ms to ~100 s in
+          sqrt(2) steps; values above the last bound land in an overflow bucket
+    """
+    def __init__(self, bounds=None):
+        self.bounds = np.array(bounds if bounds is not None else [0.05 * 2 ** (i / 2) for i in range(42)])
+        self.counts = np.zeros(len(self.bounds) + 1, dtype=np.int64)
+        self.total = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[np.searchsorted(self.bounds, value)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantile(self, q):
+        "upper bound of the bucket holding the q-quantile, at most the largest value seen"
+        if self.count == 0:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        return min(float(self.bounds[i]), self.max) if i < len(self.bounds) else self.max
+
+    def snapshot(self):
+        n = self.count
+        return {'count': n, 'mean': self.total / n if n else None, 'max': self.max,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+                'buckets': [[float(b) if i < len(self.bounds) else 'inf', int(c)]
+                            for i, (b, c) in enumerate(zip(list(self.bounds) + [None], self.counts)) if c]}
+
+
+class Forecaster(object):
+    """Forecasts of a loaded T_STGCN straight from the (memory-mapped) series
+
+    A request is a target hour (an index into the series, or a timestamp of
+    it) and optional row-major cell ids. Its window is gathered from the last
+    close/period/trend hours before it, so any hour from the first full
+    window up to one past the end of the series can be forecast. A call runs
+    the requests as one batch (one window per distinct hour) on the full grid
+    and answers every request with its cells, in real units.
+    Every thread gets its own replica of the model: the MUSE attention
+    rewrites its dy_paras inside forward, so one module must not run
+    concurrently.
+
+    Args:
+        model: a T_STGCN (with set_order if it was trained on reordered cells)
+        opt: model options (sizes, mode, flows, branches)
+        mmn: the normalizer of the checkpoint
+        data: T*nb_flow*N series in row-major cell order (dataloader.store)
+        start: timestamp of hour 0, None accepts hour indices only
+        replicas: model copies, one per thread that calls the forecaster
+    """
+    def __init__(self, model, opt, mmn, data, start=None, replicas=1):
+        self.opt = opt
+        self.mmn = mmn
+        self.data = data
+        self.start = None if start is None else datetime.strptime(start, TIME_FORMAT)
+        self.order = model.order
+        self.restore = None if model.order is None else inverse(model.order)
+        self.models = queue.Queue()
+        model = model.eval()
+        for i in range(replicas):
+            self.models.put(model if i == 0 else copy.deepcopy(model))
+        self.first = first_target(opt.close_size, opt.period_size, opt.trend_size)
+
+    @property
+    def cells(self):
+        return self.data.shape[-1]
+
+    def hour(self, timestamp):
+        "hour index of a timestamp string or an int"
+        if isinstance(timestamp, int):
+            return timestamp
+        if self.start is None:
+            raise ValueError('no timestamps for this series, pass an hour index')
+        delta = datetime.strptime(timestamp, TIME_FORMAT) - self.start
+        return int(delta.total_seconds() // 3600)
+
+    def timestamp(self, hour):
+        return str(hour) if self.start is None else (self.start + timedelta(hours=hour)).strftime(TIME_FORMAT)
+
+    def check(self, hour, cells=None):
+        "raise ValueError for a request this series cannot answer"
+        if not self.first <= hour <= len(self.data):
+            raise ValueError('hour {} outside [{}, {}]'.format(hour, self.first, len(self.data)))
+        if cells is not None and len(cells) and not (0 <= min(cells) and max(cells) < self.cells):
+            raise ValueError('cell ids must be in [0, {})'.format(self.cells))
+
+    def __call__(self, requests):
+        "forecasts of [(hour, cells or None), ...]: one close*N (close*nb_flow*N with -multi_flow) array per request"
+        hours = sorted(set(h for h, _ in requests))
+        x = windows(self.data, hours, self.opt.close_size, self.opt.period_size, self.opt.trend_size, target=False)
+        if self.order is not None:
+            x = [v[..., self.order] for v in x]
+        batch = [torch.from_numpy(np.ascontiguousarray(self.mmn.transform(v))).float() for v in x] + [None]
+        model = self.models.get()
+        try:
+            with torch.inference_mode():
+                pred = torch.relu(forward_batch(model, batch, self.opt)).float().numpy()
+        finally:
+            self.models.put(model)
+        pred = self.mmn.inverse_transform(pred)
+        if self.restore is not None:
+            pred = pred[..., self.restore]
+        row = {h: i for i, h in enumerate(hours)}
+        return [pred[row[h]] if cells is None else pred[row[h]][..., cells] for h, cells in requests]
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent forecast requests into batches on a thread pool
+
+    Requests wait in an asyncio queue. A batch closes when it holds
+    `max_batch` requests or `max_wait_ms` after its first request arrived,
+    and runs in a pool of `threads` threads under inference_mode while the
+    event loop keeps accepting requests; with every thread busy the next
+    batch keeps filling until one is free. Latency (end to end, queueing,
+    model), batch size and queue depth are kept as histograms.
+
+    Args:
+        forecaster: a :class:`Forecaster` with at least `threads` replicas
+        max_batch: requests per batch
+        max_wait_ms: longest a request waits for others to join its batch
+        threads: batches running at once
+    """
+    def __init__(self, forecaster, max_batch=32, max_wait_ms=5., threads=1):
+        self.forecaster = forecaster
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(threads)
+        self.queue = None
+        self.slots = None
+        self.task = None
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.started = time.time()
+        counts = [2 ** i for i in range(12)]
+        self.histograms = {'latency_ms': Histogram(), 'queue_ms': Histogram(), 'model_ms': Histogram(),
+                           'batch_size': Histogram(counts), 'queue_depth': Histogram([0] + counts)}
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.threads)
+        self.task = asyncio.get_running_loop().create_task(self._batches())
+        return self
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.pool.shutdown()
+
+    async def submit(self, hour, cells=None):
+        "the forecast of one request, once its batch ran"
+        self.forecaster.check(hour, cells)
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((time.perf_counter(), hour, cells, future))
+        return await future
+
+    async def _batches(self):
+        while True:
+            await self.slots.acquire()
+            items = [await self.queue.get()]
+            deadline = items[0][0] + self.max_wait
+            while len(items) < self.max_batch:
+                if not self.queue.empty():
+                    items.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.histograms['queue_depth'].observe(self.queue.qsize())
+            asyncio.get_running_loop().create_task(self._run(items))
+
+    def _forecast(self, requests):
+        start = time.perf_counter()
+        return self.forecaster(requests), start, time.perf_counter()
+
+    async def _run(self, items):
+        try:
+            outputs, start, end = await asyncio.get_running_loop().run_in_executor(
+                self.pool, self._forecast, [(hour, cells) for _, hour, cells, _ in items])
+        except Exception as e:
+            self.errors += len(items)
+            for *_, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.slots.release()
+        self.batches += 1
+        self.requests += len(items)
+        self.histograms['batch_size'].observe(len(items))
+        self.histograms['model_ms'].observe(1000 * (end - start))
+        now = time.perf_counter()
+        for (arrived, _, _, future), out in zip(items, outputs):
+            self.histograms['queue_ms'].observe(1000 * (start - arrived))
+            self.histograms['latency_ms'].observe(1000 * (now - arrived))
+            if not future.done():
+                future.set_result(out)
+
+    def metrics(self):
+        return {'uptime_s': time.time() - self.started, 'requests': self.requests, 'errors': self.errors,
+                'batches': self.batches, 'queued': self.queue.qsize() if self.queue is not None else 0,
+                'max_batch': self.max_batch, 'max_wait_ms': 1000 * self.max_wait, 'threads': self.threads,
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()}}
+
+
+async def _read_request(reader):
+    "method, path, headers and body of one HTTP/1.1 request, None at EOF"
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, path, headers, body
+
+
+def _response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode()
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'
+                 .format(status, reason, len(body), 'keep-alive' if keep_alive else 'close').encode() + body)
+
+
+class ForecastServer(object):
+    """Local HTTP/1.1 endpoint in front of a :class:`MicroBatcher`
+
+    POST /forecast {"timestamp": "2013-12-01 10:00" or an hour index, "cells": [ids] (optional)}
+      -> {"timestamp", "hours": [forecast timestamps], "cells", "forecast": close[*nb_flow]*cells}
+    GET /metrics -> request/batch counters and latency, batch size and queue depth histograms
+    GET /health -> {"status": "ok", "first", "last": forecastable hours, "cells"}
+
+    Connections are kept alive, every request on them is handled by the
+    event loop; only the batched forward leaves it.
+    """
+    def __init__(self, batcher, host='127.0.0.1', port=8080):
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        await self.batcher.start()
+        self.server = await asyncio.start_server(self._connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.close()
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', 'keep-alive').lower() != 'close'
+                status, payload = await self._handle(method, path.split('?')[0], body)
+                _response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, method, path, body):
+        if method == 'GET' and path == '/health':
+            forecaster = self.batcher.forecaster
+            return 200, {'status': 'ok', 'first': forecaster.first, 'last': len(forecaster.data),
+                         'cells': forecaster.cells, 'start': forecaster.timestamp(0)}
+        if method == 'GET' and path == '/metrics':
+            return 200, self.batcher.metrics()
+        if method != 'POST' or path != '/forecast':
+            return 404, {'error': 'no route {} {}'.format(method, path)}
+        forecaster = self.batcher.forecaster
+        try:
+            query = json.loads(body or b'{}')
+            hour = forecaster.hour(query['timestamp'])
+            cells = query.get('cells')
+            out = await self.batcher.submit(hour, cells)
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'error': '{}: {}'.format(type(e).__name__, e)}
+        except Exception as e:
+            return 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+        return 200, {'timestamp': forecaster.timestamp(hour),
+                     'hours': [forecaster.timestamp(hour + i) for i in range(len(out))],
+                     'cells': cells if cells is not None else 'all', 'forecast': out.tolist()}
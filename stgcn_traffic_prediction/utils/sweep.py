@@ -0,0 +1,118 @@
+import os
+import time
+import random
+import itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor,as_completed
+import numpy as np
+import torch
+
+from stgcn_traffic_prediction.dataloader.store import build_store,build_windows,build_topk,WindowDataset
+from stgcn_traffic_prediction.dataloader.ordering import file_order
+from stgcn_traffic_prediction.utils.parser import getparse
+from stgcn_traffic_prediction.utils.trainer import Trainer,build_loaders,build_model,close_log
+
+# options that change the windows, trials agreeing on them share one window cache
+DATA_SHAPE = ('order', 'close_size', 'period_size', 'trend_size', 'test_size')
+
+
+def trials(space, search='grid', n=None, seed=22):
+    '''
+    parameter sets of a search space {option: [values]}: the full grid (or its
+    first n points) or n uniform random draws
+    '''
+    names = sorted(space)
+    if search == 'grid':
+        grid = [dict(zip(names, values)) for values in itertools.product(*(space[k] for k in names))]
+        return grid[:n] if n else grid
+    rng = random.Random(seed)
+    return [{k: rng.choice(space[k]) for k in names} for _ in range(n or 10)]
+
+
+class MedianStopping(object):
+    """Median stopping rule
+
+    after `grace` epochs a trial stops as soon as its best validation loss is
+    worse than the median of what the other trials had reached at the same epoch.
+    `history` is a dict shared between the trial processes.
+    """
+    def __init__(self, history, trial, grace):
+        self.history = history
+        self.trial = trial
+        self.grace = grace
+
+    def __call__(self, epoch, valid_loss):
+        losses = self.history.get(self.trial, []) + [valid_loss]
+        self.history[self.trial] = losses
+        if epoch + 1 < self.grace:
+            return False
+        others = [min(h[:epoch + 1]) for t, h in self.history.items() if t != self.trial and len(h) > epoch]
+        return len(others) >= 2 and min(losses) > np.median(others)
+
+
+def run_trial(trial, params, args, path, directory, sweep_dir, threads, history, grace):
+    torch.set_num_threads(threads)
+    torch.manual_seed(22)
+    opt = getparse(args)
+    for k, v in params.items():
+        setattr(opt, k, v)
+    opt.model_filename = os.path.join(sweep_dir, 'trial-{:03d}'.format(trial))
+    result = dict(params, trial=trial)
+    start = time.time()
+    trainer = None
+    try:
+        topk = build_topk(directory, opt.k, opt.mode) if opt.precompute_topk else None
+        train_data, test_data = WindowDataset(directory, 'train', topk), WindowDataset(directory, 'test', topk)
+        train_loader, valid_loader, test_loader = build_loaders(opt, train_data, test_data)
+        model = build_model(opt)
+        model.set_order(file_order(path, opt.order))
+        trainer = Trainer(opt, model, train_loader, valid_loader, test_loader, train_data.mmn,
+                          accum_steps=opt.accum_steps)
+        trainer.fit(opt.epoch_size, MedianStopping(history, trial, grace) if grace > 0 else None)
+        result.update(epochs=trainer.start_epoch, stopped=trainer.start_epoch < opt.epoch_size,
+                      best_valid_loss=trainer.best_valid_loss)
+        if not result['stopped'] and os.path.isfile(opt.model_filename + '.model'):
+            trainer.load_best()
+            metrics, _, _ = trainer.test(cells=[])
+            result.update(real_mae=metrics['real_mae'], real_rmse=metrics['real_rmse'])
+    except Exception as e:
+        # a bad point of the space (e.g. shapes the model does not support) must not end the sweep
+        result.update(error='{}: {}'.format(type(e).__name__, e))
+    finally:
+        # worker processes run many trials, a failed one must not leave its checkpoint
+        # thread, telemetry sink or log open either
+        if trainer is not None:
+            trainer.close()
+        close_log(opt.model_filename + '.log')
+    result['time'] = time.time() - start
+    return result
+
+
+def sweep(args, space, path, sweep_dir, search='grid', n=None, workers=4, threads=1, grace=2, log=print):
+    '''
+    train every parameter set of the space in a pool of `workers` processes
+    with `threads` torch threads each; windows are built once per data shape
+    and memory-mapped by every trial. returns the results, best first
+    '''
+    base = getparse(args)
+    points = trials(space, search, n)
+    directories = {}
+    for params in points:
+        key = tuple(params.get(k, getattr(base, k)) for k in DATA_SHAPE)
+        if key not in directories:
+            directories[key] = build_windows(build_store(path, base.nb_flow, base.traffic, order=key[0]), *key[1:])
+        if base.precompute_topk:
+            # once per data shape, k and mode here, the trials only memory-map it
+            build_topk(directories[key], params.get('k', base.k), params.get('mode', base.mode))
+    os.makedirs(sweep_dir, exist_ok=True)
+    results = []
+    with mp.get_context('spawn').Manager() as manager:
+        history = manager.dict()
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn')) as pool:
+            futures = [pool.submit(run_trial, i, params, args, path,
+                                   directories[tuple(params.get(k, getattr(base, k)) for k in DATA_SHAPE)],
+                                   sweep_dir, threads, history, grace) for i, params in enumerate(points)]
+            for future in as_completed(futures):
+                results.append(future.result())
+                log('[sweep] {}/{} trials done'.format(len(results), len(points)))
+    return sorted(results, key=lambda r: r.get('best_valid_loss', float('inf')))
@@ -0,0 +1,102 @@
+import json
+import time
+import queue
+import threading
+import torch
+
+_FLUSH = object()
+
+
+class JSONLSink(object):
+    """Append records to a JSON-lines file from a background thread
+
+    :meth:`write` only enqueues, serialization and file I/O happen on the
+    writer thread, and the file is opened once with a large buffer.
+    """
+    def __init__(self, path, buffering=1 << 16):
+        self.path = path
+        self.queue = queue.Queue()
+        self.file = open(path, 'a', buffering=buffering)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                self.file.flush()
+                self.queue.task_done()
+                return
+            if record is _FLUSH:
+                self.file.flush()
+            else:
+                self.file.write(json.dumps(record) + '\n')
+            self.queue.task_done()
+
+    def write(self, record):
+        self.queue.put(record)
+
+    def flush(self):
+        "block until every queued record is on disk"
+        self.queue.put(_FLUSH)
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.file.close()
+
+
+class Telemetry(object):
+    """Sampled training metrics
+
+    Args:
+        sink: a :class:`JSONLSink`
+        every: record step timings every ``every`` training steps
+        grad_every: record per-parameter weight/gradient statistics every
+          ``grad_every`` optimizer steps, 0 disables them
+    """
+    def __init__(self, sink, every=50, grad_every=0):
+        self.sink = sink
+        self.every = every
+        self.grad_every = grad_every
+
+    def sampled(self, step):
+        return self.every > 0 and step % self.every == 0
+
+    def grads_due(self, optim_step):
+        return self.grad_every > 0 and optim_step % self.grad_every == 0
+
+    def step(self, step, epoch, batch_size, loss, lr, data_wait, forward, backward, optimizer):
+        step_time = data_wait + forward + backward + optimizer
+        self.sink.write({'type': 'step', 'time': time.time(), 'step': step, 'epoch': epoch,
+                         'loss': loss, 'lr': lr, 'step_time': step_time, 'data_wait': data_wait,
+                         'forward': forward, 'backward': backward, 'optimizer': optimizer,
+                         'samples_per_s': batch_size / step_time if step_time > 0 else None})
+
+    def epoch(self, **record):
+        record.update({'type': 'epoch', 'time': time.time()})
+        self.sink.write(record)
+
+    def grads(self, model, step):
+        "weight mean, gradient mean and gradient norm of every parameter with a gradient"
+        names, stats = [], []
+        with torch.no_grad():
+            for name, p in model.named_parameters():
+                if p.grad is not None:
+                    names.append(name)
+                    stats.append(torch.stack([p.data.mean(), p.grad.mean(), p.grad.norm()]))
+        if not stats:
+            return
+        # a single device->host copy for all parameters
+        values = torch.stack(stats).cpu().tolist()
+        self.sink.write({'type': 'grads', 'time': time.time(), 'step': step,
+                         'params': {n: {'weight_mean': v[0], 'grad_mean': v[1], 'grad_norm': v[2]}
+                                    for n, v in zip(names, values)}})
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
@@ -0,0 +1,105 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import torch
+import torch.multiprocessing  # noqa: F401, tensors travel to the workers through shared memory
+
+from stgcn_traffic_prediction.models.model import cell_neighbours,forward_nodes
+from stgcn_traffic_prediction.dataloader.ordering import inverse
+
+
+def tiles(height, width, tile, halo, order=None):
+    '''
+    cell ids of every tile x tile block of the grid and of the block grown by
+    `halo` cells on each side (clipped at the border), as row-major ids or as
+    columns of data in `order` (see ordering.py)
+    '''
+    ids = torch.arange(height * width)
+    if order is not None:
+        ids = torch.as_tensor(inverse(order))
+    ids = ids.view(height, width)
+    out = []
+    for r in range(0, height, tile):
+        for c in range(0, width, tile):
+            core = ids[r:r + tile, c:c + tile].flatten()
+            block = ids[max(r - halo, 0):r + tile + halo, max(c - halo, 0):c + tile + halo].flatten()
+            out.append((core, block))
+    return out
+
+
+def run_tile(model, batch, opt, core, block, graph=None):
+    "forward of one tile: its cells, their halo and their top-k neighbours"
+    neighbours = cell_neighbours(model, batch, opt, core, graph)
+    return forward_nodes(model, batch, opt, torch.cat([block, neighbours.flatten()]), core, graph)
+
+
+_worker = {}
+
+
+def _init(model, opt, graph, threads):
+    torch.set_num_threads(threads)
+    _worker.update(model=model.eval(), opt=opt, graph=graph)
+
+
+def _run(i, batch, core, block):
+    with torch.inference_mode():
+        return i, run_tile(_worker['model'], batch, _worker['opt'], core, block, _worker['graph'])
+
+
+class TiledExecutor(object):
+    """Full-grid T_STGCN inference as tiles in worker processes
+
+    The grid is cut into tile x tile blocks. Every block runs with a halo of
+    `halo` cells around it and the top-k neighbours of its cells, so each
+    cell gathers its full-grid neighbours, while the node attention sees the
+    tile subgraph only. The per-cell outputs are stitched back into the
+    full prediction. Memory per worker grows with the tile, not with N.
+    With a model.order (set_order) the batch and the prediction keep the
+    cells in that order.
+
+    Args:
+        model: a T_STGCN, copied once into every worker
+        opt: model options (mode, flows, branches)
+        tile: cells per tile side
+        halo: extra cells around each tile
+        workers: worker processes, 0 runs the tiles in this process
+        threads: torch threads per worker
+        graph: cached N*k top-k graph, default the per-sample top-k
+    """
+    def __init__(self, model, opt, tile=20, halo=2, workers=4, threads=1, graph=None):
+        self.model = model.eval()
+        self.opt = opt
+        self.tile = tile
+        self.halo = halo
+        self.graph = graph
+        self.pool = None
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'), initializer=_init,
+                                            initargs=(self.model, opt, graph, threads))
+
+    def __call__(self, batch, height, width):
+        "prediction of a (c,p[,t],...) batch over a height x width grid, as forward_batch returns it"
+        parts = tiles(height, width, self.tile, self.halo, self.model.order)
+        if self.pool is None:
+            with torch.inference_mode():
+                outputs = [run_tile(self.model, batch, self.opt, core, block, self.graph) for core, block in parts]
+        else:
+            batch = [x.share_memory_() for x in batch]
+            outputs = [None] * len(parts)
+            for future in [self.pool.submit(_run, i, batch, core, block) for i, (core, block) in enumerate(parts)]:
+                i, out = future.result()
+                outputs[i] = out
+        pred = torch.zeros(outputs[0].shape[:-1] + (height * width,), dtype=outputs[0].dtype)
+        for (core, _), out in zip(parts, outputs):
+            pred[..., core] = out
+        return pred
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
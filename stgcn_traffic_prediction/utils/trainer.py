@@ -0,0 +1,495 @@
+import os
+import atexit
+import math
+import time
+import numpy as np
+from contextlib import nullcontext
+from datetime import datetime
+import torch
+from torch import nn
+from torch import optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader,Subset
+from torch.utils.data.distributed import DistributedSampler
+from torch.utils.data.sampler import SubsetRandomSampler
+
+from stgcn_traffic_prediction.dataloader.milano_crop import load_data,read_h5
+from stgcn_traffic_prediction.dataloader.ordering import file_order,inverse
+from stgcn_traffic_prediction.models.model import T_STGCN,forward_batch,select_target,sample_subgraph,subgraph,\
+    split_batch,subgraph_index,model_graph
+from stgcn_traffic_prediction.models.utils import window_topk
+from stgcn_traffic_prediction.utils.lr_scheduler import LR_Scheduler
+from stgcn_traffic_prediction.utils.metrics import StreamingMetrics
+from stgcn_traffic_prediction.utils.telemetry import JSONLSink,Telemetry
+from stgcn_traffic_prediction.utils.profiler import BranchProfiler
+from stgcn_traffic_prediction.utils.memory import profiled
+from stgcn_traffic_prediction.utils.checkpoint import AsyncCheckpointer,load_checkpoint,rng_state,set_rng_state
+from stgcn_traffic_prediction.models.MinMaxNorm import MinMaxNorm01
+from stgcn_traffic_prediction.utils.distributed import get_world_size,is_main,all_reduce_sum,broadcast_object
+
+_log_files = {}
+
+
+def log(fname, s):
+    '''
+    append a timestamped line, the file is opened once and kept open until
+    close_log. It is line-buffered, every line is on disk once written
+    '''
+    f = _log_files.get(fname)
+    if f is None:
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        f = _log_files[fname] = open(fname, 'a', buffering=1)
+    f.write(str(datetime.now()) + ': ' + s + '\n')
+
+
+def close_log(fname=None):
+    "close the file log(fname) keeps open, every one when fname is None"
+    for name in list(_log_files) if fname is None else [fname]:
+        f = _log_files.pop(name, None)
+        if f is not None:
+            f.close()
+
+
+atexit.register(close_log)
+
+
+def train_valid_split(dataloader, test_size=0.2, shuffle=True, random_seed=0):
+    length = len(dataloader)
+    indices = list(range(0, length))
+
+    if shuffle:
+        np.random.seed(random_seed)
+        np.random.shuffle(indices)
+
+    if type(test_size) is float:
+        split = int(np.floor(test_size * length))
+    elif type(test_size) is int:
+        split = test_size
+    else:
+        raise ValueError('%s should be an int or float'.format(str))
+    return indices[split:], indices[:split]
+
+
+def build_data(opt, path, profiler=None):
+    '''
+    windows of the h5 file at path as (train, test) lists of (c,p[,t],target) and the normalizer.
+    with -precompute_topk every window also carries its N*k top-k index before target.
+    a MemoryProfiler records every preprocessing stage
+    '''
+    data = read_h5(path, opt.nb_flow, opt.traffic, profiler, file_order(path, getattr(opt, 'order', 'row')))
+    x_train, y_train, x_test, y_test, mmn = load_data(data, opt.traffic, opt.close_size, opt.period_size,
+                                                       opt.trend_size, opt.test_size, opt.nb_flow, profiler)
+    if getattr(opt, 'precompute_topk', False):
+        with profiled(profiler, 'top-k index'):
+            x_train.append(window_topk(x_train[0], opt.k, opt.mode, chunk_size=opt.node_chunk or 1024))
+            x_test.append(window_topk(x_test[0], opt.k, opt.mode, chunk_size=opt.node_chunk or 1024))
+    x_train.append(y_train)
+    x_test.append(y_test)
+    with profiled(profiler, 'tuple list'):
+        train_data, test_data = list(zip(*x_train)), list(zip(*x_test))
+    return train_data, test_data, mmn
+
+
+def build_loaders(opt, train_data, test_data):
+    '''
+    train/valid loaders over a 90/10 split of train_data and a sequential test
+    loader. Under torch.distributed the train and valid splits are sharded
+    over the ranks, every rank sees len(split) / world_size windows per epoch.
+    '''
+    train_idx, valid_idx = train_valid_split(train_data, 0.1)
+    if get_world_size() > 1:
+        train_loader = DataLoader(Subset(train_data, train_idx), batch_size=opt.batch_size,
+                                  sampler=DistributedSampler(Subset(train_data, train_idx), shuffle=True),
+                                  drop_last=True)
+        valid_loader = DataLoader(Subset(train_data, valid_idx), batch_size=opt.batch_size,
+                                  sampler=DistributedSampler(Subset(train_data, valid_idx), shuffle=False),
+                                  drop_last=True)
+        test_loader = DataLoader(test_data, batch_size=opt.test_batch_size, shuffle=False, drop_last=True)
+        return train_loader, valid_loader, test_loader
+    train_loader = DataLoader(train_data, batch_size=opt.batch_size, sampler=SubsetRandomSampler(train_idx),
+                              pin_memory=True, drop_last=True)
+    valid_loader = DataLoader(train_data, batch_size=opt.batch_size, sampler=SubsetRandomSampler(valid_idx),
+                              pin_memory=True, drop_last=True)
+    test_loader = DataLoader(test_data, batch_size=opt.test_batch_size, shuffle=False, drop_last=True)
+    return train_loader, valid_loader, test_loader
+
+
+def build_model(opt, external_size=6, **kwargs):
+    "T_STGCN of the options, keyword arguments (e.g. checkpoint, chunk_size) override opt"
+    kwargs.setdefault('checkpoint', opt.checkpoint)
+    kwargs.setdefault('chunk_size', opt.node_chunk)
+    return T_STGCN(opt.close_size, external_size, opt.model_N, opt.k, opt.spatial, opt.s_model_d, opt.c_model_d,
+                   opt.p_model_d, opt.t_model_d, **kwargs)
+
+
+def load_model(opt, filename, device='cpu'):
+    '''
+    the model of a checkpoint written by :meth:`Trainer.fit`, rebuilt from opt,
+    with the cell order it was trained on (set_order)
+    '''
+    saved = load_checkpoint(filename)
+    if isinstance(saved['model'], nn.Module):
+        return saved['model'].to(device)
+    model = build_model(opt)
+    model.load_state_dict(saved['model'])
+    if saved.get('order') is not None:
+        model.set_order(np.asarray(saved['order']))
+    return model.to(device)
+
+
+def load_mmn(filename, data, test_size):
+    '''
+    the normalizer stored in a checkpoint. Checkpoints written before it was
+    stored (e.g. whole-model pickles) get it refit on the T*nb_flow*N series
+    without its last test_size hours, as load_data fits it
+    '''
+    saved = load_checkpoint(filename).get('mmn')
+    mmn = MinMaxNorm01()
+    if saved is None:
+        mmn.fit(data[:-test_size])
+    else:
+        mmn.min, mmn.max = saved['min'], saved['max']
+    return mmn
+
+
+class Trainer(object):
+    """Fit/evaluate/predict T_STGCN in-process
+
+    Args:
+        opt: options from :func:`getparse`, :attr:`opt.model_filename` is the
+          checkpoint/log prefix
+        model: the T_STGCN to train
+        train_loader, valid_loader, test_loader: loaders of (c,p[,t],target)
+        mmn: the MinMaxNorm01 the data was scaled with, for real-unit metrics
+        accum_steps: batches accumulated per optimizer step, the effective
+          batch size is ``opt.batch_size * accum_steps``
+        telemetry: a :class:`Telemetry` for sampled step/epoch metrics, by
+          default one writing ``opt.model_filename + '.metrics.jsonl'`` when
+          ``opt.telemetry_every`` > 0
+
+    Checkpoints hold state_dicts of the model, optimizer and scheduler, the
+    epoch/iteration, the RNG states and the normalizer, they are written on a
+    background thread and loaded memory-mapped: ``opt.model_filename + '.model'``
+    when the validation loss improves and ``opt.model_filename + '.last.model'``
+    after every epoch, to resume from.
+
+    Inside an initialized process group the model is wrapped in
+    DistributedDataParallel, losses are averaged over the ranks and only
+    rank 0 writes checkpoints, logs and telemetry.
+    """
+    def __init__(self, opt, model, train_loader=None, valid_loader=None, test_loader=None, mmn=None,
+                 lr=None, accum_steps=1, device=None, telemetry=None):
+        self.opt = opt
+        self.device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model = model.to(self.device)
+        self.net = self._wrap(self.model)
+        self.train_loader = train_loader
+        self.valid_loader = valid_loader
+        self.test_loader = test_loader
+        self.mmn = mmn
+        self.accum_steps = accum_steps
+        if getattr(opt, 'subgraph_cells', None) and opt.spatial == 'gcn':
+            # e.g. a sweep space that combines them, getparse rejects it on the command line
+            raise ValueError('-subgraph_cells needs a top-k spatial model, -spatial gcn convolves over the grid of all cells')
+        self.lr = lr or opt.lr or 0.001
+        self.optimizer = optim.Adam(self.model.parameters(), self.lr, betas=(0.9, 0.98), eps=1e-9)
+        if opt.loss == 'l1':
+            self.criterion = nn.L1Loss()
+        elif opt.loss == 'l2':
+            self.criterion = nn.MSELoss()
+        self.start_epoch = 0
+        self.scheduler = None
+        self.scheduler_state = None
+        self.best_valid_loss = opt.best_valid_loss
+        self.train_loss, self.valid_loss = [], []
+        self.global_step = 0
+        self.optim_step = 0
+        self.checkpointer = AsyncCheckpointer()
+        if telemetry is None and is_main() and getattr(opt, 'telemetry_every', 0) > 0 and getattr(opt, 'model_filename', None):
+            telemetry = Telemetry(JSONLSink(opt.model_filename + '.metrics.jsonl'), opt.telemetry_every,
+                                  opt.grad_stats_every)
+        self.telemetry = telemetry
+        self.profiler = None
+
+    def _wrap(self, model):
+        if get_world_size() == 1:
+            return model
+        device_ids = [self.device.index] if self.device.type == 'cuda' else None
+        # MUSEAttention replaces dy_paras by a new Parameter on every call, the
+        # registered one never gets a gradient
+        return DistributedDataParallel(model, device_ids=device_ids, find_unused_parameters=True)
+
+    def state_dict(self, epoch):
+        return {'epoch': epoch, 'iteration': self.global_step, 'optim_step': self.optim_step,
+                'model': self.model.state_dict(), 'optimizer': self.optimizer.state_dict(),
+                'order': None if self.model.order is None else [int(i) for i in self.model.order],
+                'scheduler': self.scheduler.state_dict(), 'rng': rng_state(),
+                'mmn': None if self.mmn is None else {'min': float(self.mmn.min), 'max': float(self.mmn.max)},
+                'train_loss': self.train_loss, 'valid_loss': self.valid_loss,
+                'best_valid_loss': self.best_valid_loss, 'opt': vars(self.opt)}
+
+    def load_state_dict(self, state):
+        self.model.load_state_dict(state['model'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        # base lr of the schedule, the decayed one lives in the optimizer state
+        self.lr = state['scheduler']['lr']
+        self.scheduler_state = state['scheduler']
+        self.start_epoch = state['epoch'] + 1
+        self.global_step, self.optim_step = state['iteration'], state['optim_step']
+        self.train_loss, self.valid_loss = list(state['train_loss']), list(state['valid_loss'])
+        self.best_valid_loss = state['best_valid_loss']
+        if state['mmn'] is not None:
+            if self.mmn is None:
+                self.mmn = MinMaxNorm01()
+            self.mmn.min, self.mmn.max = state['mmn']['min'], state['mmn']['max']
+        set_rng_state(state['rng'])
+
+    def resume(self, filename):
+        '''
+        continue after the epoch stored in a checkpoint written by :meth:`fit`.
+        Under torch.distributed only rank 0 reads it and sends the state to the
+        other ranks, so they all start from the same epoch and weights
+        '''
+        saved = broadcast_object(load_checkpoint(filename) if is_main() else None)
+        if not isinstance(saved['model'], nn.Module):
+            self.load_state_dict(saved)
+            return
+        # whole-model pickle: no optimizer/scheduler state to restore
+        self.model = saved['model'].to(self.device)
+        self.net = self._wrap(self.model)
+        self.optimizer = optim.Adam(self.model.parameters(), self.lr, betas=(0.9, 0.98), eps=1e-9)
+        self.scheduler_state = None
+        self.start_epoch = saved['epoch'] + 1
+        self.best_valid_loss = saved['valid_loss'][-1]
+
+    def loss(self, batch, model=None, subsample=False):
+        '''
+        loss over the full grid, or with subsample and -subgraph_cells over random
+        target cells only, the model seeing just their top-k subgraph
+        '''
+        cells = getattr(self.opt, 'subgraph_cells', None)
+        if not (subsample and cells and cells < batch[0].shape[-1]):
+            cells = None
+        if cells is not None:
+            # full-grid neighbours (precomputed index or the model's graph) pick the
+            # targets' neighbours and are remapped to subgraph ids
+            x, _, target = split_batch(batch)
+            graph = model_graph(self.model, batch)
+            nodes = sample_subgraph(batch[0], self.opt.mode, self.opt.k, cells, graph)
+            batch = [subgraph(v, nodes) for v in x + [target]]
+            if graph is not None:
+                batch.insert(-1, subgraph_index(graph, batch[0], self.opt.mode, self.opt.k, nodes))
+        pred = forward_batch(self.net if model is None else model, batch, self.opt)
+        target = select_target(batch[-1].to(self.device).float(), self.opt)
+        if cells is not None:
+            return self.criterion(pred.float()[..., :cells], target[..., :cells])
+        return self.criterion(pred.float(), target)
+
+    def _clock(self, sync):
+        # cuda kernels are asynchronous, only pay for a sync on sampled steps
+        if sync and self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        return time.perf_counter()
+
+    def train_epoch(self, epoch):
+        self.model.train()
+        total_loss = 0
+        n = len(self.train_loader)
+        if isinstance(self.train_loader.sampler, DistributedSampler):
+            self.train_loader.sampler.set_epoch(epoch)
+        self.optimizer.zero_grad()
+        # the last group is short when accum_steps does not divide n
+        tail = n - n % self.accum_steps
+        end = time.perf_counter()
+        for idx, batch in enumerate(self.train_loader):
+            fetched = time.perf_counter()
+            sample = self.telemetry is not None and self.telemetry.sampled(self.global_step)
+            step = idx // self.accum_steps
+            if idx % self.accum_steps == 0:
+                self.scheduler(self.optimizer, step, epoch)
+            update = (idx + 1) % self.accum_steps == 0 or idx == n - 1
+            # accumulated micro-batches skip the gradient all-reduce
+            with self.net.no_sync() if self.net is not self.model and not update else nullcontext():
+                loss = self.loss(batch, subsample=True)
+                forward = self._clock(sample)
+                (loss / (self.accum_steps if idx < tail else n - tail)).backward()
+            backward = self._clock(sample)
+            if update:
+                if self.telemetry is not None and self.telemetry.grads_due(self.optim_step):
+                    self.telemetry.grads(self.model, self.global_step)
+                self.optimizer.step()
+                self.optimizer.zero_grad()
+                self.optim_step += 1
+            optimized = self._clock(sample)
+            # keep the running loss on device, .item() would sync every step
+            total_loss += loss.detach()
+            if sample:
+                self.telemetry.step(self.global_step, epoch, batch[0].shape[0], loss.item(),
+                                    self.optimizer.param_groups[0]['lr'], fetched - end, forward - fetched,
+                                    backward - forward, optimized - backward)
+            self.global_step += 1
+            end = optimized
+        total, count = all_reduce_sum(float(total_loss), n)
+        return total / count
+
+    def evaluate(self, loader=None):
+        "mean loss over a loader (the validation loader by default)"
+        if loader is None:
+            loader = self.valid_loader
+        self.model.eval()
+        total_loss = 0
+        # the profile covers training steps only
+        with torch.no_grad(), self.profiler.pause() if self.profiler is not None else nullcontext():
+            for batch in loader:
+                total_loss += self.loss(batch, self.model).item()
+        total_loss, count = all_reduce_sum(total_loss, len(loader))
+        return total_loss / count
+
+    def fit(self, epochs, stop=None):
+        '''
+        train for `epochs` more epochs, or until stop(epoch, valid_loss) returns
+        True. After a resume the schedule continues from the checkpoint and
+        spans start_epoch + epochs epochs
+        '''
+        total_epochs = self.start_epoch + epochs
+        memory = getattr(self.opt, 'profile_memory', False)
+        if (getattr(self.opt, 'profile', False) or memory) and self.profiler is None:
+            self.profiler = BranchProfiler(self.model, trace=self.opt.profile_trace is not None, memory=memory)
+        # len(train_loader) is already per rank, so every rank walks the same schedule
+        iters_per_epoch = math.ceil(len(self.train_loader) / self.accum_steps)
+        self.scheduler = LR_Scheduler(self.opt.lr_scheduler, self.lr, total_epochs, iters_per_epoch,
+                                      warmup_epochs=self.opt.warmup)
+        if self.scheduler_state is not None:
+            self.scheduler.load_state_dict(self.scheduler_state)
+            # the loader and the number of epochs may differ from the checkpointed run
+            self.scheduler.iters_per_epoch, self.scheduler.N = iters_per_epoch, total_epochs * iters_per_epoch
+            self.scheduler.warmup_iters = self.opt.warmup * iters_per_epoch
+            self.scheduler_state = None
+        for i in range(self.start_epoch, total_epochs):
+            start = time.perf_counter()
+            self.train_loss.append(self.train_epoch(i))
+            self.valid_loss.append(self.evaluate())
+
+            if self.valid_loss[-1] < self.best_valid_loss:
+                self.best_valid_loss = self.valid_loss[-1]
+                if is_main():
+                    self.checkpointer.save(self.state_dict(i), self.opt.model_filename + '.model')
+            if is_main():
+                self.checkpointer.save(self.state_dict(i), self.opt.model_filename + '.last.model')
+            log_string = ('iter: [{:d}/{:d}], train_loss: {:0.8f}, valid_loss: {:0.8f}, '
+                          'best_valid_loss: {:0.8f}, lr: {:0.8f}').format((i + 1), total_epochs,
+                                                                          self.train_loss[-1],
+                                                                          self.valid_loss[-1],
+                                                                          self.best_valid_loss,
+                                                                          self.optimizer.param_groups[0]['lr'])
+            if is_main():
+                print(log_string)
+                log(self.opt.model_filename + '.log', log_string)
+                if self.profiler is not None:
+                    print(self.profiler.table())
+                    log(self.opt.model_filename + '.log', '[profile]\n' + self.profiler.table())
+            if self.profiler is not None:
+                self.profiler.reset()
+            if self.telemetry is not None:
+                self.telemetry.epoch(epoch=i, train_loss=self.train_loss[-1], valid_loss=self.valid_loss[-1],
+                                     best_valid_loss=self.best_valid_loss, lr=self.optimizer.param_groups[0]['lr'],
+                                     epoch_time=time.perf_counter() - start)
+            if stop is not None and stop(i, self.valid_loss[-1]):
+                total_epochs = i + 1
+                break
+        if self.telemetry is not None:
+            self.telemetry.flush()
+        self.checkpointer.wait()
+        self.start_epoch = total_epochs
+        return self.train_loss, self.valid_loss
+
+    def close(self):
+        self.checkpointer.wait()
+        if getattr(self.opt, 'model_filename', None):
+            close_log(self.opt.model_filename + '.log')
+        if self.profiler is not None:
+            if self.opt.profile_trace is not None and is_main():
+                self.profiler.export_chrome_trace(self.opt.profile_trace)
+            self.profiler.remove()
+            self.profiler = None
+        if self.telemetry is not None:
+            self.telemetry.close()
+            self.telemetry = None
+
+    def load_best(self):
+        saved = load_checkpoint(self.opt.model_filename + '.model')
+        if isinstance(saved['model'], nn.Module):
+            self.model = saved['model'].to(self.device)
+        else:
+            self.model.load_state_dict(saved['model'])
+        self.net = self._wrap(self.model)
+        return self.model
+
+    def predict(self, loader=None):
+        '''
+        relu-clipped predictions and ground truth (normalized) of a loader
+        (the test loader by default) and the mean runtime per batch
+        '''
+        if loader is None:
+            loader = self.test_loader
+        self.model.eval()
+        predictions, ground_truth = [], []
+        t = 0
+        with torch.no_grad():
+            for batch in loader:
+                start = self._clock(True)
+                pred = torch.relu(forward_batch(self.model, batch, self.opt))
+                t += self._clock(True) - start
+                predictions.append(pred.float().cpu().numpy())
+                ground_truth.append(select_target(batch[-1].float(), self.opt).numpy())
+        predictions, ground_truth = np.concatenate(predictions), np.concatenate(ground_truth)
+        if self.model.order is not None:
+            # back to row-major cells
+            keep = inverse(self.model.order)
+            predictions, ground_truth = predictions[..., keep], ground_truth[..., keep]
+        return predictions, ground_truth, t / len(loader)
+
+    def test(self, loader=None, cells=None, first_hour=None):
+        '''
+        metrics of the relu-clipped predictions of a loader (the test loader by
+        default) in normalized and real units, logged like training. Metrics are
+        streamed batch by batch; real-unit predictions and ground truth are only
+        kept for `cells` (row-major ids, all cells when None, none for []). With first_hour (the
+        hour index of the first sample of a sequential loader) the accumulator in
+        self.metrics also holds a per-hour breakdown.
+        returns (metrics, predictions, ground truth)
+        '''
+        if loader is None:
+            loader = self.test_loader
+        self.model.eval()
+        self.metrics = StreamingMetrics(self.mmn)
+        predictions, ground_truth = [], []
+        t, seen = 0, 0
+        # cells are row-major ids, the model may see them in another order
+        keep = slice(None) if cells is None else list(cells)
+        if self.model.order is not None:
+            keep = inverse(self.model.order)[keep]
+        with torch.no_grad():
+            for batch in loader:
+                start = self._clock(True)
+                pred = torch.relu(forward_batch(self.model, batch, self.opt))
+                t += self._clock(True) - start
+                truth = select_target(batch[-1].to(self.device).float(), self.opt)
+                hours = None if first_hour is None else first_hour + seen + np.arange(len(truth))
+                self.metrics.update(pred.float(), truth, hours)
+                seen += len(truth)
+                if cells is None or len(cells):
+                    predictions.append(self.mmn.inverse_transform(pred.float()[..., keep].cpu().numpy()))
+                    ground_truth.append(self.mmn.inverse_transform(truth[..., keep].cpu().numpy()))
+        mrt = t / len(loader)
+        m = self.metrics.result()
+        b = np.concatenate(predictions) if predictions else None
+        a = np.concatenate(ground_truth) if ground_truth else None
+
+        log_string = ' [MSE]:{:0.5f}, [RMSE]:{:0.5f}, [NRMSE]: {:0.5f}, [MAE]:{:0.5f}, [R2]: {:0.5f},[mrt]:{:0.5f}\n'.format(m['mse'],m['rmse'],m['nrmse'],m['mae'],m['r2'],mrt)+' [Real MSE]:{:0.5f}, [Real RMSE]:{:0.5f}, [Real NRMSE]: {:0.5f}, [Real MAE]:{:0.5f}, [Real R2]: {:0.5f}'.format(m['real_mse'],m['real_rmse'],m['real_nrmse'],m['real_mae'],m['real_r2'])
+        print(log_string)
+        print('mean runtime:',mrt)
+        log(self.opt.model_filename + '.log', log_string)
+        m['mrt'] = mrt
+        return m, b, a